@@ -1,75 +1,39 @@
+import argparse
 import json
-import time
 import re
-import lark_oapi as lark
-from lark_oapi.api.bitable.v1 import *
-from config_loader import get_feishu_config
+from concurrent.futures import CancelledError
+from config_loader import load_config, prefetch_feishu_config, wait_for_tenant_access_token
+from feishu_bitable import create_client, iter_records, preload_feishu_sdk, write_and_record
+from feishu_executor import get_executor
+from tag_matcher import get_tag_matcher, load_compiled_tag_library
+from record_index import RecordRef
+from run_journal import open_journal
+from work_scheduler import get_deadline, get_priority, order_records
+from metrics import configure_logging, get_logger, get_metrics, write_run_summary
+
+
+logger = get_logger(__name__)
 
 
 def load_tag_library():
-    """加载标签库"""
+    """加载标签库（支持config.md/JSON/YAML，进程内缓存，文件变化时自动重新加载）"""
     try:
-        with open('/Users/daiweiwei/独立开发/makemoney/config.md', 'r', encoding='utf-8') as f:
-            content = f.read()
+        matcher = load_compiled_tag_library()
+        tag_library = matcher.tag_library
         
-        # 解析标签库
-        tag_library = {}
-        lines = content.strip().split('\n')
-        
-        for line in lines:
-            if ':' in line:
-                # 解析格式：'规模': ['中证500', '沪深300', ...]
-                category = line.split(':')[0].strip().strip("'\"")
-                tags_str = line.split(':', 1)[1].strip()
-                
-                # 提取标签列表
-                tags = []
-                if '[' in tags_str and ']' in tags_str:
-                    tags_content = tags_str[tags_str.find('[')+1:tags_str.rfind(']')]
-                    tags = [tag.strip().strip("'\"，,") for tag in tags_content.split(',') if tag.strip()]
-                
-                if tags:
-                    tag_library[category] = tags
-        
-        print(f"✅ 成功加载标签库，共 {len(tag_library)} 个分类")
+        logger.info(f"✅ 成功加载标签库，共 {len(tag_library)} 个分类 (版本: {matcher.version})")
         for category, tags in tag_library.items():
-            print(f"   {category}: {len(tags)} 个标签")
+            logger.debug(f"   {category}: {len(tags)} 个标签")
         
         return tag_library
     except Exception as e:
-        print(f"❌ 加载标签库失败: {str(e)}")
+        logger.error(f"❌ 加载标签库失败: {str(e)}")
         return {}
 
 
 def match_tags_from_fund_name(fund_name, tag_library):
-    """从基金名称中匹配标签"""
-    if not fund_name or not tag_library:
-        return [], []
-    
-    matched_tags = []
-    matched_categories = []
-    
-    # 遍历所有标签分类
-    for category, tags in tag_library.items():
-        for tag in tags:
-            # 检查基金名称中是否包含该标签
-            if tag in fund_name:
-                if tag not in matched_tags:  # 避免重复
-                    matched_tags.append(tag)
-                    matched_categories.append(category)
-                    
-                    # 最多匹配2个标签
-                    if len(matched_tags) >= 2:
-                        break
-        
-        if len(matched_tags) >= 2:
-            break
-    
-    # 确保返回2个元素的列表
-    while len(matched_tags) < 2:
-        matched_tags.append("")
-    
-    return matched_tags[:2], matched_categories[:2]
+    """从基金名称中匹配标签（长标签优先，位置不重叠，最多2个）"""
+    return get_tag_matcher(tag_library).match(fund_name)
 
 
 def match_tags_by_fund_type(fund_type, fund_name, tag_library):
@@ -91,84 +55,60 @@ def match_tags_by_fund_type(fund_type, fund_name, tag_library):
         '债券型-债券指数', '债券型-普通债券'
     ]
     
-    print(f"   🔍 基金类型: {fund_type}")
+    logger.debug(f"   🔍 基金类型: {fund_type}")
     
     # 根据基金类型确定标签
     if fund_type in money_types:
-        print(f"   💰 货币型基金，统一标签为'货币'")
+        logger.debug("   💰 货币型基金，统一标签为'货币'")
         return ['货币', ''], ['货币', '']
     
     elif fund_type in bond_types:
-        print(f"   📊 债券型基金，统一标签为'债券'")
+        logger.debug("   📊 债券型基金，统一标签为'债券'")
         return ['债券', ''], ['债券', '']
     
     elif fund_type in stock_types:
-        print(f"   📈 股票/混合型基金，使用基金名称匹配标签")
+        logger.debug("   📈 股票/混合型基金，使用基金名称匹配标签")
         return match_tags_from_fund_name(fund_name, tag_library)
     
     else:
-        print(f"   ❓ 未知基金类型，使用基金名称匹配标签")
+        logger.debug("   ❓ 未知基金类型，使用基金名称匹配标签")
         return match_tags_from_fund_name(fund_name, tag_library)
 
 
-def get_all_records(client, app_token, table_id, tenant_access_token):
-    """获取飞书表格中的所有记录"""
-    print("📋 正在获取飞书表格中的所有记录...")
+def get_all_records(client, app_token, table_id, tenant_access_token, pending_only=True):
+    """获取飞书表格中的记录
     
-    all_records = []
-    page_token = None
+    pending_only为True时由服务端筛选出标签1或标签2为空的记录，并且只返回需要用到的字段
+    （资产情况用于安排写入顺序）；每条记录以紧凑的RecordRef保存
+    """
+    logger.info("📋 正在获取飞书表格中的所有记录...")
     
-    while True:
-        try:
-            # 构建查询请求
-            request_builder = ListAppTableRecordRequest.builder() \
-                .app_token(app_token) \
-                .table_id(table_id) \
-                .page_size(500)  # 每页最多500条记录
-            
-            if page_token:
-                request_builder.page_token(page_token)
-            
-            request = request_builder.build()
-            option = lark.RequestOption.builder().tenant_access_token(tenant_access_token).build()
-            response = client.bitable.v1.app_table_record.list(request, option)
-            
-            if not response.success():
-                print(f"❌ 获取记录失败: {response.msg}")
-                break
-            
-            # 处理返回的记录
-            if response.data and response.data.items:
-                for record in response.data.items:
-                    fields = record.fields if record.fields else {}
-                    fund_name = fields.get('基金名称', '')
-                    fund_type = fields.get('基金类型', '')  # 新增获取基金类型
-                    
-                    if fund_name:  # 只处理有基金名称的记录
-                        all_records.append({
-                            'record_id': record.record_id,
-                            'fund_name': str(fund_name),
-                            'fund_type': str(fund_type),  # 新增基金类型字段
-                            'fields': fields
-                        })
-            
-            # 检查是否还有更多页
-            if not response.data.has_more:
-                break
-            
-            page_token = response.data.page_token
-            time.sleep(0.1)  # 避免API限制
-            
-        except Exception as e:
-            print(f"❌ 获取记录时出错: {str(e)}")
-            break
+    filter_formula = None
+    field_names = None
+    if pending_only:
+        filter_formula = 'OR(CurrentValue.[标签1]="",CurrentValue.[标签2]="")'
+        field_names = ['基金名称', '基金类型', '标签1', '标签2', '资产情况']
+    
+    all_records = []
+    for record in iter_records(client, app_token, table_id, tenant_access_token, filter_formula, field_names):
+        record = RecordRef.from_fields(record.record_id, record.fields or {})
+        if record.fund_name:  # 只处理有基金名称的记录
+            all_records.append(record)
     
-    print(f"📋 已获取 {len(all_records)} 条有效记录")
+    logger.info(f"📋 已获取 {len(all_records)} 条有效记录")
     return all_records
 
 
+def describe_pending_record(record):
+    """排序用：(资产情况, 是否两个标签都为空, 是否卡在获取失败)"""
+    return record.asset_value, not record.tag1 and not record.tag2, False
+
+
 def update_record_with_tags(client, app_token, table_id, record_id, tag1, tag2, tenant_access_token):
     """更新记录，添加标签字段"""
+    import lark_oapi as lark
+    from lark_oapi.api.bitable.v1 import AppTableRecord, UpdateAppTableRecordRequest
+    
     try:
         # 构建更新字段
         update_fields = {
@@ -186,7 +126,8 @@ def update_record_with_tags(client, app_token, table_id, record_id, tag1, tag2,
             .build()
         
         option = lark.RequestOption.builder().tenant_access_token(tenant_access_token).build()
-        response = client.bitable.v1.app_table_record.update(request, option)
+        response = get_executor().call(app_token, lambda: client.bitable.v1.app_table_record.update(request, option),
+                                       stage='write')
         
         return response.success(), response.msg
     except Exception as e:
@@ -195,6 +136,9 @@ def update_record_with_tags(client, app_token, table_id, record_id, tag1, tag2,
 
 def add_tag_columns(client, app_token, table_id, tenant_access_token):
     """添加标签列到表格（如果不存在）"""
+    import lark_oapi as lark
+    from lark_oapi.api.bitable.v1 import AppTableField, CreateAppTableFieldRequest, ListAppTableFieldRequest
+    
     try:
         # 首先获取表格字段信息
         request = ListAppTableFieldRequest.builder() \
@@ -222,11 +166,11 @@ def add_tag_columns(client, app_token, table_id, tenant_access_token):
             
             field_response = client.bitable.v1.app_table_field.create(field_request, option)
             if field_response.success():
-                print("✅ 成功创建标签1列")
+                logger.info("✅ 成功创建标签1列")
             else:
-                print(f"❌ 创建标签1列失败: {field_response.msg}")
+                logger.error(f"❌ 创建标签1列失败: {field_response.msg}")
         else:
-            print("✅ 标签1列已存在")
+            logger.info("✅ 标签1列已存在")
         
         # 检查并创建标签2列
         if '标签2' not in existing_fields:
@@ -241,80 +185,95 @@ def add_tag_columns(client, app_token, table_id, tenant_access_token):
             
             field_response = client.bitable.v1.app_table_field.create(field_request, option)
             if field_response.success():
-                print("✅ 成功创建标签2列")
+                logger.info("✅ 成功创建标签2列")
             else:
-                print(f"❌ 创建标签2列失败: {field_response.msg}")
+                logger.error(f"❌ 创建标签2列失败: {field_response.msg}")
         else:
-            print("✅ 标签2列已存在")
+            logger.info("✅ 标签2列已存在")
         
         return True, "标签列检查完成"
             
     except Exception as e:
-        print(f"❌ 添加标签列时出错: {str(e)}")
+        logger.error(f"❌ 添加标签列时出错: {str(e)}")
         return False, str(e)
 
 
-def update_fund_tags(app_token, table_id, tenant_access_token):
-    """主要逻辑：获取基金名称并更新标签"""
+def update_fund_tags(app_token, table_id, tenant_access_token, resume=False, priority=None, time_budget=None):
+    """主要逻辑：获取基金名称并更新标签
+    
+    每条记录写入后记入进度日志，resume为True时跳过上次已写入的记录
+    （只匹配到一个标签的记录标签2为空，不跳过的话每次运行都会重写）；
+    记录按priority排序写入（见work_scheduler.PRIORITIES），time_budget秒用完后取消剩余的写入
+    """
     # 创建client
-    client = lark.Client.builder() \
-        .enable_set_token(True) \
-        .log_level(lark.LogLevel.INFO) \
-        .build()
+    client = create_client()
     
     success_count = 0
     error_count = 0
+    executor = get_executor()
+    pending_updates = []
     
-    print(f"开始更新基金标签信息")
-    print(f"目标数据表ID: {table_id}")
+    logger.info("开始更新基金标签信息")
+    logger.info(f"目标数据表ID: {table_id}")
     
     # 加载标签库
     tag_library = load_tag_library()
     if not tag_library:
-        print("❌ 标签库加载失败，无法继续")
+        logger.error("❌ 标签库加载失败，无法继续")
         return
     
     # 添加标签列（如果不存在）
     column_success, column_msg = add_tag_columns(client, app_token, table_id, tenant_access_token)
     if not column_success:
-        print(f"❌ 无法添加标签列: {column_msg}")
+        logger.error(f"❌ 无法添加标签列: {column_msg}")
         return
     
     # 获取所有记录
-    all_records = get_all_records(client, app_token, table_id, tenant_access_token)
+    with get_metrics().timer('stage_load_records'):
+        all_records = get_all_records(client, app_token, table_id, tenant_access_token)
     
+    # 服务端已筛选出待处理的记录，没有记录说明都已完成（读取失败时iter_records已记录错误）
     if not all_records:
-        print("❌ 没有找到任何记录")
-        return
+        logger.info("✅ 没有需要更新标签的记录")
+        return 0, 0
     
-    print(f"\n🔄 开始处理 {len(all_records)} 条记录...")
+    logger.info(f"\n🔄 开始处理 {len(all_records)} 条记录...")
+    
+    journal = open_journal('add_fund_tags', app_token, table_id, resume=resume)
+    deadline = get_deadline(time_budget)
+    all_records = order_records(all_records, describe_pending_record, get_priority(priority))
+    on_written = lambda record_id: journal.mark_done(record_id)
+    interrupted = False
     
     for index, record in enumerate(all_records, 1):
         try:
-            fund_name = record['fund_name']
-            fund_type = record['fund_type']  # 新增获取基金类型
-            record_id = record['record_id']
+            fund_name = record.fund_name
+            fund_type = record.fund_type  # 新增获取基金类型
+            record_id = record.record_id
+            
+            if journal.is_done(record_id):
+                continue
             
-            print(f"\n📊 处理第 {index}/{len(all_records)} 条记录")
-            print(f"   基金名称: {fund_name}")
-            print(f"   基金类型: {fund_type}")  # 新增显示基金类型
+            logger.debug(f"\n📊 处理第 {index}/{len(all_records)} 条记录")
+            logger.debug(f"   基金名称: {fund_name}")
+            logger.debug(f"   基金类型: {fund_type}")  # 新增显示基金类型
             
             # 检查是否已有标签信息
-            existing_tag1 = record['fields'].get('标签1', '')
-            existing_tag2 = record['fields'].get('标签2', '')
+            existing_tag1 = record.tag1
+            existing_tag2 = record.tag2
             
             if existing_tag1 and existing_tag2:
-                print(f"   ⏭️  已有标签: {existing_tag1}, {existing_tag2}，跳过")
+                logger.debug(f"   ⏭️  已有标签: {existing_tag1}, {existing_tag2}，跳过")
                 continue
             
             # 根据基金类型匹配标签（新逻辑）
-            print(f"   🔍 正在根据基金类型匹配标签...")
+            logger.debug("   🔍 正在根据基金类型匹配标签...")
             matched_tags, matched_categories = match_tags_by_fund_type(fund_type, fund_name, tag_library)
             
             tag1 = matched_tags[0] if matched_tags[0] else ""
             tag2 = matched_tags[1] if matched_tags[1] else ""
             
-            print(f"   📋 匹配到标签: [{tag1}], [{tag2}]")
+            logger.debug(f"   📋 匹配到标签: [{tag1}], [{tag2}]")
             
             # 删除这部分重复代码：
             # print(f"   🔍 正在匹配标签...")
@@ -323,51 +282,69 @@ def update_fund_tags(app_token, table_id, tenant_access_token):
             # tag2 = matched_tags[1] if matched_tags[1] else ""
             # print(f"   📋 匹配到标签: [{tag1}], [{tag2}]")
             
-            # 更新记录
-            success, msg = update_record_with_tags(client, app_token, table_id, record_id, tag1, tag2, tenant_access_token)
-            
-            if success:
-                print(f"   ✅ 成功更新标签: {tag1}, {tag2}")
-                success_count += 1
-            else:
-                print(f"   ❌ 更新失败: {msg}")
-                error_count += 1
-            
-            # 添加延迟避免API限制
-            time.sleep(0.5)
+            # 提交到共享执行器并发更新记录（由令牌桶统一限流）
+            future = executor.submit(write_and_record, on_written, [record_id],
+                                     update_record_with_tags, client, app_token, table_id,
+                                     record_id, tag1, tag2, tenant_access_token)
+            pending_updates.append((fund_name, tag1, tag2, future))
+            deadline.watch([(future, 1)])
                 
         except KeyboardInterrupt:
-            print(f"\n⚠️  用户中断操作，已处理 {index-1} 条记录")
+            logger.warning(f"\n⚠️  用户中断操作，已处理 {index-1} 条记录")
+            interrupted = True
             break
         except Exception as e:
-            print(f"   ❌ 处理记录时出错: {str(e)}")
+            logger.error(f"   ❌ 处理记录时出错: {str(e)}")
             error_count += 1
             continue
     
-    print(f"\n📊 更新完成！")
-    print(f"✅ 成功更新: {success_count} 条记录")
-    print(f"❌ 失败: {error_count} 条记录")
+    # 等待所有飞书更新完成，时间预算用完后取消尚未开始的写入
+    for fund_name, tag1, tag2, future in pending_updates:
+        try:
+            success, msg = future.result()
+        except CancelledError:
+            continue
+        if success:
+            logger.debug(f"   ✅ 成功更新标签 ({fund_name}): {tag1}, {tag2}")
+            success_count += 1
+        else:
+            logger.error(f"   ❌ 更新失败 ({fund_name}): {msg}")
+            error_count += 1
+    if deadline.deferred:
+        logger.warning(f"⏰ 时间预算已用完，{deadline.deferred} 条记录的写入已取消，留待下次运行")
+        interrupted = True
+    
+    journal.close(completed=not interrupted and error_count == 0)
+    if interrupted or error_count:
+        logger.info("♻️  重新运行时加上 --resume 可跳过已写入的记录")
+    
+    logger.info("\n📊 更新完成！")
+    logger.info(f"✅ 成功更新: {success_count} 条记录")
+    logger.info(f"❌ 失败: {error_count} 条记录")
     return success_count, error_count
 
 
-def main():
-    """主函数"""
+def main(resume=False):
+    """主函数，resume为True时跳过上次中断前已完成的工作"""
     print("=== 飞书表格基金标签更新工具 ===")
     print("💡 根据基金名称自动匹配并更新标签信息")
     
     try:
+        # 飞书SDK和tenant_access_token都在后台准备，与下面的交互提示同时进行
+        preload_feishu_sdk()
+        
         # 从配置文件加载默认值
         try:
-            config = get_feishu_config()
+            config = load_config()
             default_app_token = config['app_token']
-            default_tenant_access_token = config['tenant_access_token']
             default_table_id = config['table_id']
+            config_future = prefetch_feishu_config()
         except Exception as e:
             print(f"⚠️  加载配置文件失败: {str(e)}")
             print("将使用手动输入模式")
             default_app_token = ""
-            default_tenant_access_token = ""
             default_table_id = ""
+            config_future = None
         
         # 获取用户输入
         app_token = input(f"请输入App Token (回车使用配置文件默认值): ").strip()
@@ -390,8 +367,7 @@ def main():
         
         tenant_access_token = input(f"请输入Tenant Access Token (回车使用配置文件默认值): ").strip()
         if not tenant_access_token:
-            tenant_access_token = default_tenant_access_token
-            if tenant_access_token:
+            if config_future is not None:
                 print(f"使用配置文件Tenant Access Token")
             else:
                 print("❌ 错误: Tenant Access Token不能为空")
@@ -412,8 +388,15 @@ def main():
         
         print("\n⚠️  提示: 更新过程中可以按 Ctrl+C 中断操作")
         
+        # 使用配置文件的token时，到这里才等待后台获取完成
+        if not tenant_access_token:
+            tenant_access_token = wait_for_tenant_access_token(config_future)
+            if not tenant_access_token:
+                print("❌ 错误: Tenant Access Token不能为空")
+                return
+        
         # 执行更新
-        update_fund_tags(app_token, table_id, tenant_access_token)
+        update_fund_tags(app_token, table_id, tenant_access_token, resume=resume)
         
     except KeyboardInterrupt:
         print("\n⚠️  用户中断操作")
@@ -422,4 +405,12 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='飞书表格基金标签更新工具')
+    parser.add_argument('--resume', action='store_true', help='跳过上次中断前已完成的工作')
+    args = parser.parse_args()
+    
+    configure_logging()
+    try:
+        main(resume=args.resume)
+    finally:
+        write_run_summary('add_fund_tags')
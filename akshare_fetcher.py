@@ -0,0 +1,205 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from config_loader import get_setting
+from feishu_executor import TokenBucket
+from fund_cache import lookup_cached_fund_type, request_fund_info, store_fund_type
+from metrics import get_logger, get_metrics
+
+
+logger = get_logger(__name__)
+
+
+# 熔断器半开时，等待试探结果的请求每隔多久检查一次
+PROBE_POLL_SECONDS = 0.05
+
+
+class CircuitBreaker:
+    """连续threshold个基金代码查询失败（重试用尽）后断开，冷却cooldown秒后半开
+
+    冷却中的查询直接放弃，上游故障时尽早结束运行；半开时只放行一个试探请求，其余请求等待结果：
+    试探成功则恢复，失败则重新断开并再冷却一次。查询器是全局共享的，冷却结束后仍可继续使用
+    """
+
+    def __init__(self, threshold=10, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        """是否处于断开状态（包括冷却结束、尚未试探成功的半开状态）"""
+        return self.opened_at is not None
+
+    @property
+    def is_cooling_down(self):
+        """断开后仍在冷却中，查询一律放弃"""
+        opened_at = self.opened_at
+        return opened_at is not None and time.monotonic() - opened_at < self.cooldown
+
+    def allow(self):
+        """是否放行一次查询：放行返回True，冷却中返回False，半开且已有试探请求时返回None（应等待）"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            if self.probing:
+                return None
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def release_probe(self):
+        """试探请求没有明确结果（如返回空数据）时交还试探机会，状态不变"""
+        with self.lock:
+            self.probing = False
+
+    def record_failure(self):
+        """记录一个基金代码重试用尽后的失败，本次失败导致断开（或试探失败重新断开）时返回True"""
+        with self.lock:
+            self.failures += 1
+            if self.probing:
+                self.probing = False
+                self.opened_at = time.monotonic()
+                return True
+            if self.threshold and self.opened_at is None and self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+class AkshareFetcher:
+    """并发查询基金类型
+
+    - 线程池并发调用akshare，令牌桶按AIMD调节速率：出错或返回空数据时速率减半，成功时缓慢回升
+    - 网络异常按带随机抖动的指数退避重试，重试用尽仍失败记为"获取失败"（不缓存，下次运行重新获取）
+    - 连续breaker_threshold个基金代码重试用尽仍失败时熔断，剩余代码不再请求也不返回结果，留给下次运行；
+      冷却breaker_cooldown秒后放行一个试探请求，成功则恢复查询（见CircuitBreaker）
+    - 给出时间预算（work_scheduler.Deadline）时，预算用完后同样停止请求和返回结果
+    """
+
+    def __init__(self, max_workers=4, rate=2, min_rate=0.2, max_retries=3, backoff_base=1.0, backoff_cap=30.0,
+                 breaker_threshold=10, breaker_cooldown=60):
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(rate, capacity=1, min_rate=min_rate)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+
+    def backoff_seconds(self, attempt):
+        """第attempt次重试前的等待时间（full jitter）"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def wait_for_breaker(self, deadline=None):
+        """等待熔断器放行本次查询：半开时等待试探请求的结果；冷却中或时间预算用完时返回False"""
+        while deadline is None or not deadline.expired:
+            allowed = self.breaker.allow()
+            if allowed is not None:
+                return allowed
+            time.sleep(PROBE_POLL_SECONDS)
+        return False
+
+    def fetch(self, normalized_code, deadline=None):
+        """查询一个基金代码并写入缓存，返回基金类型；熔断或时间预算用完而没有查询时返回None"""
+        metrics = get_metrics()
+        if not self.wait_for_breaker(deadline):
+            return None
+        for attempt in range(self.max_retries + 1):
+            if self.breaker.is_cooling_down or (deadline is not None and deadline.expired):
+                self.breaker.release_probe()
+                return None
+            self.bucket.acquire()
+            try:
+                fund_type, fund_info = request_fund_info(normalized_code)
+            except Exception as e:
+                self.bucket.slow_down()
+                metrics.incr('akshare_errors')
+                # 断开（或半开试探）时不再重试
+                if attempt < self.max_retries and not self.breaker.is_open:
+                    backoff = self.backoff_seconds(attempt)
+                    metrics.incr('akshare_retries')
+                    logger.debug(f"   ⏳ 基金代码 {normalized_code} 查询失败: {str(e)}，{backoff:.1f}秒后重试 "
+                                 f"({attempt + 1}/{self.max_retries})")
+                    time.sleep(backoff)
+                    continue
+                logger.warning(f"⚠️  获取基金代码 {normalized_code} 的类型信息失败: {str(e)}")
+                if self.breaker.record_failure():
+                    metrics.incr('akshare_circuit_open')
+                    logger.error(f"❌ akshare查询连续失败，"
+                                 f"暂停查询 {self.breaker.cooldown:g} 秒")
+                return "获取失败"
+
+            # 返回空数据可能是上游在限流，同样降速，但结果照常缓存（短期有效）；基金不存在是正常结果
+            if fund_info or fund_type == "基金不存在":
+                self.bucket.speed_up()
+                self.breaker.record_success()
+            else:
+                self.bucket.slow_down()
+                self.breaker.release_probe()
+                metrics.incr('akshare_empty')
+            store_fund_type(normalized_code, fund_type, fund_info)
+            return fund_type
+        return "获取失败"
+
+    def lookup_all(self, fund_codes, universe_index=None, deadline=None):
+        """查询一组基金代码，按完成顺序逐个返回(基金代码, 基金类型, 是否实际调用了akshare)
+
+        全市场索引和本地缓存命中的代码立即返回，其余按fund_codes的顺序提交到线程池（排在前面的先查询）；
+        熔断冷却中或时间预算用完后停止返回（检查breaker.is_open、deadline.expired）；
+        调用方提前结束迭代（如Ctrl+C）时取消尚未开始的查询
+        """
+        pending = {}
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for fund_code in fund_codes:
+                normalized_code, fund_type = lookup_cached_fund_type(fund_code, universe_index=universe_index)
+                if fund_type is not None:
+                    yield fund_code, fund_type, False
+                else:
+                    pending[pool.submit(self.fetch, normalized_code, deadline)] = fund_code
+
+            while pending and not self.breaker.is_cooling_down:
+                if deadline is not None and deadline.expired:
+                    break
+                done, _ = wait(pending, timeout=deadline.remaining() if deadline is not None else None,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    # 熔断或预算用完后的结果不能交给调用方写入
+                    if self.breaker.is_cooling_down or (deadline is not None and deadline.expired):
+                        break
+                    fund_code = pending.pop(future)
+                    fund_type = future.result()
+                    if fund_type is not None:
+                        yield fund_code, fund_type, True
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_akshare_fetcher():
+    """获取全局共享的akshare查询器，参数可在config.json中配置"""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = AkshareFetcher(
+                max_workers=get_setting('akshare_max_workers', 4),
+                rate=get_setting('akshare_rate_per_second', 2),
+                max_retries=get_setting('akshare_max_retries', 3),
+                breaker_threshold=get_setting('akshare_breaker_threshold', 10),
+                breaker_cooldown=get_setting('akshare_breaker_cooldown_seconds', 60),
+            )
+        return _fetcher
@@ -0,0 +1,93 @@
+import argparse
+import csv
+import itertools
+import os
+import random
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_CSV = os.path.join(REPO_DIR, 'test.csv')
+
+HEADERS = ['序号', '基金代码', '基金名称', '销售机构', '交易账户', '持有份额', '份额日期', '基金净值',
+           '净值日期', '资产情况（结算币种）', '结算币种', '分红方式', '基金类型', '标签1', '标签2']
+
+NAME_PARTS = ['中证500', '沪深300', '恒生科技', '纳斯达克', '标普500', '医药', '消费', '半导体', '新能源',
+              '红利', '低波', '价值', '成长', '人工智能', '军工', '银行', '科创板', '创业板']
+NAME_SUFFIXES = ['指数', '交易型开放式指数证券投资基金联接A', '增强', '混合', '精选股票', '债券', '货币']
+
+
+def load_sample(sample_csv=SAMPLE_CSV):
+    """读取示例持仓，作为名称/类型/销售机构分布的来源"""
+    with open(sample_csv, 'r', encoding='utf-8-sig') as f:
+        rows = list(csv.DictReader(f))
+    funds = {}
+    for row in rows:
+        code = row['基金代码'].strip().zfill(6)
+        funds.setdefault(code, (row['基金名称'], row['基金类型'], float(row['基金净值'] or 1)))
+    institutions = sorted({row['销售机构'] for row in rows})
+    return list(funds.items()), institutions
+
+
+def build_fund_universe(size, rng, sample_funds):
+    """生成基金池：先用示例中的真实基金，不足的部分合成"""
+    universe = [(code, name, fund_type, nav) for code, (name, fund_type, nav) in sample_funds[:size]]
+    fund_types = [fund_type for _, (_, fund_type, _) in sample_funds if fund_type]
+    used_codes = {code for code, *_ in universe}
+    while len(universe) < size:
+        code = f"{rng.randint(1, 999999):06d}"
+        if code in used_codes:
+            continue
+        used_codes.add(code)
+        name = f"{rng.choice(['华夏', '易方达', '广发', '南方', '富国', '嘉实'])}{rng.choice(NAME_PARTS)}{rng.choice(NAME_SUFFIXES)}"
+        universe.append((code, name, rng.choice(fund_types), round(rng.uniform(0.8, 3.5), 4)))
+    return universe
+
+
+def generate_holdings(output_path, rows, seed=0, with_footer=True):
+    """生成与test.csv结构相同的持仓文件，基金按Zipf分布重复出现在多个账户中"""
+    rng = random.Random(seed)
+    sample_funds, institutions = load_sample()
+    universe = build_fund_universe(max(50, rows // 20), rng, sample_funds)
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(universe) + 1)))
+    accounts = {institution: [f"{rng.randint(10 ** 9, 10 ** 10 - 1)}" for _ in range(max(1, rows // 200))]
+                for institution in institutions}
+    
+    seen_keys = set()
+    with open(output_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADERS)
+        index = 0
+        while index < rows:
+            code, name, fund_type, nav = rng.choices(universe, cum_weights=cum_weights)[0]
+            institution = rng.choice(institutions)
+            account = rng.choice(accounts[institution])
+            if (code, account) in seen_keys:
+                # 热门基金在已有账户中都出现过时开一个新账户，避免反复重抽
+                account = f"{rng.randint(10 ** 9, 10 ** 10 - 1)}"
+                accounts[institution].append(account)
+                if (code, account) in seen_keys:
+                    continue
+            seen_keys.add((code, account))
+            index += 1
+            shares = round(rng.lognormvariate(9, 1.2), 2)
+            writer.writerow([index, code.lstrip('0') or '0', name, institution, account, shares, '2025/9/10',
+                             nav, '2025/9/10', round(shares * nav, 2), '人民币',
+                             rng.choice(['现金分红', '红利转投']), fund_type, '', ''])
+        if with_footer:
+            writer.writerow(['打印时间：2025-09-10 12:00:00'] + [''] * (len(HEADERS) - 1))
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成持仓CSV')
+    parser.add_argument('rows', type=int, help='行数，例如1000 / 100000 / 1000000')
+    parser.add_argument('-o', '--output', default='holdings_synthetic.csv')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    generate_holdings(args.output, args.rows, args.seed)
+    print(f"✅ 已生成 {args.rows} 行: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# 飞书开放平台的限流错误码
+RATE_LIMIT_CODE = 99991400
+# 不支持的筛选公式返回的错误码（触发客户端回退到全表扫描）
+INVALID_FILTER_CODE = 1254018
+
+RECORDS_PATH = re.compile(r'^/open-apis/bitable/v1/apps/([^/]+)/tables/([^/]+)/records(?:/([^/]+))?$')
+FIELDS_PATH = re.compile(r'^/open-apis/bitable/v1/apps/([^/]+)/tables/([^/]+)/fields$')
+FILTER_CONDITION = re.compile(r'CurrentValue\.\[(.+?)\]="(.*?)"')
+
+
+class MockBitable:
+    """内存中的多维表格，记录每类接口的调用次数"""
+
+    def __init__(self, latency=0.02, rate=0, page_size_limit=500):
+        self.latency = latency
+        self.rate = rate
+        self.page_size_limit = page_size_limit
+        self.tables = {}
+        self.fields = {}
+        self.calls = {}
+        self.rate_limited = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._window_count = 0
+
+    def count(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def allow(self):
+        """按秒计数的简单限流，rate为0时不限流"""
+        if not self.rate:
+            return True
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            if self._window_count > self.rate:
+                self.rate_limited += 1
+                return False
+            return True
+
+    def table(self, app_token, table_id):
+        return self.tables.setdefault((app_token, table_id), {})
+
+    def new_record(self, fields):
+        return {
+            'record_id': f'rec{next(self._ids):012d}',
+            'fields': dict(fields),
+            'last_modified_time': int(time.time() * 1000),
+        }
+
+    def seed(self, app_token, table_id, rows):
+        """预置记录（不计入调用次数），rows为fields字典列表"""
+        table = self.table(app_token, table_id)
+        for fields in rows:
+            record = self.new_record(fields)
+            table[record['record_id']] = record
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': dict(self.calls),
+                'total_calls': sum(self.calls.values()),
+                'rate_limited': self.rate_limited,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = {}
+            self.rate_limited = 0
+
+
+def match_filter(formula, fields):
+    """只支持"字段等于某值"的OR/单条件公式，其余公式视为不支持"""
+    conditions = FILTER_CONDITION.findall(formula)
+    for field_name, value in conditions:
+        current = fields.get(field_name)
+        if isinstance(current, list):
+            current = ''.join(item.get('text', '') if isinstance(item, dict) else str(item) for item in current)
+        if ('' if current is None else str(current)) == value:
+            return True
+    return False
+
+
+def make_handler(bitable):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, data=None, code=0, msg='success', status=200):
+            body = json.dumps({'code': code, 'msg': msg, 'data': data or {}}, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def dispatch(self, method):
+            url = urlparse(self.path)
+            body = self.read_body() if method in ('POST', 'PUT') else {}
+
+            if url.path == '/__stats':
+                return self.reply(bitable.stats())
+            if url.path == '/open-apis/auth/v3/tenant_access_token/internal':
+                bitable.count('auth')
+                body = json.dumps({'code': 0, 'msg': 'ok', 'tenant_access_token': 't-mock', 'expire': 7200}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            if not bitable.allow():
+                return self.reply(code=RATE_LIMIT_CODE, msg='request trigger frequency limit', status=429)
+            time.sleep(bitable.latency)
+
+            match = FIELDS_PATH.match(url.path)
+            if match:
+                key = match.groups()
+                fields = bitable.fields.setdefault(key, {})
+                if method == 'GET':
+                    bitable.count('fields.list')
+                    items = [{'field_id': f'fld{i}', 'field_name': name, 'type': field_type}
+                             for i, (name, field_type) in enumerate(fields.items())]
+                    return self.reply({'items': items, 'has_more': False, 'total': len(items)})
+                bitable.count('fields.create')
+                fields[body.get('field_name')] = body.get('type', 1)
+                return self.reply({'field': body})
+
+            match = RECORDS_PATH.match(url.path)
+            if not match:
+                return self.reply(code=404, msg='not found', status=404)
+            app_token, table_id, record_id = match.groups()
+            table = bitable.table(app_token, table_id)
+
+            if method == 'GET' and record_id is None:
+                return self.list_records(table, parse_qs(url.query))
+            if method == 'POST' and record_id is None:
+                bitable.count('records.create')
+                record = bitable.new_record(body.get('fields', {}))
+                table[record['record_id']] = record
+                return self.reply({'record': record})
+            if method == 'PUT' and record_id:
+                bitable.count('records.update')
+                record = table.get(record_id)
+                if record is None:
+                    return self.reply(code=1254043, msg='RecordIdNotFound', status=400)
+                record['fields'].update(body.get('fields', {}))
+                record['last_modified_time'] = int(time.time() * 1000)
+                return self.reply({'record': record})
+            if method == 'POST' and record_id == 'batch_create':
+                bitable.count('records.batch_create')
+                records = []
+                for item in body.get('records', []):
+                    record = bitable.new_record(item.get('fields', {}))
+                    table[record['record_id']] = record
+                    records.append(record)
+                return self.reply({'records': records})
+            if method == 'POST' and record_id == 'batch_update':
+                bitable.count('records.batch_update')
+                records = []
+                for item in body.get('records', []):
+                    record = table.get(item.get('record_id'))
+                    if record is None:
+                        return self.reply(code=1254043, msg='RecordIdNotFound', status=400)
+                    record['fields'].update(item.get('fields', {}))
+                    record['last_modified_time'] = int(time.time() * 1000)
+                    records.append(record)
+                return self.reply({'records': records})
+            return self.reply(code=404, msg='not found', status=404)
+
+        def list_records(self, table, query):
+            bitable.count('records.list')
+            page_size = min(int(query.get('page_size', ['20'])[0]), bitable.page_size_limit)
+            offset = int(query.get('page_token', ['0'])[0] or 0)
+            formula = query.get('filter', [''])[0]
+            field_names = json.loads(query['field_names'][0]) if 'field_names' in query else None
+
+            records = list(table.values())
+            if formula:
+                if not FILTER_CONDITION.search(formula):
+                    return self.reply(code=INVALID_FILTER_CODE, msg='InvalidFilter', status=400)
+                records = [record for record in records if match_filter(formula, record['fields'])]
+
+            page = records[offset:offset + page_size]
+            items = []
+            for record in page:
+                fields = record['fields']
+                if field_names is not None:
+                    fields = {name: value for name, value in fields.items() if name in field_names}
+                items.append({'record_id': record['record_id'], 'fields': fields,
+                              'last_modified_time': record['last_modified_time']})
+            has_more = offset + page_size < len(records)
+            return self.reply({
+                'items': items,
+                'has_more': has_more,
+                'page_token': str(offset + page_size) if has_more else '',
+                'total': len(records),
+            })
+
+        def do_GET(self):
+            self.dispatch('GET')
+
+        def do_POST(self):
+            self.dispatch('POST')
+
+        def do_PUT(self):
+            self.dispatch('PUT')
+
+    return Handler
+
+
+def start_server(bitable=None, host='127.0.0.1', port=0):
+    """在后台线程启动模拟服务，返回(server, bitable, base_url)"""
+    bitable = bitable or MockBitable()
+    server = ThreadingHTTPServer((host, port), make_handler(bitable))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, bitable, f'http://{host}:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的飞书多维表格服务')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.02, help='每个请求的模拟耗时（秒）')
+    parser.add_argument('--rate', type=int, default=0, help='每秒允许的请求数，0表示不限流')
+    args = parser.parse_args()
+
+    server, _, base_url = start_server(MockBitable(args.latency, args.rate), port=args.port)
+    print(f"🚀 模拟多维表格服务已启动: {base_url}（在config.json中设置feishu_domain即可指向它）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
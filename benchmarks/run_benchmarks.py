@@ -0,0 +1,289 @@
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB_AKSHARE_DIR = os.path.join(BENCH_DIR, 'stub_akshare')
+
+APP_TOKEN = 'bench_app'
+TABLE_ID = 'bench_table'
+TENANT_TOKEN = 't-mock'
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+class BenchContext:
+    """单个场景的运行环境：临时目录、隔离的缓存/镜像、模拟服务和全局执行器"""
+
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = workdir
+        self.bitable = None
+        self.base_url = None
+
+        import akshare_fetcher
+        import bitable_mirror
+        import feishu_executor
+        import fund_cache
+        import portfolio
+        import lark_oapi  # 脚本中飞书SDK是延迟导入的，这里预先导入，数秒的导入耗时不计入场景（见startup_benchmark.py）
+
+        fund_cache._cache = fund_cache.FundInfoCache(db_path=os.path.join(workdir, 'fund_cache.sqlite3'))
+        fund_cache._universe_index = None
+        fund_cache._universe_date = None
+        bitable_mirror._mirror = bitable_mirror.BitableMirror(db_path=os.path.join(workdir, 'mirror.sqlite3'))
+        portfolio._portfolio_cache = portfolio.PortfolioCache(db_path=os.path.join(workdir, 'portfolio.sqlite3'))
+        feishu_executor._executor = feishu_executor.FeishuExecutor(
+            max_workers=args.workers, rate=args.client_rate, burst=args.client_rate, max_retries=5)
+        akshare_fetcher._fetcher = akshare_fetcher.AkshareFetcher(
+            max_workers=args.akshare_workers, rate=args.akshare_rate, backoff_base=0.05)
+
+    def holdings(self, rows):
+        from generate_holdings import generate_holdings
+        return generate_holdings(os.path.join(self.workdir, f'holdings_{rows}.csv'), rows, seed=self.args.seed)
+
+    def start_server(self):
+        """启动模拟服务，并让所有脚本创建的client指向它"""
+        import lark_oapi as lark
+        from mock_bitable_server import MockBitable, start_server
+
+        _, self.bitable, self.base_url = start_server(MockBitable(latency=self.args.latency, rate=self.args.server_rate))
+        patched = lambda domain=None: lark.Client.builder() \
+            .domain(self.base_url) \
+            .enable_set_token(True) \
+            .log_level(lark.LogLevel.ERROR) \
+            .build()
+        for module_name in ['feishu_bitable', 'import', 'pipeline', 'update_fund_type', 'add_fund_tags']:
+            module = importlib.import_module(module_name)
+            module.create_client = patched
+        return self.bitable
+
+    def seed_table(self, csv_path, with_types=True):
+        """把持仓文件直接写入模拟表格（不计调用次数），用于更新类场景"""
+        from holdings_csv import read_cleaned_rows
+
+        rows = []
+        for _, _, cleaned in read_cleaned_rows(csv_path):
+            if not with_types:
+                cleaned.pop('基金类型', None)
+            cleaned.pop('标签1', None)
+            cleaned.pop('标签2', None)
+            rows.append(cleaned)
+        self.bitable.seed(APP_TOKEN, TABLE_ID, rows)
+        return len(rows)
+
+
+@scenario('portfolio')
+def bench_portfolio(ctx, rows):
+    """汇总持仓：首次读取CSV汇总，之后的报告从SQLite缓存读取（耗时见portfolio_build、portfolio_cached）"""
+    import portfolio
+    path = ctx.holdings(rows)
+    portfolio.get_portfolio_snapshot(path)
+    portfolio.get_portfolio_cache().memory.clear()
+    portfolio.PortfolioReport(portfolio.get_portfolio_snapshot(path)).to_dict()
+
+
+@scenario('tags_local')
+def bench_tags_local(ctx, rows):
+    """本地CSV打标签（向量化）"""
+    import add_fund_tags_local
+    path = ctx.holdings(rows)
+    add_fund_tags_local.update_fund_tags_in_csv(path)
+
+
+@scenario('types_local')
+def bench_types_local(ctx, rows):
+    """本地CSV补全基金类型（全市场列表 + 逐个查询）"""
+    import update_fund_type_local
+    path = ctx.holdings(rows)
+    update_fund_type_local.update_fund_types_in_csv(path, bulk_mode=True)
+
+
+@scenario('import_batch')
+def bench_import_batch(ctx, rows):
+    """导入到空表（批量写入）"""
+    ctx.start_server()
+    path = ctx.holdings(rows)
+    importlib.import_module('import').import_csv_to_feishu(APP_TOKEN, TABLE_ID, path, TENANT_TOKEN, batch_mode=True)
+
+
+@scenario('import_single')
+def bench_import_single(ctx, rows):
+    """导入到空表（逐条写入）"""
+    ctx.start_server()
+    path = ctx.holdings(rows)
+    importlib.import_module('import').import_csv_to_feishu(APP_TOKEN, TABLE_ID, path, TENANT_TOKEN, batch_mode=False)
+
+
+@scenario('import_stream')
+def bench_import_stream(ctx, rows):
+    """导入到空表（分块流式，批量写入）"""
+    ctx.start_server()
+    path = ctx.holdings(rows)
+    importlib.import_module('import').import_csv_to_feishu(APP_TOKEN, TABLE_ID, path, TENANT_TOKEN, batch_mode=True,
+                                                           stream=True)
+
+
+@scenario('import_stream_unchanged')
+def bench_import_stream_unchanged(ctx, rows):
+    """分块流式重复导入同一文件（全部无变化，只读不写）"""
+    bitable = ctx.start_server()
+    path = ctx.holdings(rows)
+    ctx.seed_table(path)
+    bitable.reset_stats()
+    importlib.import_module('import').import_csv_to_feishu(APP_TOKEN, TABLE_ID, path, TENANT_TOKEN, batch_mode=True,
+                                                           stream=True)
+
+
+@scenario('import_unchanged')
+def bench_import_unchanged(ctx, rows):
+    """重复导入同一文件（全部无变化，只读不写）"""
+    bitable = ctx.start_server()
+    path = ctx.holdings(rows)
+    ctx.seed_table(path)
+    bitable.reset_stats()
+    importlib.import_module('import').import_csv_to_feishu(APP_TOKEN, TABLE_ID, path, TENANT_TOKEN, batch_mode=True)
+
+
+@scenario('types_remote')
+def bench_types_remote(ctx, rows):
+    """补全表格中的基金类型"""
+    bitable = ctx.start_server()
+    ctx.seed_table(ctx.holdings(rows), with_types=False)
+    bitable.reset_stats()
+    importlib.import_module('update_fund_type').update_fund_types(APP_TOKEN, TABLE_ID, TENANT_TOKEN, bulk_mode=True)
+
+
+@scenario('tags_remote')
+def bench_tags_remote(ctx, rows):
+    """为表格中的记录打标签"""
+    bitable = ctx.start_server()
+    ctx.seed_table(ctx.holdings(rows))
+    bitable.reset_stats()
+    importlib.import_module('add_fund_tags').update_fund_tags(APP_TOKEN, TABLE_ID, TENANT_TOKEN)
+
+
+@scenario('pipeline')
+def bench_pipeline(ctx, rows):
+    """一次完成导入、补全类型和打标签"""
+    ctx.start_server()
+    path = ctx.holdings(rows)
+    importlib.import_module('pipeline').run_pipeline(APP_TOKEN, TABLE_ID, path, TENANT_TOKEN, bulk_mode=True)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_child(args):
+    """在当前进程运行单个场景并输出一行JSON（每个场景独立进程，峰值内存互不影响）"""
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    if not args.real_akshare:
+        sys.path.insert(0, STUB_AKSHARE_DIR)
+
+    workdir = tempfile.mkdtemp(prefix='fund_bench_')
+    try:
+        ctx = BenchContext(args, workdir)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            SCENARIOS[args.child](ctx, args.rows)
+            elapsed = time.perf_counter() - start
+
+        result = {
+            'scenario': args.child,
+            'rows': args.rows,
+            'seconds': round(elapsed, 3),
+            'rows_per_s': round(args.rows / elapsed, 1) if elapsed else None,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        if ctx.bitable is not None:
+            stats = ctx.bitable.stats()
+            result.update({
+                'api_calls': stats['total_calls'],
+                'api_calls_per_row': round(stats['total_calls'] / args.rows, 4),
+                'rate_limited': stats['rate_limited'],
+                'api_breakdown': stats['calls'],
+            })
+        from metrics import get_metrics
+        result['stages'] = get_metrics().summary()['timers']
+        if 'akshare' in sys.modules and hasattr(sys.modules['akshare'], 'call_counts'):
+            result['akshare_calls'] = dict(sys.modules['akshare'].call_counts)
+        print(json.dumps(result, ensure_ascii=False))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_all(args):
+    results = []
+    for rows in args.rows_list:
+        for name in args.scenarios:
+            command = [sys.executable, os.path.abspath(__file__), '--child', name, '--rows', str(rows),
+                       '--latency', str(args.latency), '--server-rate', str(args.server_rate),
+                       '--client-rate', str(args.client_rate), '--workers', str(args.workers),
+                       '--akshare-rate', str(args.akshare_rate), '--akshare-workers', str(args.akshare_workers),
+                       '--seed', str(args.seed)]
+            if args.real_akshare:
+                command.append('--real-akshare')
+            completed = subprocess.run(command, capture_output=True, text=True)
+            lines = completed.stdout.strip().splitlines()
+            if completed.returncode != 0 or not lines:
+                print(f"❌ {name} ({rows}行) 运行失败:\n{completed.stderr[-2000:]}")
+                continue
+            result = json.loads(lines[-1])
+            results.append(result)
+            calls = f", API调用/行 {result['api_calls_per_row']}" if 'api_calls_per_row' in result else ''
+            print(f"📊 {name:<16} {rows:>8}行  {result['seconds']:>8.2f}s  "
+                  f"{result['rows_per_s']:>10.1f}行/s{calls}, 峰值内存 {result['peak_rss_mb']}MB")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存到: {args.output}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='基金持仓脚本的性能基准测试（本地模拟飞书和akshare）')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--rows-list', nargs='+', type=int, default=[1000, 10000])
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟飞书接口的单次耗时（秒）')
+    parser.add_argument('--server-rate', type=int, default=50, help='模拟服务端每秒允许的请求数，0表示不限流')
+    parser.add_argument('--client-rate', type=float, default=50, help='客户端令牌桶速率（每秒请求数）')
+    parser.add_argument('--workers', type=int, default=5)
+    parser.add_argument('--akshare-rate', type=float, default=50, help='akshare查询器的速率上限（每秒请求数）')
+    parser.add_argument('--akshare-workers', type=int, default=4, help='akshare查询器的并发数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--real-akshare', action='store_true', help='使用真实akshare（需联网）')
+    parser.add_argument('-o', '--output', help='把结果保存为JSON文件')
+    parser.add_argument('--child', choices=list(SCENARIOS), help=argparse.SUPPRESS)
+    parser.add_argument('--rows', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+    else:
+        run_all(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# 带命令行参数解析的入口脚本
+CLI_SCRIPTS = ['cli', 'import', 'pipeline', 'update_fund_type', 'update_fund_type_local', 'add_fund_tags']
+
+# 单独测量导入耗时的模块（lark_oapi、pandas作为参照，入口脚本启动时不应加载它们）
+MODULES = ['config_loader', 'feishu_bitable', 'bitable_mirror', 'holdings_csv', 'tag_matcher', 'akshare_fetcher',
+           'run_planner', 'portfolio', 'fx_rates', 'pandas', 'lark_oapi']
+
+# 相当于cli.py import --plan --offline，镜像换成临时文件，不读写仓库中的镜像
+PREVIEW_CODE = '''
+import sys
+sys.path.insert(0, {repo!r})
+import bitable_mirror
+bitable_mirror._mirror = bitable_mirror.BitableMirror(db_path={db!r})
+from run_planner import plan_import
+plan_import(None, 'bench_app', 'bench_table', {csv!r}).log()
+'''
+
+TAGS_LOCAL_CODE = '''
+import sys
+sys.path.insert(0, {repo!r})
+import add_fund_tags_local
+add_fund_tags_local.update_fund_tags_in_csv({csv!r})
+'''
+
+
+def time_command(command, repeat, prepare=None):
+    """在全新进程中重复运行命令，返回每次的耗时（秒）"""
+    timings = []
+    for _ in range(repeat):
+        if prepare:
+            prepare()
+        start = time.perf_counter()
+        completed = subprocess.run(command, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        elapsed = time.perf_counter() - start
+        if completed.returncode != 0:
+            raise RuntimeError(completed.stderr.decode('utf-8', errors='replace')[-2000:])
+        timings.append(elapsed)
+    return timings
+
+
+def build_cases(workdir, rows):
+    """返回[(名称, 命令, 准备函数, 是否为快速操作)]"""
+    sys.path.insert(0, BENCH_DIR)
+    from generate_holdings import generate_holdings
+
+    source = generate_holdings(os.path.join(workdir, 'holdings.csv'), rows, seed=0)
+    tags_csv = os.path.join(workdir, 'tags.csv')
+    python = sys.executable
+
+    cases = [('python（空进程）', [python, '-c', 'pass'], None, False)]
+    for script in CLI_SCRIPTS:
+        cases.append((f'{script} --help', [python, f'{script}.py', '--help'], None, True))
+    cases.append((f'import --plan --offline（{rows}行）',
+                  [python, '-c', PREVIEW_CODE.format(repo=REPO_DIR, db=os.path.join(workdir, 'mirror.sqlite3'),
+                                                     csv=source)],
+                  None, True))
+    cases.append((f'add_fund_tags_local（{rows}行）',
+                  [python, '-c', TAGS_LOCAL_CODE.format(repo=REPO_DIR, csv=tags_csv)],
+                  lambda: shutil.copyfile(source, tags_csv), True))
+    for module in MODULES:
+        cases.append((f'import {module}', [python, '-c', f'import {module}'], None, False))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description='入口脚本冷启动耗时（每次测量都是全新进程）')
+    parser.add_argument('--repeat', type=int, default=5, help='每项测量的次数，取中位数')
+    parser.add_argument('--rows', type=int, default=1000, help='预览导入和本地打标签所用持仓文件的行数')
+    parser.add_argument('--budget', type=float, default=1.0, help='快速操作的耗时上限（秒），超出时标记⚠️')
+    parser.add_argument('-o', '--output', help='把结果保存为JSON文件')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fund_startup_')
+    results = []
+    try:
+        for name, command, prepare, is_quick in build_cases(workdir, args.rows):
+            try:
+                timings = time_command(command, args.repeat, prepare)
+            except RuntimeError as e:
+                print(f"❌ {name} 运行失败:\n{e}")
+                continue
+            median = statistics.median(timings)
+            mark = ('✅' if median < args.budget else '⚠️ ') if is_quick else '  '
+            print(f"{mark} {name:<36} 中位数 {median:6.3f}s  最快 {min(timings):6.3f}s")
+            results.append({'name': name, 'median_s': round(median, 4), 'min_s': round(min(timings), 4),
+                            'quick': is_quick})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存到: {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
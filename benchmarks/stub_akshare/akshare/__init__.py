@@ -0,0 +1,77 @@
+"""基准测试用的akshare替身，只实现本项目用到的几个接口
+
+延迟和全市场列表规模通过环境变量控制：
+    STUB_AKSHARE_LATENCY     单只基金查询的模拟耗时（秒），默认0.05
+    STUB_AKSHARE_FAIL_RATE   单只基金查询随机失败的比例，默认0
+    STUB_AKSHARE_UNIVERSE    fund_name_em对常见代码段的覆盖比例（0~1），默认0.9
+"""
+import hashlib
+import os
+import random
+import threading
+import time
+
+import pandas as pd
+
+
+FUND_TYPES = ['混合型-偏股', '混合型-灵活配置', '指数型-股票', '债券型-长债', '债券型-中短债',
+              'QDII-股票', '货币型-普通货币', '股票型', 'FOF-稳健型']
+
+# 东方财富口径，fund_cache.normalize_universe_fund_type会换算成雪球口径
+UNIVERSE_TYPES = ['混合型-偏股', '混合型-灵活', '指数型-股票', '债券型-长债', '债券型-中短债',
+                  'QDII-普通股票', '货币型-普通货币', '股票型', 'FOF-稳健型']
+
+call_counts = {'fund_individual_basic_info_xq': 0, 'fund_name_em': 0, 'currency_boc_safe': 0}
+_lock = threading.Lock()
+
+
+def _bucket(code):
+    return int(hashlib.md5(code.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _count(name):
+    with _lock:
+        call_counts[name] += 1
+
+
+def fund_individual_basic_info_xq(symbol):
+    """按代码哈希确定性地返回基金类型，以9开头的代码视为不存在"""
+    _count('fund_individual_basic_info_xq')
+    time.sleep(float(os.environ.get('STUB_AKSHARE_LATENCY', '0.05')))
+    if random.random() < float(os.environ.get('STUB_AKSHARE_FAIL_RATE', '0')):
+        raise ConnectionError('stub akshare: simulated network error')
+    if symbol.startswith('9'):
+        raise KeyError('data')
+    fund_type = FUND_TYPES[_bucket(symbol) % len(FUND_TYPES)]
+    return pd.DataFrame({
+        'item': ['基金代码', '基金名称', '基金类型'],
+        'value': [symbol, f'模拟基金{symbol}', fund_type],
+    })
+
+
+def fund_name_em():
+    """返回全市场基金列表，只覆盖部分代码，其余留给逐个查询"""
+    _count('fund_name_em')
+    coverage = float(os.environ.get('STUB_AKSHARE_UNIVERSE', '0.9'))
+    candidates = list(range(1, 30000)) + list(range(160000, 170000)) + list(range(510000, 520000))
+    codes = [f'{i:06d}' for i in candidates if (_bucket(f'{i:06d}') % 1000) < coverage * 1000]
+    return pd.DataFrame({
+        '基金代码': codes,
+        '基金简称': [f'模拟基金{code}' for code in codes],
+        '基金类型': [UNIVERSE_TYPES[_bucket(code) % len(UNIVERSE_TYPES)] for code in codes],
+    })
+
+
+def currency_boc_safe():
+    """返回最近两年工作日的人民币汇率中间价（100外币兑人民币），数值按日期确定性生成"""
+    _count('currency_boc_safe')
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=520)
+    drift = [(_bucket(date.strftime('%Y%m%d')) % 200 - 100) / 10000 for date in dates]
+    return pd.DataFrame({
+        '日期': dates.date,
+        '美元': [round(710 * (1 + d), 2) for d in drift],
+        '欧元': [round(780 * (1 + d), 2) for d in drift],
+        '日元': [round(4.8 * (1 + d), 4) for d in drift],
+        '港元': [round(91 * (1 + d), 3) for d in drift],
+        '英镑': [round(920 * (1 + d), 2) for d in drift],
+    })
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from config_loader import get_setting
+from feishu_bitable import field_text, iter_records, list_records
+from holdings_csv import make_record_key
+from metrics import get_logger, get_metrics
+from record_index import RecordIndex
+
+
+logger = get_logger(__name__)
+
+
+DEFAULT_MIRROR_PATH = os.path.join(os.path.dirname(__file__), 'bitable_mirror.sqlite3')
+
+# 全量同步的间隔：每天定时运行时若设为24小时，启动时间差几分钟就会决定是全量还是增量，
+# 所以默认一周做一次全量扫描（发现被删除的记录），其余运行都是增量同步
+DEFAULT_FULL_SYNC_HOURS = 7 * 24
+
+# 同步和逐条读取镜像时每批处理的记录数
+SYNC_BATCH_SIZE = 5000
+
+
+def hash_fields(fields):
+    """计算字段内容的哈希，用于判断记录是否变化"""
+    content = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class BitableMirror:
+    """飞书多维表格的本地SQLite镜像
+    
+    首次运行或距上次全量同步超过full_sync_hours时做一次全量扫描（可发现被删除的记录），
+    其余时候只拉取"最后更新时间"字段不早于水位线当天的记录。
+    表格中没有该字段时服务端会拒绝筛选条件，自动退回全量扫描。
+    """
+    
+    def __init__(self, db_path=None, modified_field='最后更新时间', full_sync_hours=DEFAULT_FULL_SYNC_HOURS):
+        self.db_path = db_path or DEFAULT_MIRROR_PATH
+        self.modified_field = modified_field
+        self.full_sync_seconds = full_sync_hours * 3600
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS records (
+                app_token TEXT NOT NULL,
+                table_id TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                fund_code TEXT,
+                trading_account TEXT,
+                record_key TEXT,
+                content_hash TEXT NOT NULL,
+                last_modified_time INTEGER,
+                fields_json TEXT NOT NULL,
+                PRIMARY KEY (app_token, table_id, record_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_records_key ON records (app_token, table_id, record_key);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                app_token TEXT NOT NULL,
+                table_id TEXT NOT NULL,
+                watermark INTEGER NOT NULL,
+                last_full_sync REAL NOT NULL,
+                PRIMARY KEY (app_token, table_id)
+            );
+        ''')
+        self.conn.commit()
+    
+    def _get_state(self, app_token, table_id):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT watermark, last_full_sync FROM sync_state WHERE app_token = ? AND table_id = ?',
+                (app_token, table_id)
+            ).fetchone()
+    
+    def needs_full_sync(self, app_token, table_id):
+        """下次同步是否为全量扫描（从未同步过或距上次全量同步超过full_sync_hours）"""
+        state = self._get_state(app_token, table_id)
+        return state is None or time.time() - state[1] > self.full_sync_seconds
+    
+    def sync(self, client, app_token, table_id, tenant_access_token, full=False):
+        """同步镜像，返回本次拉取的记录数"""
+        state = self._get_state(app_token, table_id)
+        full = full or self.needs_full_sync(app_token, table_id)
+        
+        filter_formula = None
+        if not full:
+            # 按天比较，与水位线同一天修改的记录会被重复拉取，写入是幂等的
+            watermark_date = datetime.fromtimestamp(state[0] / 1000).strftime('%Y-%m-%d')
+            filter_formula = f'CurrentValue.[{self.modified_field}]>=TODATE("{watermark_date}")'
+            logger.info(f"🔄 增量同步镜像（{watermark_date}之后修改的记录）...")
+        else:
+            logger.info("🔄 全量同步镜像...")
+        
+        watermark = state[0] if state else 0
+        pulled = 0
+        rows = []
+        sync_start = time.perf_counter()
+        with self.lock:
+            try:
+                if full:
+                    self.conn.execute('DELETE FROM records WHERE app_token = ? AND table_id = ?',
+                                      (app_token, table_id))
+                # 分批写入镜像，同步再大的表格内存中也只有一批记录；全部写完才提交，
+                # 任何一页获取失败都会抛出异常（strict），不会把只扫描了一部分的结果当作完整镜像提交
+                for record in iter_records(client, app_token, table_id, tenant_access_token,
+                                           filter_formula=filter_formula, automatic_fields=True, strict=True):
+                    fields = record.fields if record.fields else {}
+                    fund_code = field_text(fields.get('基金代码'))
+                    trading_account = field_text(fields.get('交易账户'))
+                    record_key = make_record_key(fund_code, trading_account) if fund_code and trading_account else None
+                    modified_time = record.last_modified_time or 0
+                    watermark = max(watermark, modified_time)
+                    rows.append((app_token, table_id, record.record_id, fund_code, trading_account, record_key,
+                                 hash_fields(fields), modified_time,
+                                 json.dumps(fields, ensure_ascii=False, default=str)))
+                    if len(rows) >= SYNC_BATCH_SIZE:
+                        self._insert_rows(rows)
+                        pulled += len(rows)
+                        rows = []
+                self._insert_rows(rows)
+                pulled += len(rows)
+                last_full_sync = time.time() if full else state[1]
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO sync_state (app_token, table_id, watermark, last_full_sync) VALUES (?, ?, ?, ?)',
+                    (app_token, table_id, watermark, last_full_sync)
+                )
+                self.conn.commit()
+            except BaseException:
+                # 同步中途失败时放弃本次写入，镜像保持上次同步的状态
+                self.conn.rollback()
+                raise
+        
+        metrics = get_metrics()
+        metrics.observe('mirror_full_sync' if full else 'mirror_incremental_sync', time.perf_counter() - sync_start)
+        metrics.incr('mirror_records_pulled', pulled)
+        logger.info(f"✅ 镜像同步完成，本次拉取 {pulled} 条记录")
+        return pulled
+    
+    def _insert_rows(self, rows):
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO records (app_token, table_id, record_id, fund_code, trading_account, '
+            'record_key, content_hash, last_modified_time, fields_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            rows
+        )
+    
+    def records(self, app_token, table_id):
+        """从镜像读取所有记录，返回[(record_id, fields), ...]"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT record_id, fields_json FROM records WHERE app_token = ? AND table_id = ?',
+                (app_token, table_id)
+            ).fetchall()
+        return [(record_id, json.loads(fields_json)) for record_id, fields_json in rows]
+    
+    def iter_records(self, app_token, table_id):
+        """逐条读取镜像中的记录(record_id, fields)，不一次性载入整张表
+        
+        每批按rowid分页读取，读完一批就释放锁再逐条返回：调用方提前结束迭代或在循环中使用镜像都不会一直占着锁
+        """
+        last_rowid = -1
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    'SELECT rowid, record_id, fields_json FROM records WHERE app_token = ? AND table_id = ? '
+                    'AND rowid > ? ORDER BY rowid LIMIT ?',
+                    (app_token, table_id, last_rowid, SYNC_BATCH_SIZE)
+                ).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+            for _, record_id, fields_json in rows:
+                yield record_id, json.loads(fields_json)
+    
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def get_bitable_mirror():
+    """获取全局共享的表格镜像，路径和同步参数可在config.json中配置"""
+    global _mirror
+    with _mirror_lock:
+        if _mirror is None:
+            _mirror = BitableMirror(
+                db_path=get_setting('bitable_mirror_path', DEFAULT_MIRROR_PATH),
+                modified_field=get_setting('bitable_mirror_modified_field', '最后更新时间'),
+                full_sync_hours=get_setting('bitable_mirror_full_sync_hours', DEFAULT_FULL_SYNC_HOURS),
+            )
+        return _mirror
+
+
+def is_mirror_enabled():
+    """是否启用本地镜像，可在config.json中通过use_bitable_mirror关闭"""
+    return bool(get_setting('use_bitable_mirror', True))
+
+
+def _sync_mirror(client, app_token, table_id, tenant_access_token):
+    """同步镜像，失败时返回None以便调用方退回直接扫描表格"""
+    if not is_mirror_enabled():
+        return None
+    try:
+        mirror = get_bitable_mirror()
+        mirror.sync(client, app_token, table_id, tenant_access_token)
+        return mirror
+    except Exception as e:
+        logger.warning(f"⚠️  本地镜像同步失败: {str(e)}，改为直接扫描表格")
+        return None
+
+
+def load_all_records(client, app_token, table_id, tenant_access_token):
+    """获取表格中的所有记录[(record_id, fields), ...]，优先由本地镜像提供"""
+    mirror = _sync_mirror(client, app_token, table_id, tenant_access_token)
+    if mirror is None:
+        return list_records(client, app_token, table_id, tenant_access_token)
+    
+    records = mirror.records(app_token, table_id)
+    logger.info(f"📋 已从本地镜像获取 {len(records)} 条记录")
+    return records
+
+
+def iter_table_records(client, app_token, table_id, tenant_access_token):
+    """逐条返回表格中的记录(record_id, fields)，不同时持有整张表的字段
+    
+    优先同步本地镜像后从镜像读取，镜像不可用时直接分页扫描表格；
+    client为None时不联网，只读镜像中上次同步时的内容（镜像未启用时没有记录）
+    """
+    if client is None:
+        if is_mirror_enabled():
+            yield from get_bitable_mirror().iter_records(app_token, table_id)
+        return
+    
+    mirror = _sync_mirror(client, app_token, table_id, tenant_access_token)
+    if mirror is None:
+        logger.info("📋 正在扫描飞书表格中的现有记录...")
+        for record in iter_records(client, app_token, table_id, tenant_access_token):
+            yield record.record_id, record.fields or {}
+    else:
+        yield from mirror.iter_records(app_token, table_id)
+
+
+def load_record_index(client, app_token, table_id, tenant_access_token, field_names=None, numeric_fields=()):
+    """获取(基金代码, 交易账户) → RecordRef的紧凑索引，不保留字段内容
+    
+    给出field_names时每条记录带上这些字段的内容摘要，用于判断CSV行是否有变化；
+    记录来源见iter_table_records
+    """
+    record_index = RecordIndex.from_fields(iter_table_records(client, app_token, table_id, tenant_access_token),
+                                           field_names, numeric_fields)
+    logger.info(f"📋 已获取 {len(record_index)} 条现有记录的索引")
+    return record_index
+
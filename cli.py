@@ -0,0 +1,179 @@
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import sys
+from config_loader import load_config, prefetch_feishu_config, wait_for_tenant_access_token
+from feishu_bitable import create_client, preload_feishu_sdk
+from run_planner import plan_fund_types, plan_import, plan_pipeline, plan_tags
+from work_scheduler import PRIORITIES
+from portfolio import DIMENSIONS
+from metrics import configure_logging, get_logger, write_run_summary
+
+
+logger = get_logger(__name__)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='基金持仓表格工具（非交互，可用于定时任务；未给出的参数取config.json中的配置）')
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--app-token', help='多维表格App Token')
+    common.add_argument('--table-id', help='数据表ID')
+    common.add_argument('--tenant-access-token', help='默认按config.json中的app_id/app_secret获取')
+    common.add_argument('--resume', action='store_true', help='跳过上次中断前已完成的工作')
+    common.add_argument('--plan', action='store_true',
+                        help='只预估工作量（待创建/待更新/跳过/akshare查询、API调用次数和耗时），不写入任何数据')
+    common.add_argument('--offline', action='store_true',
+                        help='与--plan一起使用：不同步镜像，直接按本地镜像预估，不需要token')
+    common.add_argument('--json', action='store_true', help='与--plan一起使用：以JSON格式输出计划')
+
+    # 补全基金类型/标签的命令可以限时运行，先处理重要的记录
+    schedule = argparse.ArgumentParser(add_help=False)
+    schedule.add_argument('--priority', choices=PRIORITIES,
+                          help='处理顺序：asset资产从大到小（默认）、failed先处理获取失败的、new先处理新记录、none原始顺序')
+    schedule.add_argument('--time-budget', type=float, metavar='SECONDS',
+                          help='时间预算（秒），用完后停止查询和写入，剩余的留待下次运行（可配合--resume）')
+    
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='命令')
+
+    import_parser = subparsers.add_parser('import', parents=[common], help='导入CSV（按基金代码+交易账户新建或更新）')
+    import_parser.add_argument('csv', help='持仓CSV文件')
+    import_parser.add_argument('--single', action='store_true', help='逐条写入（默认批量写入）')
+    import_parser.add_argument('--stream', action='store_true', default=None,
+                               help='分块流式导入，内存占用与文件大小无关（适合超大的导出文件）')
+
+    type_parser = subparsers.add_parser('type', parents=[common, schedule], help='补全表格中的基金类型')
+    type_parser.add_argument('--per-fund', action='store_true', help='不使用全市场基金列表，逐个查询')
+
+    subparsers.add_parser('tag', parents=[common, schedule], help='为表格中的记录匹配标签')
+
+    pipeline_parser = subparsers.add_parser('pipeline', parents=[common, schedule], help='导入 → 基金类型 → 标签，每条记录只写入一次')
+    pipeline_parser.add_argument('csv', help='持仓CSV文件')
+    pipeline_parser.add_argument('--per-fund', action='store_true', help='不使用全市场基金列表，逐个查询')
+    
+    report_parser = subparsers.add_parser('report', help='组合净值和按基金/类型/标签/账户等汇总的资产占比（不需要token）')
+    report_parser.add_argument('csv', help='持仓CSV文件')
+    report_parser.add_argument('--by', nargs='+', choices=list(DIMENSIONS), metavar='维度',
+                               help=f"只输出这些维度（{'、'.join(f'{key}={name}' for key, name in DIMENSIONS.items())}），默认全部")
+    report_parser.add_argument('--top', type=int, default=10, help='每个维度最多输出的行数，0表示全部')
+    report_parser.add_argument('--refresh', action='store_true', help='忽略缓存的汇总结果，重新读取CSV汇总')
+    report_parser.add_argument('--json', action='store_true', help='以JSON格式输出')
+    return parser
+
+
+def make_plan(args, client, app_token, table_id, tenant_access_token):
+    if args.command == 'import':
+        return plan_import(client, app_token, table_id, args.csv, tenant_access_token,
+                           batch_mode=not args.single, resume=args.resume)
+    if args.command == 'type':
+        return plan_fund_types(client, app_token, table_id, tenant_access_token,
+                               bulk_mode=not args.per_fund, resume=args.resume)
+    if args.command == 'tag':
+        return plan_tags(client, app_token, table_id, tenant_access_token, resume=args.resume)
+    return plan_pipeline(client, app_token, table_id, args.csv, tenant_access_token,
+                         bulk_mode=not args.per_fund, resume=args.resume)
+
+
+def run_job(args, app_token, table_id, tenant_access_token):
+    """执行命令，返回失败数；前置步骤失败（如无法创建列）时返回None"""
+    if args.command == 'import':
+        result = importlib.import_module('import').import_csv_to_feishu(
+            app_token, table_id, args.csv, tenant_access_token, batch_mode=not args.single, resume=args.resume,
+            stream=args.stream)
+        return result[1]
+    if args.command == 'type':
+        from update_fund_type import update_fund_types
+        result = update_fund_types(app_token, table_id, tenant_access_token, bulk_mode=not args.per_fund,
+                                   resume=args.resume, priority=args.priority, time_budget=args.time_budget)
+        return result and result[1]
+    if args.command == 'tag':
+        from add_fund_tags import update_fund_tags
+        result = update_fund_tags(app_token, table_id, tenant_access_token, resume=args.resume,
+                                  priority=args.priority, time_budget=args.time_budget)
+        return result and result[1]
+    from pipeline import run_pipeline
+    result = run_pipeline(app_token, table_id, args.csv, tenant_access_token, bulk_mode=not args.per_fund,
+                          resume=args.resume, priority=args.priority, time_budget=args.time_budget)
+    return result and result[3]
+
+
+def run_report(args):
+    """汇总持仓文件，返回(进程退出码, 报告)"""
+    from portfolio import PortfolioReport, get_portfolio_snapshot
+    
+    if not os.path.exists(args.csv):
+        logger.error(f"❌ 文件不存在: {args.csv}")
+        return 1, None
+    snapshot = get_portfolio_snapshot(args.csv, refresh=args.refresh)
+    return 0, PortfolioReport(snapshot, args.by, args.top)
+
+
+def run(args):
+    """执行一条命令，返回(进程退出码, 输出)：退出码0为成功、1为失败，--plan时输出计划，report输出汇总报告"""
+    if args.command == 'report':
+        return run_report(args)
+    
+    needs_token = not (args.plan and args.offline)
+    if needs_token:
+        preload_feishu_sdk()
+
+    config = {}
+    if not (args.app_token and args.table_id and (args.tenant_access_token or not needs_token)):
+        try:
+            config = load_config()
+        except Exception as e:
+            logger.error(f"❌ 加载配置文件失败: {str(e)}")
+            return 1, None
+    app_token = args.app_token or config['app_token']
+    table_id = args.table_id or config['table_id']
+
+    # token在后台获取，同时检查CSV
+    config_future = prefetch_feishu_config() if needs_token and not args.tenant_access_token else None
+    csv_file_path = getattr(args, 'csv', None)
+    if csv_file_path and not os.path.exists(csv_file_path):
+        logger.error(f"❌ 文件不存在: {csv_file_path}")
+        return 1, None
+
+    tenant_access_token = None
+    if needs_token:
+        tenant_access_token = args.tenant_access_token or wait_for_tenant_access_token(config_future)
+        if not tenant_access_token:
+            logger.error("❌ 没有可用的tenant_access_token")
+            return 1, None
+
+    if args.plan:
+        client = create_client() if needs_token else None
+        return 0, make_plan(args, client, app_token, table_id, tenant_access_token)
+
+    error_count = run_job(args, app_token, table_id, tenant_access_token)
+    return (0 if error_count == 0 else 1), None
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    configure_logging()
+    
+    # --json时日志改写到stderr，stdout上只有计划/报告本身，便于调度程序解析
+    output = None
+    with contextlib.redirect_stdout(sys.stderr if args.json else sys.stdout):
+        try:
+            exit_code, output = run(args)
+        except KeyboardInterrupt:
+            logger.warning("\n⚠️  用户中断操作")
+            exit_code = 130
+        finally:
+            write_run_summary(f'cli_{args.command}')
+    
+    if output is not None:
+        if args.json:
+            print(json.dumps(output.to_dict(), ensure_ascii=False, indent=2))
+        else:
+            output.log()
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
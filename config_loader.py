@@ -1,39 +1,122 @@
 import json
 import os
-import requests
-import time
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from metrics import get_logger, get_metrics
 
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl，退化为仅进程内加锁
+    fcntl = None
 
-# 全局变量用于缓存token
+
+logger = get_logger(__name__)
+
+# 进程内token缓存
 _cached_token = None
 _token_expire_time = None
+_token_lock = threading.Lock()
+
+# 跨进程共享的token缓存文件及其文件锁
+TOKEN_CACHE_PATH = os.path.join(os.path.dirname(__file__), '.token_cache.json')
+TOKEN_LOCK_PATH = TOKEN_CACHE_PATH + '.lock'
+
+# 提前5分钟刷新token
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+@contextmanager
+def _token_file_lock():
+    """获取token缓存文件的排他锁，保证多个进程只有一个去刷新token"""
+    with open(TOKEN_LOCK_PATH, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _read_token_cache(app_id):
+    """从共享缓存文件读取token，返回(token, 过期时间)，没有则返回(None, None)"""
+    try:
+        with open(TOKEN_CACHE_PATH, 'r', encoding='utf-8') as f:
+            entry = json.load(f).get(app_id)
+        if entry:
+            return entry['token'], datetime.fromtimestamp(entry['expire_at'])
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError, ValueError):
+        pass
+    return None, None
+
+
+def _write_token_cache(app_id, token, expire_time):
+    """原子写入共享缓存文件（先写临时文件再替换），文件权限仅限当前用户"""
+    try:
+        with open(TOKEN_CACHE_PATH, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+    
+    cache[app_id] = {'token': token, 'expire_at': expire_time.timestamp()}
+    
+    temp_path = TOKEN_CACHE_PATH + '.tmp'
+    with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+    os.replace(temp_path, TOKEN_CACHE_PATH)
+
+
+def _is_token_valid(token, expire_time):
+    return bool(token and expire_time and datetime.now() < expire_time - TOKEN_REFRESH_MARGIN)
 
 
 def get_tenant_access_token(app_id, app_secret):
-    """通过飞书API获取tenant_access_token"""
+    """获取tenant_access_token
+    
+    依次查找进程内缓存和跨进程共享的缓存文件；都失效时在文件锁内刷新，
+    并发的线程/进程只会有一个真正请求飞书API，其余等待后直接读取新token
+    """
     global _cached_token, _token_expire_time
     
-    print(f"🔍 [DEBUG] 开始获取token，当前时间: {datetime.now()}")
-    print(f"🔍 [DEBUG] 缓存状态 - token存在: {_cached_token is not None}, 过期时间: {_token_expire_time}")
+    if _is_token_valid(_cached_token, _token_expire_time):
+        return _cached_token
     
-    # 检查缓存的token是否还有效（提前5分钟刷新）
-    if _cached_token and _token_expire_time:
-        time_until_refresh = _token_expire_time - timedelta(minutes=5) - datetime.now()
-        print(f"🔍 [DEBUG] 距离刷新时间还有: {time_until_refresh}")
-        
-        if datetime.now() < _token_expire_time - timedelta(minutes=5):
-            print("✅ 使用缓存的tenant_access_token")
-            print(f"🔍 [DEBUG] 返回缓存token: {_cached_token[:20]}...")
+    with _token_lock:
+        # 其他线程可能已经刷新
+        if _is_token_valid(_cached_token, _token_expire_time):
             return _cached_token
-        else:
-            print("⏰ 缓存token即将过期，需要刷新")
-    else:
-        print("🔍 [DEBUG] 没有有效的缓存token")
+        
+        with _token_file_lock():
+            # 其他进程可能已经刷新
+            token, expire_time = _read_token_cache(app_id)
+            if _is_token_valid(token, expire_time):
+                get_metrics().incr('token_cache_hits')
+                logger.info("✅ 使用缓存的tenant_access_token")
+                logger.debug(f"🔍 缓存token过期时间: {expire_time}")
+                _cached_token, _token_expire_time = token, expire_time
+                return token
+            
+            token, expire_seconds = _fetch_tenant_access_token(app_id, app_secret)
+            expire_time = datetime.now() + timedelta(seconds=expire_seconds)
+            
+            try:
+                _write_token_cache(app_id, token, expire_time)
+            except OSError as e:
+                logger.warning(f"⚠️  写入token缓存文件失败: {str(e)}")
+            
+            _cached_token, _token_expire_time = token, expire_time
+            logger.debug(f"🔍 缓存更新完成，过期时间: {_token_expire_time}")
+            return token
+
+
+def _fetch_tenant_access_token(app_id, app_secret):
+    """通过飞书API获取tenant_access_token，返回(token, 有效期秒数)"""
+    import requests
     
-    print("🔄 正在获取新的tenant_access_token...")
-    print(f"🔍 [DEBUG] 使用app_id: {app_id}")
-    print(f"🔍 [DEBUG] 使用app_secret: {app_secret[:10]}...")
+    logger.info("🔄 正在获取新的tenant_access_token...")
+    logger.debug(f"🔍 使用app_id: {app_id}")
     
     url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
     headers = {
@@ -45,43 +128,36 @@ def get_tenant_access_token(app_id, app_secret):
     }
     
     try:
-        print(f"🔍 [DEBUG] 发送请求到: {url}")
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
-        print(f"🔍 [DEBUG] 响应状态码: {response.status_code}")
+        logger.debug(f"🔍 发送请求到: {url}")
+        get_metrics().incr('token_fetches')
+        with get_metrics().timer('token_fetch'):
+            response = requests.post(url, headers=headers, json=payload, timeout=10)
+        logger.debug(f"🔍 响应状态码: {response.status_code}")
         
         response.raise_for_status()
         
         result = response.json()
-        print(f"🔍 [DEBUG] API响应: {result}")
         
         if result.get("code") == 0:
             token = result.get("tenant_access_token")
             expire_seconds = result.get("expire", 7200)  # 默认2小时
             
-            print(f"🔍 [DEBUG] 获取到新token: {token[:20]}...")
-            print(f"🔍 [DEBUG] token有效期: {expire_seconds}秒")
-            
-            # 缓存token和过期时间
-            _cached_token = token
-            _token_expire_time = datetime.now() + timedelta(seconds=expire_seconds)
-            
-            print(f"🔍 [DEBUG] 缓存更新完成，过期时间: {_token_expire_time}")
-            print(f"✅ 成功获取tenant_access_token，有效期: {expire_seconds}秒")
-            return token
+            logger.info(f"✅ 成功获取tenant_access_token，有效期: {expire_seconds}秒")
+            return token, expire_seconds
         else:
             error_msg = result.get("msg", "未知错误")
-            print(f"❌ [DEBUG] 飞书API返回错误码: {result.get('code')}, 错误信息: {error_msg}")
+            logger.error(f"❌ 飞书API返回错误码: {result.get('code')}, 错误信息: {error_msg}")
             raise Exception(f"飞书API返回错误: {error_msg}")
             
     except requests.exceptions.RequestException as e:
-        print(f"❌ [DEBUG] 网络请求异常: {str(e)}")
+        logger.error(f"❌ 网络请求异常: {str(e)}")
         raise Exception(f"请求飞书API失败: {str(e)}")
     except json.JSONDecodeError as e:
-        print(f"❌ [DEBUG] JSON解析错误: {str(e)}")
-        print(f"❌ [DEBUG] 响应内容: {response.text if 'response' in locals() else 'N/A'}")
+        logger.error(f"❌ JSON解析错误: {str(e)}")
+        logger.debug(f"❌ 响应内容: {response.text if 'response' in locals() else 'N/A'}")
         raise Exception("飞书API返回的数据格式错误")
     except Exception as e:
-        print(f"❌ [DEBUG] 其他异常: {str(e)}")
+        logger.error(f"❌ 其他异常: {str(e)}")
         raise Exception(f"获取tenant_access_token失败: {str(e)}")
 
 
@@ -91,13 +167,13 @@ def load_config(config_path=None):
         # 默认配置文件路径
         config_path = os.path.join(os.path.dirname(__file__), 'config.json')
     
-    print(f"🔍 [DEBUG] 加载配置文件: {config_path}")
+    logger.debug(f"🔍 加载配置文件: {config_path}")
     
     try:
         with open(config_path, 'r', encoding='utf-8') as f:
             config = json.load(f)
         
-        print(f"🔍 [DEBUG] 配置文件内容: {list(config.keys())}")
+        logger.debug(f"🔍 配置文件内容: {list(config.keys())}")
         
         # 验证必要的配置项
         required_keys = ['app_token', 'table_id', 'app_id', 'app_secret']
@@ -105,58 +181,44 @@ def load_config(config_path=None):
             if key not in config:
                 raise ValueError(f"配置文件缺少必要参数: {key}")
         
-        print(f"✅ [DEBUG] 配置文件验证通过")
+        logger.debug("✅ 配置文件验证通过")
         return config
     except FileNotFoundError:
-        print(f"❌ [DEBUG] 配置文件不存在: {config_path}")
+        logger.error(f"❌ 配置文件不存在: {config_path}")
         raise FileNotFoundError(f"配置文件不存在: {config_path}")
     except json.JSONDecodeError as e:
-        print(f"❌ [DEBUG] 配置文件JSON格式错误: {str(e)}")
+        logger.error(f"❌ 配置文件JSON格式错误: {str(e)}")
         raise ValueError(f"配置文件格式错误: {config_path}")
 
 
 def get_feishu_config():
     """获取飞书相关配置，包括动态获取的tenant_access_token"""
-    print("🔍 [DEBUG] ========== 开始获取飞书配置 ==========")
+    logger.debug("🔍 ========== 开始获取飞书配置 ==========")
     
     config = load_config()
     original_token = config.get('tenant_access_token', '')
     
-    print(f"🔍 [DEBUG] 配置文件中的tenant_access_token: {original_token[:20]}...")
+    logger.debug(f"🔍 配置文件中的tenant_access_token: {original_token[:20]}...")
     
-    # 动态获取tenant_access_token
+    # 动态获取tenant_access_token（保存在共享缓存文件中，不再改写config.json）
     try:
-        print("🔍 [DEBUG] 尝试动态获取tenant_access_token")
+        logger.debug("🔍 尝试动态获取tenant_access_token")
         tenant_access_token = get_tenant_access_token(
             config['app_id'], 
             config['app_secret']
         )
-        print(f"🔍 [DEBUG] 动态获取成功，token: {tenant_access_token[:20]}...")
-        
-        # 如果获取到的token与配置文件中的不同，更新配置文件
-        if tenant_access_token != original_token:
-            print("🔄 检测到新token，正在更新配置文件...")
-            update_success = update_config({
-                'tenant_access_token': tenant_access_token
-            })
-            if update_success:
-                print("✅ 配置文件已更新为最新token")
-            else:
-                print("⚠️  配置文件更新失败，但将使用新token")
-        else:
-            print("ℹ️  token未发生变化，无需更新配置文件")
-            
+        logger.debug(f"🔍 动态获取成功，token: {tenant_access_token[:20]}...")
     except Exception as e:
-        print(f"⚠️  获取tenant_access_token失败: {str(e)}")
-        print(f"🔍 [DEBUG] 异常详情: {type(e).__name__}: {str(e)}")
+        logger.warning(f"⚠️  获取tenant_access_token失败: {str(e)}")
+        logger.debug(f"🔍 异常详情: {type(e).__name__}: {str(e)}")
         
         # 如果配置文件中有备用的tenant_access_token，使用它
         tenant_access_token = config.get('tenant_access_token', '')
         if tenant_access_token:
-            print("🔄 使用配置文件中的备用tenant_access_token")
-            print(f"🔍 [DEBUG] 备用token: {tenant_access_token[:20]}...")
+            logger.info("🔄 使用配置文件中的备用tenant_access_token")
+            logger.debug(f"🔍 备用token: {tenant_access_token[:20]}...")
         else:
-            print("❌ [DEBUG] 没有备用token可用")
+            logger.error("❌ 没有备用token可用")
             raise Exception("无法获取有效的tenant_access_token")
     
     final_config = {
@@ -167,12 +229,53 @@ def get_feishu_config():
         'app_secret': config['app_secret']
     }
     
-    print(f"🔍 [DEBUG] 最终返回的token: {final_config['tenant_access_token'][:20]}...")
-    print("🔍 [DEBUG] ========== 飞书配置获取完成 ==========\n")
+    logger.debug(f"🔍 最终返回的token: {final_config['tenant_access_token'][:20]}...")
+    logger.debug("🔍 ========== 飞书配置获取完成 ==========")
     
     return final_config
 
 
+def prefetch_feishu_config():
+    """在后台线程中执行get_feishu_config，立即返回Future
+    
+    获取token可能要发一次网络请求，入口脚本在交互提示和读取CSV的同时完成它，真正需要token时再取结果
+    """
+    future = Future()
+    
+    def run():
+        try:
+            future.set_result(get_feishu_config())
+        except Exception as e:
+            future.set_exception(e)
+    
+    threading.Thread(target=run, name='feishu-config-prefetch', daemon=True).start()
+    return future
+
+
+def wait_for_tenant_access_token(config_future):
+    """等待prefetch_feishu_config完成并返回其中的token，没有可用token时返回空字符串"""
+    if config_future is None:
+        return ''
+    try:
+        return config_future.result()['tenant_access_token']
+    except Exception as e:
+        logger.error(f"❌ 获取tenant_access_token失败: {str(e)}")
+        return ''
+
+
+def get_setting(key, default=None, config_path=None):
+    """读取config.json中的可选配置项（如限流、缓存参数），缺失时返回默认值"""
+    if config_path is None:
+        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
+    
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return config.get(key, default)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
 def update_config(updates, config_path=None):
     """更新配置文件"""
     if config_path is None:
@@ -189,17 +292,22 @@ def update_config(updates, config_path=None):
         with open(config_path, 'w', encoding='utf-8') as f:
             json.dump(config, f, indent=2, ensure_ascii=False)
         
-        print(f"✅ 配置已更新: {config_path}")
+        logger.info(f"✅ 配置已更新: {config_path}")
         return True
     except Exception as e:
-        print(f"❌ 更新配置失败: {str(e)}")
+        logger.error(f"❌ 更新配置失败: {str(e)}")
         return False
 
 
 def clear_token_cache():
-    """清除token缓存，强制重新获取"""
+    """清除token缓存（包括共享缓存文件），强制重新获取"""
     global _cached_token, _token_expire_time
-    print(f"🔍 [DEBUG] 清除前 - token: {_cached_token[:20] if _cached_token else 'None'}..., 过期时间: {_token_expire_time}")
-    _cached_token = None
-    _token_expire_time = None
-    print("🗑️  已清除token缓存")
\ No newline at end of file
+    with _token_lock:
+        _cached_token = None
+        _token_expire_time = None
+        with _token_file_lock():
+            try:
+                os.remove(TOKEN_CACHE_PATH)
+            except FileNotFoundError:
+                pass
+    logger.info("🗑️  已清除token缓存")
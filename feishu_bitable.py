@@ -0,0 +1,434 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import CancelledError
+from config_loader import get_setting
+from feishu_executor import get_executor
+from holdings_csv import clean_text_value, make_record_key
+from metrics import get_logger, get_metrics
+
+
+logger = get_logger(__name__)
+
+
+# 飞书批量接口单次最多写入500条记录
+BATCH_SIZE = 500
+
+# record_digest中每个字段摘要的字节数
+FIELD_DIGEST_SIZE = 8
+
+
+def _import_sdk():
+    """导入飞书SDK，导入后的模块留在sys.modules中，之后函数内的import直接复用"""
+    import lark_oapi
+    from lark_oapi.api.bitable import v1
+
+
+def preload_feishu_sdk():
+    """在后台线程中导入飞书SDK并立即返回
+
+    lark_oapi导入时会加载全部开放平台接口，耗时数秒，所以本模块只在函数内部导入它；
+    入口脚本启动时调用本函数，让导入与交互提示、读取CSV同时进行，首次调用接口时不必再等待
+    """
+    thread = threading.Thread(target=_import_sdk, name='lark-sdk-preload', daemon=True)
+    thread.start()
+    return thread
+
+
+def create_client(domain=None):
+    """创建飞书client，domain默认取config.json中的feishu_domain（可指向私有部署或本地模拟服务）"""
+    import lark_oapi as lark
+    
+    if domain is None:
+        domain = get_setting('feishu_domain', lark.FEISHU_DOMAIN)
+    return lark.Client.builder() \
+        .domain(domain) \
+        .enable_set_token(True) \
+        .log_level(lark.LogLevel.INFO) \
+        .build()
+
+
+def build_filter_formula(field_name, values):
+    """生成"字段等于任一取值"的多维表格筛选公式"""
+    conditions = [f'CurrentValue.[{field_name}]="{value}"' for value in values]
+    return conditions[0] if len(conditions) == 1 else f"OR({','.join(conditions)})"
+
+
+def iter_records(client, app_token, table_id, tenant_access_token, filter_formula=None, field_names=None,
+                 automatic_fields=False, strict=False):
+    """分页获取飞书表格中的记录，逐条返回SDK记录对象
+    
+    filter_formula: 服务端筛选公式，只返回满足条件的记录
+    field_names: 只返回指定的字段
+    automatic_fields: 同时返回创建/最后修改时间等系统字段
+    strict: 某一页获取失败时抛出异常，而不是记录错误后停止（只返回了部分记录），
+            用于必须拿到完整结果的场景（如同步本地镜像）
+    服务端拒绝筛选条件时（例如字段不存在）会退回到不筛选的完整扫描
+    """
+    import lark_oapi as lark
+    from lark_oapi.api.bitable.v1 import ListAppTableRecordRequest
+    
+    page_token = None
+    
+    while True:
+        try:
+            # 构建查询请求
+            request_builder = ListAppTableRecordRequest.builder() \
+                .app_token(app_token) \
+                .table_id(table_id) \
+                .page_size(500)  # 每页最多500条记录
+            
+            if page_token:
+                request_builder.page_token(page_token)
+            if filter_formula:
+                request_builder.filter(filter_formula)
+            if field_names:
+                request_builder.field_names(json.dumps(list(field_names), ensure_ascii=False))
+            if automatic_fields:
+                request_builder.automatic_fields(True)
+            
+            request = request_builder.build()
+            option = lark.RequestOption.builder().tenant_access_token(tenant_access_token).build()
+            response = get_executor().call(app_token, lambda: client.bitable.v1.app_table_record.list(request, option),
+                                           stage='list')
+            
+            if not response.success():
+                if (filter_formula or field_names) and page_token is None:
+                    logger.warning(f"⚠️  服务端筛选失败: {response.msg}，改为获取全部记录")
+                    yield from iter_records(client, app_token, table_id, tenant_access_token,
+                                            automatic_fields=automatic_fields, strict=strict)
+                    return
+                logger.error(f"❌ 获取记录失败: {response.msg}")
+                if strict:
+                    raise Exception(f"获取记录失败: {response.msg}")
+                break
+            
+            metrics = get_metrics()
+            metrics.incr('list_pages')
+            if response.raw is not None and response.raw.content:
+                metrics.incr('list_bytes', len(response.raw.content))
+            
+            # 处理返回的记录
+            if response.data and response.data.items:
+                metrics.incr('list_records', len(response.data.items))
+                yield from response.data.items
+            
+            # 检查是否还有更多页
+            if not response.data.has_more:
+                break
+            
+            page_token = response.data.page_token
+            
+        except Exception as e:
+            if strict:
+                raise
+            logger.error(f"❌ 获取记录时出错: {str(e)}")
+            break
+
+
+def list_records(client, app_token, table_id, tenant_access_token, filter_formula=None, field_names=None):
+    """分页获取飞书表格中的记录，返回[(record_id, fields), ...]，参数同iter_records"""
+    return [
+        (record.record_id, record.fields if record.fields else {})
+        for record in iter_records(client, app_token, table_id, tenant_access_token, filter_formula, field_names)
+    ]
+
+
+def normalize_compare_value(value, is_numeric):
+    """将CSV值或飞书返回的字段值统一为可比较的形式"""
+    # 飞书文本字段可能以富文本片段列表的形式返回
+    if isinstance(value, list):
+        value = ''.join(
+            str(item.get('text', '')) if isinstance(item, dict) else str(item)
+            for item in value
+        )
+    
+    if value is None or value == '':
+        return None
+    
+    if is_numeric:
+        try:
+            # 四舍五入消除浮点误差
+            return round(float(value), 6)
+        except (TypeError, ValueError):
+            return clean_text_value(value)
+    
+    return clean_text_value(value)
+
+
+def field_text(value):
+    """将飞书返回的字段值转换为纯文本，空值返回空字符串"""
+    return normalize_compare_value(value, False) or ''
+
+
+def diff_record_fields(cleaned_row, existing_fields, numeric_fields):
+    """比较CSV行与现有记录，返回值发生变化的字段"""
+    changed_fields = {}
+    for field_name, value in cleaned_row.items():
+        is_numeric = field_name in numeric_fields
+        new_value = normalize_compare_value(value, is_numeric)
+        old_value = normalize_compare_value(existing_fields.get(field_name), is_numeric)
+        if new_value != old_value:
+            changed_fields[field_name] = value
+    return changed_fields
+
+
+def field_digest(value):
+    """单个比较值（normalize_compare_value的结果）的FIELD_DIGEST_SIZE字节摘要
+
+    按repr计算，数字与文本、None与空文本互不相同；-0.0与0.0比较时相等，先统一为0.0
+    """
+    if isinstance(value, float):
+        value += 0.0
+    return hashlib.blake2b(repr(value).encode('utf-8'), digest_size=FIELD_DIGEST_SIZE).digest()
+
+
+def record_digest(fields, field_names, numeric_fields):
+    """按指定字段计算记录内容的摘要：每个字段一个field_digest，按field_names的顺序拼接
+
+    CSV行与飞书记录的摘要相同即diff_record_fields无差异（除非摘要碰撞，每个字段约2^-64）；
+    不同时用diff_digest_fields找出变化的字段
+    """
+    return b''.join(field_digest(normalize_compare_value(fields.get(field_name), field_name in numeric_fields))
+                    for field_name in field_names)
+
+
+def diff_digest_fields(cleaned_row, existing_digest, field_names, numeric_fields):
+    """按摘要比较CSV行与现有记录，返回值发生变化的字段（结果同diff_record_fields，但不需要现有记录的字段内容）
+
+    existing_digest是现有记录按同样的field_names算出的record_digest
+    """
+    digest = record_digest(cleaned_row, field_names, numeric_fields)
+    changed_fields = {}
+    for position, field_name in enumerate(field_names):
+        start = position * FIELD_DIGEST_SIZE
+        if field_name in cleaned_row and digest[start:start + FIELD_DIGEST_SIZE] != \
+                existing_digest[start:start + FIELD_DIGEST_SIZE]:
+            changed_fields[field_name] = cleaned_row[field_name]
+    return changed_fields
+
+
+def update_record(client, app_token, table_id, record_id, fields, tenant_access_token):
+    """更新飞书表格中的记录"""
+    import lark_oapi as lark
+    from lark_oapi.api.bitable.v1 import AppTableRecord, UpdateAppTableRecordRequest
+    
+    try:
+        request = UpdateAppTableRecordRequest.builder() \
+            .app_token(app_token) \
+            .table_id(table_id) \
+            .record_id(record_id) \
+            .request_body(AppTableRecord.builder()
+                .fields(fields)
+                .build()) \
+            .build()
+        
+        option = lark.RequestOption.builder().tenant_access_token(tenant_access_token).build()
+        response = get_executor().call(app_token, lambda: client.bitable.v1.app_table_record.update(request, option),
+                                       stage='write')
+        
+        return response.success(), response.msg
+    except Exception as e:
+        return False, str(e)
+
+
+def create_record(client, app_token, table_id, fields, tenant_access_token):
+    """创建新的飞书表格记录"""
+    import lark_oapi as lark
+    from lark_oapi.api.bitable.v1 import AppTableRecord, CreateAppTableRecordRequest
+    
+    try:
+        request = CreateAppTableRecordRequest.builder() \
+            .app_token(app_token) \
+            .table_id(table_id) \
+            .request_body(AppTableRecord.builder()
+                .fields(fields)
+                .build()) \
+            .build()
+        
+        option = lark.RequestOption.builder().tenant_access_token(tenant_access_token).build()
+        response = get_executor().call(app_token, lambda: client.bitable.v1.app_table_record.create(request, option),
+                                       stage='write')
+        
+        return response.success(), response.msg
+    except Exception as e:
+        return False, str(e)
+
+
+def batch_create_records(client, app_token, table_id, fields_list, tenant_access_token):
+    """批量创建飞书表格记录（单次最多500条）"""
+    import lark_oapi as lark
+    from lark_oapi.api.bitable.v1 import AppTableRecord, BatchCreateAppTableRecordRequest, BatchCreateAppTableRecordRequestBody
+    
+    try:
+        request = BatchCreateAppTableRecordRequest.builder() \
+            .app_token(app_token) \
+            .table_id(table_id) \
+            .request_body(BatchCreateAppTableRecordRequestBody.builder()
+                .records([AppTableRecord.builder().fields(fields).build() for fields in fields_list])
+                .build()) \
+            .build()
+        
+        option = lark.RequestOption.builder().tenant_access_token(tenant_access_token).build()
+        response = get_executor().call(app_token, lambda: client.bitable.v1.app_table_record.batch_create(request, option),
+                                       stage='write')
+        
+        return response.success(), response.msg
+    except Exception as e:
+        return False, str(e)
+
+
+def batch_update_records(client, app_token, table_id, records, tenant_access_token):
+    """批量更新飞书表格记录（单次最多500条），records为(record_id, fields)列表"""
+    import lark_oapi as lark
+    from lark_oapi.api.bitable.v1 import AppTableRecord, BatchUpdateAppTableRecordRequest, BatchUpdateAppTableRecordRequestBody
+    
+    try:
+        request = BatchUpdateAppTableRecordRequest.builder() \
+            .app_token(app_token) \
+            .table_id(table_id) \
+            .request_body(BatchUpdateAppTableRecordRequestBody.builder()
+                .records([AppTableRecord.builder().record_id(record_id).fields(fields).build()
+                          for record_id, fields in records])
+                .build()) \
+            .build()
+        
+        option = lark.RequestOption.builder().tenant_access_token(tenant_access_token).build()
+        response = get_executor().call(app_token, lambda: client.bitable.v1.app_table_record.batch_update(request, option),
+                                       stage='write')
+        
+        return response.success(), response.msg
+    except Exception as e:
+        return False, str(e)
+
+
+def split_into_chunks(items, chunk_size):
+    """按固定大小切分列表"""
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def write_and_record(on_written, labels, write_func, *args):
+    """在工作线程中执行写入，成功后立即记录进度（主线程被中断时已完成的写入也不会漏记）"""
+    success, msg = write_func(*args)
+    if success and on_written:
+        for label in labels:
+            on_written(label)
+    return success, msg
+
+
+def upsert_records_individually(client, app_token, table_id, creates, updates, tenant_access_token,
+                                on_written=None, deadline=None):
+    """通过共享执行器并发逐条写入记录，返回(创建数, 更新数, 失败数)
+    
+    creates: [(row_index, fields), ...]
+    updates: [(row_index, record_id, fields), ...]
+    on_written: 每条记录写入成功后以row_index调用（如记录进度日志）
+    deadline: 时间预算（work_scheduler.Deadline），到期时取消尚未开始的写入，取消的条数记在deadline.deferred
+    """
+    executor = get_executor()
+    tasks = []
+    for row_index, fields in creates:
+        future = executor.submit(write_and_record, on_written, [row_index],
+                                 create_record, client, app_token, table_id, fields, tenant_access_token)
+        tasks.append(('create', row_index, fields, future))
+    for row_index, record_id, fields in updates:
+        future = executor.submit(write_and_record, on_written, [row_index],
+                                 update_record, client, app_token, table_id, record_id, fields, tenant_access_token)
+        tasks.append(('update', row_index, fields, future))
+    if deadline is not None:
+        deadline.watch([(task[3], 1) for task in tasks])
+    
+    create_count = 0
+    update_count = 0
+    error_count = 0
+    
+    try:
+        for action, row_index, fields, future in tasks:
+            try:
+                success, msg = future.result()
+            except CancelledError:
+                continue
+            action_name = '创建' if action == 'create' else '更新'
+            if success:
+                logger.debug(f"{'➕' if action == 'create' else '🔄'} 成功{action_name}第{row_index}行数据")
+                if action == 'create':
+                    create_count += 1
+                else:
+                    update_count += 1
+            else:
+                logger.error(f"❌ {action_name}第{row_index}行失败: {msg}")
+                logger.debug(f"   数据: {fields}")
+                error_count += 1
+    except KeyboardInterrupt:
+        for _, _, _, future in tasks:
+            future.cancel()
+        logger.warning("\n⚠️  用户中断操作，已取消尚未开始的写入")
+    
+    metrics = get_metrics()
+    metrics.incr('records_created', create_count)
+    metrics.incr('records_updated', update_count)
+    metrics.incr('write_errors', error_count)
+    return create_count, update_count, error_count
+
+
+def batch_upsert_records(client, app_token, table_id, creates, updates, tenant_access_token, batch_size=BATCH_SIZE,
+                         on_written=None, deadline=None):
+    """分块批量写入记录，某一块失败时逐条重试，避免一条坏数据拖累整块
+    
+    creates: [(row_index, fields), ...]
+    updates: [(row_index, record_id, fields), ...]
+    on_written: 每条记录写入成功后以row_index调用（如记录进度日志）
+    deadline: 时间预算（work_scheduler.Deadline），到期时取消尚未开始的块，取消的条数记在deadline.deferred
+    """
+    executor = get_executor()
+    tasks = []
+    for chunk in split_into_chunks(creates, batch_size):
+        future = executor.submit(write_and_record, on_written, [item[0] for item in chunk],
+                                 batch_create_records, client, app_token, table_id,
+                                 [fields for _, fields in chunk], tenant_access_token)
+        tasks.append(('create', chunk, future))
+    for chunk in split_into_chunks(updates, batch_size):
+        future = executor.submit(write_and_record, on_written, [item[0] for item in chunk],
+                                 batch_update_records, client, app_token, table_id,
+                                 [(record_id, fields) for _, record_id, fields in chunk], tenant_access_token)
+        tasks.append(('update', chunk, future))
+    if deadline is not None:
+        deadline.watch([(future, len(chunk)) for _, chunk, future in tasks])
+    
+    create_count = 0
+    update_count = 0
+    retry_creates = []
+    retry_updates = []
+    
+    try:
+        for action, chunk, future in tasks:
+            try:
+                success, msg = future.result()
+            except CancelledError:
+                continue
+            action_name = '创建' if action == 'create' else '更新'
+            if success:
+                logger.info(f"{'➕' if action == 'create' else '🔄'} 批量{action_name} {len(chunk)} 条记录成功")
+                if action == 'create':
+                    create_count += len(chunk)
+                else:
+                    update_count += len(chunk)
+            else:
+                logger.warning(f"⚠️  批量{action_name} {len(chunk)} 条记录失败: {msg}，改为逐条重试")
+                (retry_creates if action == 'create' else retry_updates).extend(chunk)
+    except KeyboardInterrupt:
+        for _, _, future in tasks:
+            future.cancel()
+        raise
+    
+    metrics = get_metrics()
+    metrics.incr('records_created', create_count)
+    metrics.incr('records_updated', update_count)
+    
+    retry_create_count, retry_update_count, error_count = upsert_records_individually(
+        client, app_token, table_id, retry_creates, retry_updates, tenant_access_token, on_written, deadline)
+    
+    return create_count + retry_create_count, update_count + retry_update_count, error_count
+
+
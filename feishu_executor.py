@@ -0,0 +1,134 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config_loader import get_setting
+from metrics import get_logger, get_metrics
+
+
+logger = get_logger(__name__)
+
+
+# 飞书开放平台的频率限制错误码
+RATE_LIMIT_CODES = {99991400}
+
+
+def is_rate_limited(response):
+    """判断飞书响应是否为频率限制"""
+    if getattr(response, 'code', None) in RATE_LIMIT_CODES:
+        return True
+    raw = getattr(response, 'raw', None)
+    return getattr(raw, 'status_code', None) == 429
+
+
+class TokenBucket:
+    """令牌桶限流器，速率可根据限流响应自适应调整"""
+    
+    def __init__(self, rate, capacity, min_rate=0.5):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    def acquire(self):
+        """阻塞直到取得一个令牌"""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+    
+    def slow_down(self):
+        """遇到限流：速率减半并清空令牌"""
+        with self.lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+    
+    def speed_up(self):
+        """请求成功：速率缓慢恢复至上限"""
+        with self.lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class FeishuExecutor:
+    """飞书API请求执行器
+    
+    - call(): 按app_token的令牌桶节流后同步执行请求，限流时指数退避重试
+    - submit(): 在有界线程池中并发执行任务（任务内部再通过call()节流）
+    """
+    
+    def __init__(self, max_workers=5, rate=10, burst=10, max_retries=5):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.buckets = {}
+        self.lock = threading.Lock()
+    
+    def bucket(self, app_token):
+        """获取（或创建）app_token对应的令牌桶"""
+        with self.lock:
+            if app_token not in self.buckets:
+                self.buckets[app_token] = TokenBucket(self.rate, self.burst)
+            return self.buckets[app_token]
+    
+    def call(self, app_token, request_func, stage='request'):
+        """节流执行一次飞书请求，request_func返回SDK响应对象
+        
+        每次请求的耗时记录在feishu_<stage>计时器中（如feishu_list、feishu_write）
+        """
+        bucket = self.bucket(app_token)
+        metrics = get_metrics()
+        
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            with metrics.timer(f'feishu_{stage}'):
+                response = request_func()
+            
+            if not is_rate_limited(response):
+                bucket.speed_up()
+                return response
+            
+            metrics.incr('rate_limit_hits')
+            bucket.slow_down()
+            if attempt < self.max_retries:
+                backoff = min(30, 2 ** attempt) + random.uniform(0, 0.5)
+                logger.warning(f"⏳ 触发飞书频率限制，{backoff:.1f}秒后重试 ({attempt + 1}/{self.max_retries})")
+                time.sleep(backoff)
+        
+        return response
+    
+    def submit(self, func, *args, **kwargs):
+        """在线程池中执行任务，返回Future"""
+        return self.pool.submit(func, *args, **kwargs)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """获取全局共享的执行器，参数可在config.json中配置"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = FeishuExecutor(
+                max_workers=get_setting('feishu_max_workers', 5),
+                rate=get_setting('feishu_rate_per_second', 10),
+                burst=get_setting('feishu_rate_burst', 10),
+                max_retries=get_setting('feishu_max_retries', 5),
+            )
+        return _executor
@@ -0,0 +1,273 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+from config_loader import get_setting
+from metrics import get_logger, get_metrics
+
+
+logger = get_logger(__name__)
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'fund_cache.sqlite3')
+
+# 获取失败的结果：基金不存在/无类型信息会被短期缓存，网络异常不缓存
+NEGATIVE_FUND_TYPES = {'基金不存在', '未知'}
+FAILED_FUND_TYPES = {'未知', '获取失败', '基金不存在', '代码格式错误'}
+
+# 东方财富全市场列表与雪球基本信息的基金类型命名不同，统一为雪球的命名
+UNIVERSE_TYPE_MAPPING = {
+    '指数型-固收': '债券型-债券指数',
+    '货币型-普通货币': '货币型',
+    '货币型-浮动净值': '货币型',
+    '混合型-灵活': '混合型-灵活配置',
+    '混合型-平衡': '混合型-股债平衡',
+    '债券型-长债': '债券型-长期纯债',
+    '债券型-混合一级': '债券型-普通债券',
+    '债券型-混合二级': '债券型-普通债券',
+    '股票型': '股票型-普通',
+    'QDII-普通股票': 'QDII-股票',
+    'QDII-纯债': 'QDII-债券',
+    'QDII-混合债': 'QDII-债券',
+    '商品（不含QDII）': '商品型-非QDII',
+}
+
+
+def normalize_fund_code(fund_code):
+    """标准化基金代码：去除空格，补零至6位；格式错误返回None"""
+    normalized_code = str(fund_code).strip()
+    if not normalized_code.isdigit():
+        return None
+    return normalized_code.zfill(6)
+
+
+def extract_fund_type(fund_info):
+    """从基金基本信息(item -> value)中提取基金类型"""
+    for field in ['基金类型', '类型', 'fund_type', '投资类型']:
+        if fund_info.get(field):
+            return str(fund_info[field])
+    return "未知"
+
+
+class FundInfoCache:
+    """基金基本信息的本地SQLite缓存，按6位基金代码存储完整的item/value表"""
+    
+    def __init__(self, db_path=None, ttl_days=30, negative_ttl_hours=24):
+        self.db_path = db_path or DEFAULT_CACHE_PATH
+        self.ttl_seconds = ttl_days * 86400
+        self.negative_ttl_seconds = negative_ttl_hours * 3600
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS fund_info (
+                fund_code TEXT PRIMARY KEY,
+                fund_type TEXT NOT NULL,
+                info_json TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS fund_universe (
+                snapshot_date TEXT NOT NULL,
+                fund_code TEXT NOT NULL,
+                fund_type TEXT NOT NULL,
+                PRIMARY KEY (snapshot_date, fund_code)
+            )
+        ''')
+        self.conn.commit()
+    
+    def get(self, fund_code):
+        """读取未过期的缓存，返回(基金类型, 基本信息dict)，未命中返回None"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT fund_type, info_json FROM fund_info WHERE fund_code = ? AND expires_at > ?',
+                (fund_code, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+    
+    def put(self, fund_code, fund_type, fund_info):
+        """写入缓存，失败结果使用较短的有效期"""
+        now = time.time()
+        ttl = self.negative_ttl_seconds if fund_type in NEGATIVE_FUND_TYPES else self.ttl_seconds
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO fund_info (fund_code, fund_type, info_json, fetched_at, expires_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (fund_code, fund_type, json.dumps(fund_info, ensure_ascii=False), now, now + ttl)
+            )
+            self.conn.commit()
+
+    def get_universe(self, snapshot_date):
+        """读取指定日期的全市场基金类型表，返回{基金代码: 基金类型}，不存在返回None"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT fund_code, fund_type FROM fund_universe WHERE snapshot_date = ?',
+                (snapshot_date,)
+            ).fetchall()
+        if not rows:
+            return None
+        return dict(rows)
+    
+    def put_universe(self, snapshot_date, fund_types):
+        """保存全市场基金类型表，只保留最新一天的快照"""
+        with self.lock:
+            self.conn.execute('DELETE FROM fund_universe')
+            self.conn.executemany(
+                'INSERT INTO fund_universe (snapshot_date, fund_code, fund_type) VALUES (?, ?, ?)',
+                [(snapshot_date, code, fund_type) for code, fund_type in fund_types.items()]
+            )
+            self.conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_universe_index = None
+_universe_date = None
+
+
+def get_fund_cache():
+    """获取全局共享的基金信息缓存，路径和有效期可在config.json中配置"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FundInfoCache(
+                db_path=get_setting('fund_cache_path', DEFAULT_CACHE_PATH),
+                ttl_days=get_setting('fund_cache_ttl_days', 30),
+                negative_ttl_hours=get_setting('fund_cache_negative_ttl_hours', 24),
+            )
+        return _cache
+
+
+def request_fund_info(normalized_code):
+    """调用akshare获取基金基本信息，返回(基金类型, 基本信息dict)
+    
+    基金不存在时返回"基金不存在"，网络等其他异常直接抛出，由调用方决定是否重试
+    """
+    import akshare as ak
+    
+    try:
+        with get_metrics().timer('akshare_fetch'):
+            fund_info_df = ak.fund_individual_basic_info_xq(symbol=normalized_code)
+    except KeyError as e:
+        logger.warning(f"⚠️  基金代码 {normalized_code} 可能不存在或API返回格式异常: {str(e)}")
+        return "基金不存在", {}
+    fund_info = {}
+    if not fund_info_df.empty:
+        fund_info = {str(item): str(value) for item, value in zip(fund_info_df['item'], fund_info_df['value'])}
+    return extract_fund_type(fund_info), fund_info
+
+
+def fetch_fund_info_from_akshare(normalized_code):
+    """调用akshare获取基金基本信息，返回(基金类型, 基本信息dict)，异常时返回获取失败"""
+    try:
+        return request_fund_info(normalized_code)
+    except Exception as e:
+        logger.warning(f"⚠️  获取基金代码 {normalized_code} 的类型信息失败: {str(e)}")
+        get_metrics().incr('akshare_errors')
+        return "获取失败", {}
+
+
+def normalize_universe_fund_type(fund_type, fund_name=''):
+    """将东方财富全市场列表的基金类型转换为雪球基本信息使用的类型名称"""
+    fund_type = str(fund_type).strip()
+    if fund_type == '指数型-股票':
+        return '股票型-增强指数' if '增强' in str(fund_name) else '股票型-标准指数'
+    return UNIVERSE_TYPE_MAPPING.get(fund_type, fund_type)
+
+
+def fetch_fund_universe_from_akshare():
+    """一次性下载全市场公募基金列表，返回{基金代码: 基金类型}"""
+    import akshare as ak
+    
+    with get_metrics().timer('akshare_universe'):
+        fund_name_df = ak.fund_name_em()
+    fund_types = {}
+    for code, name, fund_type in zip(fund_name_df['基金代码'], fund_name_df['基金简称'], fund_name_df['基金类型']):
+        normalized_code = normalize_fund_code(code)
+        if normalized_code and str(fund_type).strip():
+            fund_types[normalized_code] = normalize_universe_fund_type(fund_type, name)
+    return fund_types
+
+
+def get_fund_universe_index(cache=None, download=True):
+    """获取当天的全市场基金类型索引，每天最多下载一次，失败时返回空索引
+    
+    download为False时只读本地缓存，当天还没有下载过则返回None
+    """
+    global _universe_index, _universe_date
+    
+    today = date.today().isoformat()
+    if _universe_index is not None and _universe_date == today:
+        return _universe_index
+    
+    cache = cache or get_fund_cache()
+    fund_types = cache.get_universe(today)
+    if fund_types is None:
+        if not download:
+            return None
+        logger.info("🌐 正在下载全市场基金列表...")
+        try:
+            fund_types = fetch_fund_universe_from_akshare()
+            cache.put_universe(today, fund_types)
+        except Exception as e:
+            logger.warning(f"⚠️  下载全市场基金列表失败: {str(e)}，将逐个查询基金类型")
+            return {}
+    
+    logger.info(f"✅ 全市场基金类型索引: {len(fund_types)} 只基金")
+    _universe_index = fund_types
+    _universe_date = today
+    return fund_types
+
+
+def lookup_cached_fund_type(fund_code, cache=None, universe_index=None):
+    """只查全市场索引和本地缓存，返回(标准化代码, 基金类型)
+    
+    代码格式错误时标准化代码为None；需要调用akshare时基金类型为None
+    """
+    normalized_code = normalize_fund_code(fund_code)
+    if normalized_code is None:
+        logger.warning(f"⚠️  基金代码格式错误: {fund_code}，应为数字")
+        return None, "代码格式错误"
+    
+    metrics = get_metrics()
+    if universe_index and normalized_code in universe_index:
+        metrics.incr('fund_type_universe_hits')
+        return normalized_code, universe_index[normalized_code]
+    
+    cache = cache or get_fund_cache()
+    cached = cache.get(normalized_code)
+    if cached is not None:
+        metrics.incr('fund_type_cache_hits')
+        return normalized_code, cached[0]
+    
+    if str(fund_code).strip() != normalized_code:
+        logger.debug(f"   📝 基金代码标准化: {fund_code} -> {normalized_code}")
+    return normalized_code, None
+
+
+def store_fund_type(normalized_code, fund_type, fund_info, cache=None):
+    """缓存akshare的查询结果，网络异常等临时失败不写入缓存，下次运行重新获取"""
+    if fund_type != "获取失败":
+        (cache or get_fund_cache()).put(normalized_code, fund_type, fund_info)
+
+
+def lookup_fund_type(fund_code, cache=None, universe_index=None):
+    """先查全市场索引和本地缓存，未命中再调用akshare，返回(基金类型, 是否实际调用了akshare)"""
+    normalized_code, fund_type = lookup_cached_fund_type(fund_code, cache, universe_index)
+    if fund_type is not None:
+        return fund_type, False
+    
+    fund_type, fund_info = fetch_fund_info_from_akshare(normalized_code)
+    store_fund_type(normalized_code, fund_type, fund_info, cache)
+    return fund_type, True
+
+
+def get_fund_type_from_akshare(fund_code):
+    """通过akshare获取基金类型信息（优先读取本地缓存）"""
+    fund_type, _ = lookup_fund_type(fund_code)
+    return fund_type
@@ -0,0 +1,204 @@
+import os
+import sqlite3
+import threading
+from datetime import date
+from config_loader import get_setting
+from metrics import get_logger, get_metrics
+
+
+logger = get_logger(__name__)
+
+
+DEFAULT_FX_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'fx_rates.sqlite3')
+
+BASE_CURRENCY = '人民币'
+
+# 国家外汇管理局人民币汇率中间价（akshare.currency_boc_safe）中直接标价的币种，数值为100外币兑人民币
+SAFE_CURRENCIES = ('美元', '欧元', '日元', '港元', '英镑', '澳元', '新西兰元', '新加坡元', '瑞士法郎', '加元')
+
+# 结算币种的其他写法 → 标准名称（"现汇"、"现钞"后缀先去掉）
+CURRENCY_ALIASES = {
+    '': BASE_CURRENCY,
+    'CNY': BASE_CURRENCY,
+    'RMB': BASE_CURRENCY,
+    '人民币元': BASE_CURRENCY,
+    'USD': '美元',
+    '美金': '美元',
+    'HKD': '港元',
+    '港币': '港元',
+    'EUR': '欧元',
+    'JPY': '日元',
+    'GBP': '英镑',
+    'AUD': '澳元',
+    'NZD': '新西兰元',
+    'SGD': '新加坡元',
+    'CHF': '瑞士法郎',
+    'CAD': '加元',
+}
+
+# 净值日期之前最近一次中间价距今超过这么多天时视为缺少汇率（节假日没有中间价）
+DEFAULT_MAX_STALE_DAYS = 10
+
+
+def normalize_currency(currency):
+    """标准化结算币种名称，空值视为人民币"""
+    currency = str(currency).strip()
+    for suffix in ('现汇', '现钞'):
+        currency = currency.removesuffix(suffix)
+    return CURRENCY_ALIASES.get(currency.upper(), CURRENCY_ALIASES.get(currency, currency))
+
+
+class FxRateCache:
+    """人民币汇率中间价的本地SQLite时间序列，按(币种, 日期)存储1单位外币兑人民币的汇率"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or DEFAULT_FX_CACHE_PATH
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS fx_rates (
+                currency TEXT NOT NULL,
+                rate_date TEXT NOT NULL,
+                rate REAL NOT NULL,
+                PRIMARY KEY (currency, rate_date)
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS fx_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+    def latest_date(self, currency):
+        """某币种已缓存的最新日期（YYYY-MM-DD），没有时返回None"""
+        with self.lock:
+            row = self.conn.execute('SELECT MAX(rate_date) FROM fx_rates WHERE currency = ?', (currency,)).fetchone()
+        return row[0]
+
+    def fetched_date(self):
+        """最近一次下载汇率的日期"""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM fx_state WHERE key = 'fetched_date'").fetchone()
+        return row[0] if row else None
+
+    def put_rates(self, rows, fetched_date):
+        """写入[(币种, 日期, 汇率), ...]并记录下载日期，已有的日期覆盖"""
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO fx_rates (currency, rate_date, rate) VALUES (?, ?, ?)', rows)
+            self.conn.execute("INSERT OR REPLACE INTO fx_state (key, value) VALUES ('fetched_date', ?)",
+                              (fetched_date,))
+            self.conn.commit()
+
+    def load_series(self, currencies):
+        """读取指定币种的全部汇率，返回按日期排序的DataFrame[币种, 日期, 汇率]"""
+        import pandas as pd
+
+        placeholders = ','.join('?' * len(currencies))
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT currency, rate_date, rate FROM fx_rates WHERE currency IN ({placeholders}) '
+                'ORDER BY rate_date', list(currencies)
+            ).fetchall()
+        series = pd.DataFrame(rows, columns=['币种', '日期', '汇率'])
+        series['日期'] = pd.to_datetime(series['日期'])
+        return series
+
+
+_fx_cache = None
+_fx_cache_lock = threading.Lock()
+
+
+def get_fx_cache():
+    """获取全局共享的汇率缓存，路径可在config.json中配置"""
+    global _fx_cache
+    with _fx_cache_lock:
+        if _fx_cache is None:
+            _fx_cache = FxRateCache(db_path=get_setting('fx_cache_path', DEFAULT_FX_CACHE_PATH))
+        return _fx_cache
+
+
+def fetch_rates_from_akshare():
+    """下载人民币汇率中间价的全部历史，返回[(币种, 日期, 1单位外币兑人民币), ...]"""
+    import akshare as ak
+    import pandas as pd
+
+    with get_metrics().timer('akshare_fx'):
+        rates_df = ak.currency_boc_safe()
+    rate_dates = pd.to_datetime(rates_df['日期']).dt.strftime('%Y-%m-%d').tolist()
+    rows = []
+    for currency in SAFE_CURRENCIES:
+        if currency not in rates_df.columns:
+            continue
+        values = pd.to_numeric(rates_df[currency], errors='coerce') / 100
+        rows.extend((currency, rate_date, rate) for rate_date, rate in zip(rate_dates, values.tolist())
+                    if rate == rate and rate > 0)
+    return rows
+
+
+def ensure_fx_rates(currencies, latest_needed, cache=None, download=True):
+    """确保缓存中有这些币种截至latest_needed（YYYY-MM-DD）的汇率
+
+    已缓存到该日期的币种（历史估值）不再下载；否则每天最多下载一次全部历史，
+    当天已下载过仍没有最新汇率时（如节假日）沿用之前最近的中间价
+    """
+    cache = cache or get_fx_cache()
+    today = date.today().isoformat()
+    stale = [currency for currency in currencies
+             if currency in SAFE_CURRENCIES and (cache.latest_date(currency) or '') < latest_needed]
+    if not stale or not download or cache.fetched_date() == today:
+        return
+
+    logger.info(f"🌐 正在下载人民币汇率中间价（{'、'.join(stale)}）...")
+    try:
+        rows = fetch_rates_from_akshare()
+    except Exception as e:
+        logger.warning(f"⚠️  下载汇率失败: {str(e)}，将使用已缓存的汇率")
+        get_metrics().incr('akshare_errors')
+        return
+    cache.put_rates(rows, today)
+    logger.info(f"✅ 已缓存 {len(rows)} 条汇率")
+
+
+def convert_to_cny(currencies, valuation_dates, amounts, cache=None, download=True):
+    """按结算币种和净值日期把金额换算为人民币，返回(人民币金额, 汇率)两个numpy数组
+
+    每个持仓使用净值日期当天或之前最近一个交易日的中间价（一次merge_asof完成，不逐行查询）；
+    净值日期为空时按最新汇率；缺少汇率的持仓汇率为NaN，人民币金额保留原币种金额
+    """
+    import numpy as np
+    import pandas as pd
+
+    currencies = np.asarray([normalize_currency(currency) for currency in currencies], dtype=object)
+    amounts = np.asarray(amounts, dtype=float)
+    rates = np.where(currencies == BASE_CURRENCY, 1.0, np.nan)
+    foreign = currencies != BASE_CURRENCY
+    if not foreign.any():
+        return amounts.copy(), rates
+
+    today = pd.Timestamp(date.today())
+    dates = pd.to_datetime(pd.Series(valuation_dates, dtype=object)[foreign].replace('', None),
+                           errors='coerce', format='mixed').fillna(today)
+    foreign_currencies = sorted(set(currencies[foreign].tolist()))
+    ensure_fx_rates(foreign_currencies, dates.max().strftime('%Y-%m-%d'), cache, download)
+
+    series = (cache or get_fx_cache()).load_series(foreign_currencies)
+    positions = pd.DataFrame({
+        '位置': np.flatnonzero(foreign),
+        '币种': currencies[foreign],
+        '日期': dates.to_numpy(),
+    }).sort_values('日期', kind='stable')
+    # 缓存中没有这些币种的汇率时series为空，列类型推断不出来（object、秒精度），merge_asof要求两边类型一致
+    series = series.astype({'币种': positions['币种'].dtype, '日期': positions['日期'].dtype})
+    matched = pd.merge_asof(positions, series, on='日期', by='币种', direction='backward',
+                            tolerance=pd.Timedelta(days=get_setting('fx_max_stale_days', DEFAULT_MAX_STALE_DAYS)))
+    rates[matched['位置'].to_numpy()] = matched['汇率'].to_numpy()
+
+    converted = np.where(np.isnan(rates), amounts, amounts * np.nan_to_num(rates, nan=1.0))
+    missing = int(np.isnan(rates).sum())
+    if missing:
+        unknown = sorted(set(currencies[np.isnan(rates)].tolist()))
+        logger.warning(f"⚠️  {missing} 个持仓缺少汇率（{'、'.join(unknown)}），按原币种金额计入")
+    return converted, rates
@@ -0,0 +1,269 @@
+import csv
+import re
+from functools import partial
+from metrics import get_logger, get_metrics
+
+
+logger = get_logger(__name__)
+
+
+# 数字字段（根据之前的表结构）
+NUMERIC_FIELDS = {"序号", "持有份额", "基金净值", "资产情况"}
+
+# 组成唯一标识的字段
+KEY_FIELDS = ('基金代码', '交易账户')
+
+# 字段名映射（标准化后的字段名 -> 飞书表格字段名）
+FIELD_NAME_MAPPING = {
+    '资产情况（结算币种）': '资产情况',
+}
+
+# 券商导出文件末尾的打印时间行
+FOOTER_MARKER = '打印时间'
+
+# 分块读取CSV时每块的行数
+DEFAULT_CHUNK_ROWS = 50000
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+NON_NUMERIC_PATTERN = re.compile(r'[^\d.-]')
+
+
+def get_csv_headers(csv_file_path):
+    """获取CSV文件的表头"""
+    with open(csv_file_path, 'r', encoding='utf-8') as file:
+        csv_reader = csv.reader(file)
+        headers = next(csv_reader)
+        return headers
+
+
+def clean_numeric_value(value):
+    """清理数字值，确保可以转换为数字"""
+    if not value or value == '':
+        return 0
+    
+    # 移除所有非数字字符（除了小数点和负号）
+    cleaned = NON_NUMERIC_PATTERN.sub('', str(value))
+    
+    try:
+        # 尝试转换为浮点数
+        return float(cleaned) if cleaned else 0
+    except ValueError:
+        return 0
+
+
+def clean_text_value(value):
+    """清理文本值"""
+    if value is None:
+        return ""
+    return str(value).strip()
+
+
+def normalize_field_name(field_name):
+    """标准化字段名，处理换行符等特殊字符（UTF-8 BOM也一并去掉）"""
+    field_name = field_name.replace('\ufeff', '')
+    # 移除换行符和多余空格后再查映射
+    normalized = WHITESPACE_PATTERN.sub('', field_name.strip())
+    return FIELD_NAME_MAPPING.get(normalized, field_name)
+
+
+def resolve_header_mapping(headers):
+    """原始表头 -> 飞书字段名，每个文件只计算一次；空表头的列没有对应字段，不在映射中"""
+    return {header: normalize_field_name(header) for header in headers if header.replace('\ufeff', '').strip()}
+
+
+def missing_key_columns(header_mapping):
+    """组成唯一标识的列中CSV没有的列"""
+    return [name for name in KEY_FIELDS if name not in header_mapping.values()]
+
+
+def make_record_key(fund_code, trading_account):
+    """基金代码+交易账户组成的唯一标识"""
+    return f"{fund_code}_{trading_account}"
+
+
+def read_holdings_frame(csv_file_path):
+    """按列读取CSV，所有单元格保留为原始文本，表头使用文件中的原始名称"""
+    return next(iter_holdings_frames(csv_file_path, chunk_rows=None))
+
+
+def iter_holdings_frames(csv_file_path, chunk_rows=DEFAULT_CHUNK_ROWS, on_bad_line=None):
+    """分块读取CSV，每块最多chunk_rows行（None表示一次读完），单元格保留为原始文本
+    
+    索引为行号（表头之后的第一行为1），空行同样占一个行号并保留为空文本（由调用方过滤），
+    跳过的行不影响之后的行号；字段数不足的行缺失的单元格为空文本；
+    字段数多于表头的行无法确定各列的取值，不放入表格，交给on_bad_line(行号, 错误信息)处理（默认记录警告）
+    """
+    import pandas as pd
+    
+    headers = get_csv_headers(csv_file_path)
+    width = len(headers)
+    if on_bad_line is None:
+        on_bad_line = lambda row_index, message: logger.warning(f"⚠️  跳过第{row_index}行: {message}")
+    
+    def make_frame(row_numbers, rows):
+        return pd.DataFrame(rows, columns=headers, index=pd.Index(row_numbers), dtype=object)
+    
+    # pandas的C解析器分块读取时会把多出的字段直接截掉，且不报告被跳过的行，所以用csv模块逐行切分
+    with open(csv_file_path, 'r', encoding='utf-8-sig', newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        row_numbers = []
+        rows = []
+        for row_index, row in enumerate(reader, 1):
+            if len(row) != width:
+                if len(row) > width:
+                    on_bad_line(row_index, f"字段数({len(row)})多于表头({width})")
+                    continue
+                row = row + [''] * (width - len(row))
+            row_numbers.append(row_index)
+            rows.append(row)
+            if chunk_rows and len(rows) >= chunk_rows:
+                yield make_frame(row_numbers, rows)
+                row_numbers = []
+                rows = []
+        if rows or not chunk_rows:
+            yield make_frame(row_numbers, rows)
+
+
+def clean_numeric_column(values):
+    """按列的clean_numeric_value：去掉非数字字符后转为浮点数，空值或无法解析时为0"""
+    import pandas as pd
+    
+    stripped = pd.Series(list(map(partial(NON_NUMERIC_PATTERN.sub, ''), values)), dtype=object)
+    return pd.to_numeric(stripped, errors='coerce').astype(float).fillna(0.0).to_numpy()
+
+
+def clean_holdings_frame(raw_df, numeric_fields=NUMERIC_FIELDS):
+    """按列清理原始文本表格：标准化表头、清理数字列和文本列，去掉空行、打印时间行和缺少唯一标识的行
+    
+    每列只取出一次Python列表再整列处理（pandas的字符串方法在没有pyarrow时逐个单元格回调，慢得多），
+    行的筛选用numpy布尔数组完成。返回(清理后的DataFrame, 唯一标识Series)，
+    索引沿用raw_df的行号（见iter_holdings_frames）
+    """
+    import numpy as np
+    import pandas as pd
+    
+    row_numbers = raw_df.index.to_numpy()
+    columns = {}
+    for header in raw_df.columns:
+        # 字段数不足的行缺失的单元格是NaN，当作空文本
+        values = np.asarray(raw_df[header].tolist(), dtype=object)
+        values[pd.isna(values)] = ''
+        columns[header] = values
+    
+    # 空行或任一单元格包含打印时间的行；打印时间先在整列拼接的文本中查找，找到了才逐格定位
+    is_blank = np.ones(len(raw_df), dtype=bool)
+    is_footer = np.zeros(len(raw_df), dtype=bool)
+    for values in columns.values():
+        is_blank &= values == ''
+        if FOOTER_MARKER in '\n'.join(values):
+            is_footer |= np.fromiter((FOOTER_MARKER in value for value in values), dtype=bool, count=len(values))
+    skipped = is_blank | is_footer
+    for row_index in row_numbers[skipped]:
+        logger.debug(f"跳过第{row_index}行（空行或打印时间行）")
+    
+    header_mapping = resolve_header_mapping(raw_df.columns)
+    kept = ~skipped
+    cleaned = {}
+    for header, field_name in header_mapping.items():
+        values = columns[header][kept].tolist()
+        if field_name in numeric_fields:
+            cleaned[field_name] = clean_numeric_column(values)
+        else:
+            cleaned[field_name] = np.asarray(list(map(str.strip, values)), dtype=object)
+    row_numbers = row_numbers[kept]
+    
+    missing_columns = missing_key_columns(header_mapping)
+    for name in missing_columns:
+        cleaned[name] = np.full(len(row_numbers), '', dtype=object)
+    fund_codes = cleaned['基金代码']
+    trading_accounts = cleaned['交易账户']
+    missing = (fund_codes == '') | (trading_accounts == '')
+    if not missing_columns:
+        for row_index in row_numbers[missing]:
+            logger.warning(f"⚠️  第{row_index}行缺少基金代码或交易账户，跳过")
+    
+    metrics = get_metrics()
+    metrics.incr('csv_rows', len(raw_df))
+    metrics.incr('csv_rows_skipped', int(skipped.sum()) + int(missing.sum()))
+    
+    present = ~missing
+    index = pd.Index(row_numbers[present])
+    cleaned_df = pd.DataFrame({name: values[present] for name, values in cleaned.items()}, index=index)
+    record_keys = pd.Series([make_record_key(code, account) for code, account
+                             in zip(fund_codes[present].tolist(), trading_accounts[present].tolist())],
+                            index=index, dtype=object)
+    return cleaned_df, record_keys
+
+
+def report_failed_row(row_index, error, on_error=None):
+    """记录无法处理的行，on_error(行号, 异常)用于调用方计入失败行数"""
+    logger.error(f"❌ 处理第{row_index}行数据时出错: {str(error)}")
+    get_metrics().incr('csv_rows_failed')
+    if on_error is not None:
+        on_error(row_index, error)
+
+
+def clean_rows_individually(raw_df, on_error=None):
+    """整块清理出错时改为逐行清理：出错的行记录错误后跳过（on_error(行号, 异常)用于计数），其余行照常返回"""
+    import pandas as pd
+    
+    frames = []
+    keys = []
+    for offset, row_index in enumerate(raw_df.index.tolist()):
+        try:
+            cleaned, record_keys = clean_holdings_frame(raw_df.iloc[offset:offset + 1])
+        except Exception as e:
+            report_failed_row(row_index, e, on_error)
+            continue
+        frames.append(cleaned)
+        keys.append(record_keys)
+    if not frames:
+        return pd.DataFrame(), pd.Series(dtype=object)
+    return pd.concat(frames), pd.concat(keys)
+
+
+def iter_cleaned_chunks(csv_file_path, chunk_rows=DEFAULT_CHUNK_ROWS, on_error=None):
+    """分块读取并清理CSV，每块返回(行号列表, 唯一标识列表, 清理后的行列表)
+    
+    内存占用只与chunk_rows有关，与文件行数无关；
+    解析和清理耗时分别记录在csv_parse、row_clean计时器中（每块一次）；
+    字段数多于表头的行和整块清理出错时逐行清理仍出错的行（见clean_rows_individually）记为失败并跳过
+    """
+    missing_columns = missing_key_columns(resolve_header_mapping(get_csv_headers(csv_file_path)))
+    if missing_columns:
+        logger.warning(f"⚠️  CSV中没有{'、'.join(missing_columns)}列，所有行都无法生成唯一标识，全部跳过")
+    
+    metrics = get_metrics()
+    frames = iter_holdings_frames(
+        csv_file_path, chunk_rows,
+        on_bad_line=lambda row_index, message: report_failed_row(row_index, ValueError(message), on_error))
+    while True:
+        with metrics.timer('csv_parse'):
+            raw_df = next(frames, None)
+        if raw_df is None:
+            break
+        with metrics.timer('row_clean'):
+            try:
+                cleaned, record_keys = clean_holdings_frame(raw_df)
+            except Exception:
+                cleaned, record_keys = clean_rows_individually(raw_df, on_error)
+            records = frame_to_records(cleaned)
+        yield cleaned.index.tolist(), record_keys.tolist(), records
+
+
+def read_cleaned_rows(csv_file_path, chunk_rows=DEFAULT_CHUNK_ROWS, on_error=None):
+    """读取并清理CSV，逐行返回(行号, 唯一标识, 清理后的行)，跳过无效行
+    
+    表头映射只解析一次，数字列和文本列按块向量化清理；
+    清理出错的行记录错误后跳过，on_error(行号, 异常)用于调用方计入失败行数
+    """
+    for row_numbers, record_keys, records in iter_cleaned_chunks(csv_file_path, chunk_rows, on_error):
+        yield from zip(row_numbers, record_keys, records)
+
+
+def frame_to_records(df):
+    """DataFrame转为可直接发送的字段字典列表（按列取出Python原生值再拼行，比to_dict('records')快得多）"""
+    columns = list(df.columns)
+    column_values = [df[column].tolist() for column in columns]
+    return [dict(zip(columns, row)) for row in zip(*column_values)]
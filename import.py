@@ -1,275 +1,249 @@
-import json
-import csv
+import argparse
 import os
-import re
-import time
-import lark_oapi as lark
-from lark_oapi.api.bitable.v1 import *
-from config_loader import get_feishu_config
+from config_loader import get_setting, load_config, prefetch_feishu_config, wait_for_tenant_access_token
+from bitable_mirror import load_record_index
+from feishu_bitable import (batch_upsert_records, create_client, diff_digest_fields, preload_feishu_sdk,
+                            upsert_records_individually)
+from holdings_csv import (DEFAULT_CHUNK_ROWS, NUMERIC_FIELDS, get_csv_headers, iter_cleaned_chunks,
+                          normalize_field_name, read_cleaned_rows, resolve_header_mapping)
+from run_journal import file_fingerprint, open_journal
+from run_planner import plan_import
+from metrics import configure_logging, get_logger, get_metrics, write_run_summary
 
 
-def get_csv_headers(csv_file_path):
-    """获取CSV文件的表头"""
-    with open(csv_file_path, 'r', encoding='utf-8') as file:
-        csv_reader = csv.reader(file)
-        headers = next(csv_reader)
-        return headers
+logger = get_logger(__name__)
 
 
-def clean_numeric_value(value):
-    """清理数字值，确保可以转换为数字"""
-    if not value or value == '':
-        return 0
+def import_csv_to_feishu(app_token, table_id, csv_file_path, tenant_access_token, batch_mode=True, resume=False,
+                         stream=None):
+    """将CSV文件导入到飞书数据表，支持条件更新
     
-    # 移除所有非数字字符（除了小数点和负号）
-    cleaned = re.sub(r'[^\d.-]', '', str(value))
+    现有记录只保留(基金代码, 交易账户) → RecordRef的紧凑索引，按逐字段的内容摘要判断是否变化，
+    完全相同的行直接跳过，有变化的行只发送值发生变化的字段；所有待写入行先按新建/更新分组，再经共享执行器并发写入；
+    batch_mode为True时使用批量接口，否则逐条写入；
+    每行写入成功后记入进度日志，resume为True时跳过上次中断前已写入的行；
+    stream为True（默认取config.json中的import_stream）时改用stream_csv_to_feishu分块导入
+    """
+    if stream is None:
+        stream = bool(get_setting('import_stream', False))
+    if stream:
+        return stream_csv_to_feishu(app_token, table_id, csv_file_path, tenant_access_token, batch_mode, resume)
     
-    try:
-        # 尝试转换为浮点数
-        return float(cleaned) if cleaned else 0
-    except ValueError:
-        return 0
-
-
-def clean_text_value(value):
-    """清理文本值"""
-    if value is None:
-        return ""
-    return str(value).strip()
-
-
-def normalize_field_name(field_name):
-    """标准化字段名，处理换行符等特殊字符"""
-    # 移除换行符和多余空格
-    normalized = re.sub(r'\s+', '', field_name.strip())
-    
-    # 字段名映射
-    field_mapping = {
-        '资产情况（结算币种）': '资产情况',
-        '资产情况\n（结算币种）': '资产情况'
-    }
-    
-    return field_mapping.get(normalized, field_name)
-
-
-def get_existing_records(client, app_token, table_id, tenant_access_token):
-    """获取飞书表格中的所有现有记录"""
-    print("📋 正在获取飞书表格中的现有记录...")
-    
-    existing_records = {}
-    page_token = None
-    
-    while True:
-        try:
-            # 构建查询请求
-            request_builder = ListAppTableRecordRequest.builder() \
-                .app_token(app_token) \
-                .table_id(table_id) \
-                .page_size(500)  # 每页最多500条记录
-            
-            if page_token:
-                request_builder.page_token(page_token)
-            
-            request = request_builder.build()
-            option = lark.RequestOption.builder().tenant_access_token(tenant_access_token).build()
-            response = client.bitable.v1.app_table_record.list(request, option)
-            
-            if not response.success():
-                print(f"❌ 获取现有记录失败: {response.msg}")
-                break
-            
-            # 处理返回的记录
-            if response.data and response.data.items:
-                for record in response.data.items:
-                    fields = record.fields if record.fields else {}
-                    fund_code = fields.get('基金代码', '')
-                    trading_account = fields.get('交易账户', '')
-                    
-                    # 使用基金代码+交易账户作为唯一标识
-                    if fund_code and trading_account:
-                        key = f"{fund_code}_{trading_account}"
-                        existing_records[key] = {
-                            'record_id': record.record_id,
-                            'fields': fields
-                        }
-            
-            # 检查是否还有更多页
-            if not response.data.has_more:
-                break
-            
-            page_token = response.data.page_token
-            time.sleep(0.1)  # 避免API限制
-            
-        except Exception as e:
-            print(f"❌ 获取现有记录时出错: {str(e)}")
-            break
-    
-    print(f"📋 已获取 {len(existing_records)} 条现有记录")
-    return existing_records
-
-
-def update_record(client, app_token, table_id, record_id, fields, tenant_access_token):
-    """更新飞书表格中的记录"""
-    try:
-        request = UpdateAppTableRecordRequest.builder() \
-            .app_token(app_token) \
-            .table_id(table_id) \
-            .record_id(record_id) \
-            .request_body(AppTableRecord.builder()
-                .fields(fields)
-                .build()) \
-            .build()
-        
-        option = lark.RequestOption.builder().tenant_access_token(tenant_access_token).build()
-        response = client.bitable.v1.app_table_record.update(request, option)
-        
-        return response.success(), response.msg
-    except Exception as e:
-        return False, str(e)
-
-
-def create_record(client, app_token, table_id, fields, tenant_access_token):
-    """创建新的飞书表格记录"""
-    try:
-        request = CreateAppTableRecordRequest.builder() \
-            .app_token(app_token) \
-            .table_id(table_id) \
-            .request_body(AppTableRecord.builder()
-                .fields(fields)
-                .build()) \
-            .build()
-        
-        option = lark.RequestOption.builder().tenant_access_token(tenant_access_token).build()
-        response = client.bitable.v1.app_table_record.create(request, option)
-        
-        return response.success(), response.msg
-    except Exception as e:
-        return False, str(e)
-
-
-def import_csv_to_feishu(app_token, table_id, csv_file_path, tenant_access_token):
-    """将CSV文件导入到飞书数据表，支持条件更新"""
     # 创建client
-    client = lark.Client.builder() \
-        .enable_set_token(True) \
-        .log_level(lark.LogLevel.INFO) \
-        .build()
+    client = create_client()
     
     success_count = 0
     error_count = 0
     update_count = 0
     create_count = 0
+    unchanged_count = 0
+    resumed_count = 0
     
-    print(f"开始导入CSV文件: {csv_file_path}")
-    print(f"目标数据表ID: {table_id}")
+    logger.info(f"开始导入CSV文件: {csv_file_path}")
+    logger.info(f"目标数据表ID: {table_id}")
     
-    # 获取现有记录
-    existing_records = get_existing_records(client, app_token, table_id, tenant_access_token)
+    # 获取现有记录的索引（优先从本地镜像增量同步）
+    field_names = list(resolve_header_mapping(get_csv_headers(csv_file_path)).values())
+    metrics = get_metrics()
+    with metrics.timer('stage_load_records'):
+        record_index = load_record_index(client, app_token, table_id, tenant_access_token,
+                                         field_names, NUMERIC_FIELDS)
     
-    # 定义数字字段（根据之前的表结构）
-    numeric_fields = {"序号", "持有份额", "基金净值", "资产情况"}
+    # 同一文件导入到同一张表共用一份进度日志
+    journal = open_journal('import', app_token, table_id, file_fingerprint(csv_file_path), resume=resume)
+    row_keys = {}
     
-    # 读取CSV文件
-    with open(csv_file_path, 'r', encoding='utf-8') as file:
-        csv_reader = csv.DictReader(file)
-        
-        for row_index, row in enumerate(csv_reader, 1):
+    # 待写入的记录
+    pending_creates = []
+    pending_updates = []
+    interrupted = False
+    
+    # 读取并清理CSV文件，出错的行计入失败后继续处理其余行
+    failed_rows = []
+    try:
+        for row_index, record_key, cleaned_row in read_cleaned_rows(
+                csv_file_path, on_error=lambda row_index, e: failed_rows.append(row_index)):
             try:
-                # 跳过空行或无效行
-                if not any(row.values()) or '打印时间' in str(row):
-                    print(f"跳过第{row_index}行（空行或打印时间行）")
+                if journal.is_done(record_key):
+                    resumed_count += 1
                     continue
+                row_keys[row_index] = record_key
                 
-                # 清理数据，根据字段类型进行不同处理，并标准化字段名
-                cleaned_row = {}
-                for key, value in row.items():
-                    # 标准化字段名
-                    normalized_key = normalize_field_name(key)
-                    
-                    if normalized_key in numeric_fields:
-                        # 数字字段特殊处理
-                        cleaned_row[normalized_key] = clean_numeric_value(value)
-                    else:
-                        # 文本字段处理
-                        cleaned_row[normalized_key] = clean_text_value(value)
-                
-                # 获取基金代码和交易账户
-                fund_code = cleaned_row.get('基金代码', '')
-                trading_account = cleaned_row.get('交易账户', '')
-                
-                if not fund_code or not trading_account:
-                    print(f"⚠️  第{row_index}行缺少基金代码或交易账户，跳过")
+                # 与现有记录的内容摘要比对
+                existing = record_index.get(cleaned_row['基金代码'], cleaned_row['交易账户'])
+                if existing is None:
+                    pending_creates.append((row_index, cleaned_row))
                     continue
-                
-                # 构建唯一标识
-                record_key = f"{fund_code}_{trading_account}"
-                
-                # 检查是否存在现有记录
-                if record_key in existing_records:
-                    # 更新现有记录
-                    existing_record = existing_records[record_key]
-                    record_id = existing_record['record_id']
-                    
-                    success, msg = update_record(client, app_token, table_id, record_id, cleaned_row, tenant_access_token)
-                    
-                    if success:
-                        print(f"🔄 成功更新第{row_index}行数据 (基金代码: {fund_code}, 交易账户: {trading_account})")
-                        update_count += 1
-                        success_count += 1
-                    else:
-                        print(f"❌ 更新第{row_index}行失败: {msg}")
-                        print(f"   数据: {cleaned_row}")
-                        error_count += 1
+                # 只发送值发生变化的字段（同diff_record_fields），没有变化的列不会重写
+                changed_fields = diff_digest_fields(cleaned_row, existing.digest, field_names, NUMERIC_FIELDS)
+                if changed_fields:
+                    pending_updates.append((row_index, existing.record_id, changed_fields))
                 else:
-                    # 创建新记录
-                    success, msg = create_record(client, app_token, table_id, cleaned_row, tenant_access_token)
-                    
-                    if success:
-                        print(f"➕ 成功创建第{row_index}行数据 (基金代码: {fund_code}, 交易账户: {trading_account})")
-                        create_count += 1
-                        success_count += 1
-                    else:
-                        print(f"❌ 创建第{row_index}行失败: {msg}")
-                        print(f"   数据: {cleaned_row}")
-                        error_count += 1
-                
-                # 添加延迟避免API限制
-                time.sleep(0.1)
-                    
-            except KeyboardInterrupt:
-                print(f"\n⚠️  用户中断操作，已处理 {row_index-1} 行数据")
-                break
+                    unchanged_count += 1
             except Exception as e:
-                print(f"❌ 处理第{row_index}行数据时出错: {str(e)}")
+                logger.error(f"❌ 处理第{row_index}行数据时出错: {str(e)}")
                 error_count += 1
-                continue
+    except KeyboardInterrupt:
+        logger.warning(f"\n⚠️  用户中断操作，已读取 {len(pending_creates) + len(pending_updates) + unchanged_count} 行数据")
+        interrupted = True
+    error_count += len(failed_rows)
+    
+    if not interrupted:
+        logger.info(f"\n📦 {'批量' if batch_mode else '逐条'}写入: 待创建 {len(pending_creates)} 行, 待更新 {len(pending_updates)} 行")
+        write_func = batch_upsert_records if batch_mode else upsert_records_individually
+        try:
+            with metrics.timer('stage_write'):
+                create_count, update_count, write_error_count = write_func(
+                    client, app_token, table_id, pending_creates, pending_updates, tenant_access_token,
+                    on_written=lambda row_index: journal.mark_done(row_keys[row_index]))
+        except KeyboardInterrupt:
+            logger.warning("\n⚠️  用户中断操作，已写入的行已记入进度日志")
+            interrupted = True
+            write_error_count = 0
+        success_count = create_count + update_count
+        error_count += write_error_count
+    
+    # 全部成功才清除进度日志，否则可用--resume从断点继续
+    journal.close(completed=not interrupted and error_count == 0)
+    if interrupted or error_count:
+        logger.info("♻️  重新运行时加上 --resume 可跳过已写入的行")
     
-    print(f"\n📊 导入完成！")
-    print(f"✅ 总成功: {success_count} 行")
-    print(f"   ➕ 新创建: {create_count} 行")
-    print(f"   🔄 已更新: {update_count} 行")
-    print(f"❌ 失败: {error_count} 行")
-    return success_count, error_count, create_count, update_count
+    metrics.incr('rows_unchanged', unchanged_count)
+    log_import_summary(create_count, update_count, unchanged_count, resumed_count, error_count)
+    return success_count, error_count, create_count, update_count, unchanged_count
 
 
-def main():
-    """主函数"""
+def stream_csv_to_feishu(app_token, table_id, csv_file_path, tenant_access_token, batch_mode=True, resume=False,
+                         chunk_rows=None):
+    """分块流式导入，内存占用与CSV和表格的行数基本无关（适合上百万行的导出文件）
+    
+    CSV按chunk_rows行（默认取config.json中的import_chunk_rows）一块读取，每块比对完立即写入，
+    比对规则与import_csv_to_feishu相同
+    """
+    client = create_client()
+    chunk_rows = chunk_rows or get_setting('import_chunk_rows', DEFAULT_CHUNK_ROWS)
+    field_names = list(resolve_header_mapping(get_csv_headers(csv_file_path)).values())
+    
+    logger.info(f"开始流式导入CSV文件: {csv_file_path}（每块 {chunk_rows} 行）")
+    logger.info(f"目标数据表ID: {table_id}")
+    
+    metrics = get_metrics()
+    with metrics.timer('stage_load_records'):
+        record_index = load_record_index(client, app_token, table_id, tenant_access_token,
+                                         field_names, NUMERIC_FIELDS)
+    
+    journal = open_journal('import', app_token, table_id, file_fingerprint(csv_file_path), resume=resume)
+    write_func = batch_upsert_records if batch_mode else upsert_records_individually
+    
+    create_count = 0
+    update_count = 0
+    unchanged_count = 0
+    resumed_count = 0
+    error_count = 0
+    read_count = 0
+    interrupted = False
+    
+    failed_rows = []
+    try:
+        for row_numbers, record_keys, records in iter_cleaned_chunks(
+                csv_file_path, chunk_rows, on_error=lambda row_index, e: failed_rows.append(row_index)):
+            row_keys = {}
+            pending_creates = []
+            pending_updates = []
+            for row_index, record_key, cleaned_row in zip(row_numbers, record_keys, records):
+                try:
+                    if journal.is_done(record_key):
+                        resumed_count += 1
+                        continue
+                    row_keys[row_index] = record_key
+                    
+                    existing = record_index.get(cleaned_row['基金代码'], cleaned_row['交易账户'])
+                    if existing is None:
+                        pending_creates.append((row_index, cleaned_row))
+                        continue
+                    changed_fields = diff_digest_fields(cleaned_row, existing.digest, field_names, NUMERIC_FIELDS)
+                    if changed_fields:
+                        pending_updates.append((row_index, existing.record_id, changed_fields))
+                    else:
+                        unchanged_count += 1
+                except Exception as e:
+                    logger.error(f"❌ 处理第{row_index}行数据时出错: {str(e)}")
+                    error_count += 1
+            error_count += len(failed_rows)
+            failed_rows.clear()
+            read_count += len(records)
+            
+            # 每块比对完立即写入，写完再读下一块
+            with metrics.timer('stage_write'):
+                chunk_created, chunk_updated, chunk_errors = write_func(
+                    client, app_token, table_id, pending_creates, pending_updates, tenant_access_token,
+                    on_written=lambda row_index, row_keys=row_keys: journal.mark_done(row_keys[row_index]))
+            create_count += chunk_created
+            update_count += chunk_updated
+            error_count += chunk_errors
+            logger.info(f"📦 已处理 {read_count} 行: 新建 {create_count}, 更新 {update_count}, "
+                        f"无变化 {unchanged_count}, 失败 {error_count}")
+    except KeyboardInterrupt:
+        logger.warning(f"\n⚠️  用户中断操作，已处理 {read_count} 行，已写入的行已记入进度日志")
+        interrupted = True
+    
+    journal.close(completed=not interrupted and error_count == 0)
+    if interrupted or error_count:
+        logger.info("♻️  重新运行时加上 --resume 可跳过已写入的行")
+    
+    metrics.incr('rows_unchanged', unchanged_count)
+    log_import_summary(create_count, update_count, unchanged_count, resumed_count, error_count)
+    return create_count + update_count, error_count, create_count, update_count, unchanged_count
+
+
+def log_import_summary(create_count, update_count, unchanged_count, resumed_count, error_count):
+    """输出导入结果汇总"""
+    logger.info("\n📊 导入完成！")
+    logger.info(f"✅ 总成功: {create_count + update_count} 行")
+    logger.info(f"   ➕ 新创建: {create_count} 行")
+    logger.info(f"   🔄 已更新: {update_count} 行")
+    logger.info(f"   ⏸️  无变化跳过: {unchanged_count} 行")
+    if resumed_count:
+        logger.info(f"   ♻️  断点续传跳过: {resumed_count} 行")
+    logger.info(f"❌ 失败: {error_count} 行")
+
+
+def preview_main(csv_file_path):
+    """--dry-run入口：不写入也不联网，按本地镜像（上次同步时的表格内容）预估导入的工作量
+    
+    表格取config.json中的配置，不需要token，也不导入飞书SDK
+    """
+    if not os.path.exists(csv_file_path):
+        print(f"❌ 错误: 文件不存在 - {csv_file_path}")
+        return
+    try:
+        config = load_config()
+        plan_import(None, config['app_token'], config['table_id'], csv_file_path).log()
+    except Exception as e:
+        print(f"❌ 程序错误: {str(e)}")
+
+
+def main(resume=False, stream=None):
+    """主函数，resume为True时跳过上次中断前已完成的工作，stream为True时分块流式导入"""
     print("=== 飞书数据表CSV智能导入工具 ===")
     print("💡 支持基于基金代码+交易账户的条件更新")
     
     try:
+        # 飞书SDK和tenant_access_token都在后台准备，与下面的交互提示同时进行
+        preload_feishu_sdk()
+        
         # 从配置文件加载默认值
         try:
-            config = get_feishu_config()
+            config = load_config()
             default_app_token = config['app_token']
-            default_tenant_access_token = config['tenant_access_token']
             default_table_id = config['table_id']
+            config_future = prefetch_feishu_config()
         except Exception as e:
             print(f"⚠️  加载配置文件失败: {str(e)}")
             print("将使用手动输入模式")
             default_app_token = ""
-            default_tenant_access_token = ""
             default_table_id = ""
+            config_future = None
         
         # 获取用户输入
         app_token = input(f"请输入App Token (回车使用配置文件默认值): ").strip()
@@ -292,8 +266,7 @@ def main():
         
         tenant_access_token = input(f"请输入Tenant Access Token (回车使用配置文件默认值): ").strip()
         if not tenant_access_token:
-            tenant_access_token = default_tenant_access_token
-            if tenant_access_token:
+            if config_future is not None:
                 print(f"使用配置文件Tenant Access Token")
             else:
                 print("❌ 错误: Tenant Access Token不能为空")
@@ -302,7 +275,7 @@ def main():
         # 获取CSV文件路径
         csv_file_path = input("请输入CSV文件路径 (回车使用默认test.csv): ").strip()
         if not csv_file_path:
-            csv_file_path = "/Users/daiweiwei/独立开发/makemoney/test.csv"
+            csv_file_path = "test.csv"
             print(f"使用默认CSV文件: {csv_file_path}")
         
         # 检查文件是否存在
@@ -318,9 +291,15 @@ def main():
         print(f"标准化后字段: {[normalize_field_name(h) for h in headers]}")
         
         print(f"\n🔍 更新规则:")
-        print(f"   - 如果基金代码+交易账户匹配现有记录，则更新该记录")
+        print(f"   - 如果基金代码+交易账户匹配现有记录，则只更新值发生变化的字段")
+        print(f"   - 如果所有字段都未变化，则跳过该行")
         print(f"   - 如果不匹配，则创建新记录")
         
+        # 选择写入模式
+        batch_input = input("\n是否使用批量写入模式（每批最多500条）？(Y/n): ").strip().lower()
+        batch_mode = batch_input not in ['n', 'no']
+        print(f"写入模式: {'批量写入' if batch_mode else '逐条写入'}")
+        
         # 确认导入
         confirm = input("\n确认导入吗？(y/N): ").strip().lower()
         if confirm not in ['y', 'yes']:
@@ -329,8 +308,16 @@ def main():
         
         print("\n⚠️  提示: 导入过程中可以按 Ctrl+C 中断操作")
         
+        # 使用配置文件的token时，到这里才等待后台获取完成
+        if not tenant_access_token:
+            tenant_access_token = wait_for_tenant_access_token(config_future)
+            if not tenant_access_token:
+                print("❌ 错误: Tenant Access Token不能为空")
+                return
+        
         # 执行导入
-        import_csv_to_feishu(app_token, table_id, csv_file_path, tenant_access_token)
+        import_csv_to_feishu(app_token, table_id, csv_file_path, tenant_access_token, batch_mode, resume=resume,
+                             stream=stream)
         
     except KeyboardInterrupt:
         print("\n⚠️  用户中断操作")
@@ -339,4 +326,19 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='飞书数据表CSV智能导入工具')
+    parser.add_argument('--resume', action='store_true', help='跳过上次中断前已完成的工作')
+    parser.add_argument('--stream', action='store_true', default=None,
+                        help='分块流式导入，内存占用与文件大小无关（适合超大的导出文件）')
+    parser.add_argument('--dry-run', metavar='CSV',
+                        help='不写入飞书，按本地镜像预览CSV中待创建/待更新的行数（表格取config.json中的配置）')
+    args = parser.parse_args()
+    
+    configure_logging()
+    try:
+        if args.dry_run:
+            preview_main(args.dry_run)
+        else:
+            main(resume=args.resume, stream=args.stream)
+    finally:
+        write_run_summary('import')
@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# 所有脚本共用的日志器名称前缀
+LOGGER_NAME = 'fund'
+
+# 默认的指标输出目录（每个脚本一个文件）
+DEFAULT_METRICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_metrics')
+
+
+def percentile(sorted_values, pct):
+    """最近秩法计算百分位，sorted_values需已排序"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Metrics:
+    """进程内的计时器和计数器（线程安全）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.timings = {}
+            self.started_at = time.time()
+
+    def incr(self, name, value=1):
+        """计数器累加"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """记录一次耗时（秒）"""
+        with self.lock:
+            self.timings.setdefault(name, []).append(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """用with包裹需要计时的代码块"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def summary(self):
+        """汇总为可序列化的字典，耗时的百分位以毫秒表示"""
+        with self.lock:
+            counters = dict(self.counters)
+            timings = {name: sorted(values) for name, values in self.timings.items()}
+            started_at = self.started_at
+
+        timers = {}
+        for name, values in timings.items():
+            timers[name] = {
+                'count': len(values),
+                'total_s': round(sum(values), 4),
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p95_ms': round(percentile(values, 95) * 1000, 2),
+                'p99_ms': round(percentile(values, 99) * 1000, 2),
+                'max_ms': round(values[-1] * 1000, 2),
+            }
+        return {
+            'started_at': datetime.fromtimestamp(started_at).isoformat(timespec='seconds'),
+            'duration_s': round(time.time() - started_at, 3),
+            'counters': counters,
+            'timers': timers,
+        }
+
+    def to_prometheus(self, run_name):
+        """转换为Prometheus textfile collector格式"""
+        summary = self.summary()
+        label = f'run="{run_name}"'
+        lines = [
+            '# TYPE fund_run_duration_seconds gauge',
+            f'fund_run_duration_seconds{{{label}}} {summary["duration_s"]}',
+            '# TYPE fund_counter_total counter',
+        ]
+        for name, value in sorted(summary['counters'].items()):
+            lines.append(f'fund_counter_total{{{label},name="{name}"}} {value}')
+        lines.append('# TYPE fund_stage_seconds summary')
+        for name, timer in sorted(summary['timers'].items()):
+            for pct in (50, 95, 99):
+                quantile = pct / 100
+                lines.append(f'fund_stage_seconds{{{label},stage="{name}",quantile="{quantile}"}} '
+                             f'{timer[f"p{pct}_ms"] / 1000}')
+            lines.append(f'fund_stage_seconds_sum{{{label},stage="{name}"}} {timer["total_s"]}')
+            lines.append(f'fund_stage_seconds_count{{{label},stage="{name}"}} {timer["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """获取进程内共享的指标对象"""
+    return _metrics
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """始终写入当前的sys.stdout，与原来的print输出保持一致（也便于重定向）"""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def get_logger(name=None):
+    """获取分级日志器：逐行的明细用debug，进度和结果用info"""
+    root = logging.getLogger(LOGGER_NAME)
+    if not root.handlers:
+        handler = _StdoutHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        root.propagate = False
+    return root.getChild(name) if name else root
+
+
+def configure_logging(level=None):
+    """按config.json中的log_level（DEBUG/INFO/WARNING）设置日志级别，由各脚本入口调用"""
+    from config_loader import get_setting
+
+    level = level or get_setting('log_level', 'INFO')
+    get_logger().setLevel(getattr(logging, str(level).upper(), logging.INFO))
+
+
+def write_run_summary(run_name, output_path=None):
+    """把本次运行的指标写成JSON（默认）或Prometheus textfile（路径以.prom结尾），返回文件路径
+
+    输出路径可在config.json的metrics_output中配置，{run}会替换为脚本名
+    """
+    from config_loader import get_setting
+
+    if output_path is None:
+        output_path = get_setting('metrics_output') or os.path.join(DEFAULT_METRICS_DIR, '{run}.json')
+    output_path = output_path.replace('{run}', run_name)
+
+    if output_path.endswith('.prom'):
+        content = _metrics.to_prometheus(run_name)
+    else:
+        content = json.dumps({'run': run_name, **_metrics.summary()}, ensure_ascii=False, indent=2)
+
+    logger = get_logger('metrics')
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        temp_path = output_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temp_path, output_path)
+    except OSError as e:
+        logger.warning(f"⚠️  写入运行指标失败: {str(e)}")
+        return None
+
+    logger.info(f"📈 运行指标已保存到: {output_path}")
+    return output_path
@@ -0,0 +1,300 @@
+import argparse
+import os
+from config_loader import load_config, prefetch_feishu_config, wait_for_tenant_access_token
+from bitable_mirror import load_all_records
+from feishu_bitable import batch_upsert_records, create_client, diff_record_fields, field_text, preload_feishu_sdk
+from akshare_fetcher import get_akshare_fetcher
+from fund_cache import get_fund_universe_index, normalize_fund_code
+from holdings_csv import NUMERIC_FIELDS, clean_numeric_value, read_cleaned_rows
+from record_index import RecordIndex
+from tag_matcher import load_compiled_tag_library
+from update_fund_type import RETRY_FUND_TYPES, add_fund_type_column
+from add_fund_tags import add_tag_columns, match_tags_by_fund_type
+from run_journal import file_fingerprint, open_journal
+from work_scheduler import get_deadline, get_priority, order_groups, order_records
+from metrics import configure_logging, get_logger, get_metrics, write_run_summary
+
+
+logger = get_logger(__name__)
+
+
+def join_csv_with_table(records, csv_file_path):
+    """将CSV与表格记录按基金代码+交易账户合并
+    
+    返回条目列表，每个条目包含record_id（新记录为None）、表格中的原始字段
+    和合并后的字段；表格中存在但CSV中没有的记录也会参与后续补全
+    """
+    record_index = RecordIndex.from_fields(records)
+    fields_by_id = dict(records)
+    matched_record_ids = set()
+    entries = []
+    
+    for row_index, record_key, cleaned_row in read_cleaned_rows(csv_file_path):
+        existing_record = record_index.get(cleaned_row['基金代码'], cleaned_row['交易账户'])
+        if existing_record:
+            existing_fields = fields_by_id[existing_record.record_id]
+            matched_record_ids.add(existing_record.record_id)
+            entries.append({
+                'label': row_index,
+                'record_id': existing_record.record_id,
+                'existing': existing_fields,
+                'fields': {**existing_fields, **cleaned_row},
+            })
+        else:
+            entries.append({
+                'label': row_index,
+                'record_id': None,
+                'existing': {},
+                'fields': dict(cleaned_row),
+            })
+    
+    for record_id, fields in records:
+        if record_id not in matched_record_ids:
+            entries.append({
+                'label': record_id,
+                'record_id': record_id,
+                'existing': fields,
+                'fields': dict(fields),
+            })
+    
+    return entries
+
+
+def describe_entry(entry):
+    """排序用：(资产情况, 是否为新记录, 表格中是否卡在获取失败)"""
+    return (clean_numeric_value(field_text(entry['fields'].get('资产情况'))),
+            entry['record_id'] is None,
+            field_text(entry['existing'].get('基金类型')) == '获取失败')
+
+
+def resolve_fund_types(entries, bulk_mode=True, priority='asset', deadline=None):
+    """为缺少基金类型的条目补全基金类型，每个基金代码只查询一次
+
+    基金代码按priority排序查询，时间预算用完后剩余条目的基金类型留空，下次运行再补全
+    """
+    code_to_entries = {}
+    for entry in entries:
+        fund_code = field_text(entry['fields'].get('基金代码'))
+        if fund_code and field_text(entry['fields'].get('基金类型')) in RETRY_FUND_TYPES:
+            code_key = normalize_fund_code(fund_code) or fund_code
+            code_to_entries.setdefault(code_key, []).append(entry)
+    code_to_entries = order_groups(code_to_entries, describe_entry, priority)
+    
+    logger.info(f"🔍 需要补全基金类型: {sum(len(group) for group in code_to_entries.values())} 条记录，"
+                f"{len(code_to_entries)} 个基金代码")
+    
+    universe_index = get_fund_universe_index() if bulk_mode and code_to_entries else None
+    fetcher = get_akshare_fetcher()
+    fetch_count = 0
+    resolved_count = 0
+    
+    for fund_code, fund_type, from_network in fetcher.lookup_all(code_to_entries, universe_index=universe_index,
+                                                                 deadline=deadline):
+        for entry in code_to_entries[fund_code]:
+            entry['fields']['基金类型'] = fund_type
+        resolved_count += 1
+        if from_network:
+            fetch_count += 1
+    
+    logger.info(f"🌐 akshare查询: {fetch_count} 次")
+    if fetcher.breaker.is_open:
+        logger.warning("⚠️  akshare不可用，部分记录的基金类型留待下次运行补全")
+    elif deadline is not None and deadline.expired and resolved_count < len(code_to_entries):
+        logger.warning(f"⏰ 时间预算已用完，剩余 {len(code_to_entries) - resolved_count} 个基金代码的基金类型留待下次运行补全")
+
+
+def assign_tags(entries, tag_library):
+    """为缺少标签的条目在内存中计算标签"""
+    tagged_count = 0
+    for entry in entries:
+        fields = entry['fields']
+        fund_name = field_text(fields.get('基金名称'))
+        if not fund_name:
+            continue
+        
+        # 已有两个标签的记录不覆盖
+        if field_text(fields.get('标签1')) and field_text(fields.get('标签2')):
+            continue
+        
+        matched_tags, _ = match_tags_by_fund_type(field_text(fields.get('基金类型')), fund_name, tag_library)
+        fields['标签1'] = matched_tags[0] or ''
+        fields['标签2'] = matched_tags[1] or ''
+        tagged_count += 1
+    
+    logger.info(f"🏷️  计算标签: {tagged_count} 条记录")
+
+
+def run_pipeline(app_token, table_id, csv_file_path, tenant_access_token, bulk_mode=True, resume=False,
+                 priority=None, time_budget=None):
+    """导入CSV → 补全基金类型 → 计算标签，只扫描一次表格，每条记录最多写入一次
+    
+    每条记录写入后记入进度日志，resume为True时跳过上次中断前已写入的记录；
+    查询和写入都按priority排序（见work_scheduler.PRIORITIES），time_budget秒用完后剩余的工作留待下次运行
+    """
+    client = create_client()
+    
+    logger.info(f"开始执行数据流水线: {csv_file_path}")
+    logger.info(f"目标数据表ID: {table_id}")
+    
+    # 确保基金类型和标签列存在
+    column_success, column_msg = add_fund_type_column(client, app_token, table_id, tenant_access_token)
+    if not column_success:
+        logger.error(f"❌ 无法添加基金类型列: {column_msg}")
+        return
+    add_tag_columns(client, app_token, table_id, tenant_access_token)
+    
+    # 只获取一次表格记录（优先从本地镜像增量同步）
+    logger.info("📋 正在获取飞书表格中的所有记录...")
+    metrics = get_metrics()
+    with metrics.timer('stage_load_records'):
+        records = load_all_records(client, app_token, table_id, tenant_access_token)
+    
+    with metrics.timer('stage_join_csv'):
+        entries = join_csv_with_table(records, csv_file_path)
+    
+    priority = get_priority(priority)
+    deadline = get_deadline(time_budget)
+    entries = order_records(entries, describe_entry, priority)
+    
+    tag_library = load_compiled_tag_library().tag_library
+    with metrics.timer('stage_fund_types'):
+        resolve_fund_types(entries, bulk_mode, priority, deadline)
+    with metrics.timer('stage_tags'):
+        assign_tags(entries, tag_library)
+    
+    journal = open_journal('pipeline', app_token, table_id, file_fingerprint(csv_file_path), resume=resume)
+    
+    # 合并所有变化的字段，每条记录只写一次
+    creates = []
+    updates = []
+    unchanged_count = 0
+    resumed_count = 0
+    for entry in entries:
+        if journal.is_done(entry['label']):
+            resumed_count += 1
+            continue
+        if entry['record_id'] is None:
+            creates.append((entry['label'], entry['fields']))
+            continue
+        changed_fields = diff_record_fields(entry['fields'], entry['existing'], NUMERIC_FIELDS)
+        if changed_fields:
+            updates.append((entry['label'], entry['record_id'], changed_fields))
+        else:
+            unchanged_count += 1
+    
+    logger.info(f"\n📦 批量写入: 待创建 {len(creates)} 条, 待更新 {len(updates)} 条, 无变化 {unchanged_count} 条")
+    if resumed_count:
+        logger.info(f"♻️  断点续传跳过: {resumed_count} 条")
+    with metrics.timer('stage_write'):
+        create_count, update_count, error_count = batch_upsert_records(
+            client, app_token, table_id, creates, updates, tenant_access_token,
+            on_written=lambda label: journal.mark_done(label), deadline=deadline)
+    
+    if deadline.deferred:
+        logger.warning(f"⏰ 时间预算已用完，{deadline.deferred} 条记录的写入已取消，留待下次运行")
+    journal.close(completed=error_count == 0 and not deadline.deferred)
+    if error_count or deadline.deferred:
+        logger.info("♻️  重新运行时加上 --resume 可跳过已写入的记录")
+    
+    logger.info("\n📊 流水线完成！")
+    logger.info(f"   ➕ 新创建: {create_count} 条")
+    logger.info(f"   🔄 已更新: {update_count} 条")
+    logger.info(f"   ⏸️  无变化跳过: {unchanged_count} 条")
+    logger.info(f"❌ 失败: {error_count} 条")
+    return create_count, update_count, unchanged_count, error_count
+
+
+def main(resume=False):
+    """主函数，resume为True时跳过上次中断前已完成的工作"""
+    print("=== 飞书表格数据流水线：导入 → 基金类型 → 标签 ===")
+    print("💡 一次扫描表格，合并所有变化后每条记录只写入一次")
+    
+    try:
+        # 飞书SDK和tenant_access_token都在后台准备，与下面的交互提示同时进行
+        preload_feishu_sdk()
+        
+        # 从配置文件加载默认值
+        try:
+            config = load_config()
+            default_app_token = config['app_token']
+            default_table_id = config['table_id']
+            config_future = prefetch_feishu_config()
+        except Exception as e:
+            print(f"⚠️  加载配置文件失败: {str(e)}")
+            print("将使用手动输入模式")
+            default_app_token = ""
+            default_table_id = ""
+            config_future = None
+        
+        # 获取用户输入
+        app_token = input(f"请输入App Token (回车使用配置文件默认值): ").strip()
+        if not app_token:
+            app_token = default_app_token
+            if app_token:
+                print(f"使用配置文件App Token: {app_token}")
+            else:
+                print("❌ 错误: App Token不能为空")
+                return
+        
+        table_id = input(f"请输入Table ID (回车使用配置文件默认值): ").strip()
+        if not table_id:
+            table_id = default_table_id
+            if table_id:
+                print(f"使用配置文件Table ID: {table_id}")
+            else:
+                print("❌ 错误: Table ID不能为空")
+                return
+        
+        tenant_access_token = input(f"请输入Tenant Access Token (回车使用配置文件默认值): ").strip()
+        if not tenant_access_token:
+            if config_future is not None:
+                print(f"使用配置文件Tenant Access Token")
+            else:
+                print("❌ 错误: Tenant Access Token不能为空")
+                return
+        
+        # 获取CSV文件路径
+        default_file = "test.csv"
+        csv_file_path = input(f"请输入CSV文件路径 (回车使用默认: {default_file}): ").strip()
+        if not csv_file_path:
+            csv_file_path = default_file
+        
+        if not os.path.exists(csv_file_path):
+            print(f"❌ 错误: 文件不存在 - {csv_file_path}")
+            return
+        
+        # 选择查询模式
+        bulk_input = input("\n是否使用全市场基金列表批量分类（未收录的基金再逐个查询）？(Y/n): ").strip().lower()
+        bulk_mode = bulk_input not in ['n', 'no']
+        
+        # 确认执行
+        confirm = input("\n确认开始执行吗？(y/N): ").strip().lower()
+        if confirm not in ['y', 'yes']:
+            print("❌ 取消执行")
+            return
+        
+        # 使用配置文件的token时，到这里才等待后台获取完成
+        if not tenant_access_token:
+            tenant_access_token = wait_for_tenant_access_token(config_future)
+            if not tenant_access_token:
+                print("❌ 错误: Tenant Access Token不能为空")
+                return
+        
+        run_pipeline(app_token, table_id, csv_file_path, tenant_access_token, bulk_mode, resume=resume)
+        
+    except KeyboardInterrupt:
+        print("\n⚠️  用户中断操作")
+    except Exception as e:
+        print(f"❌ 程序错误: {str(e)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='飞书表格数据流水线')
+    parser.add_argument('--resume', action='store_true', help='跳过上次中断前已完成的工作')
+    args = parser.parse_args()
+    
+    configure_logging()
+    try:
+        main(resume=args.resume)
+    finally:
+        write_run_summary('pipeline')
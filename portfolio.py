@@ -0,0 +1,347 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from config_loader import get_setting
+from fund_cache import normalize_fund_code
+from fx_rates import BASE_CURRENCY, convert_to_cny
+from holdings_csv import clean_numeric_column, read_holdings_frame, resolve_header_mapping
+from run_journal import file_fingerprint
+from metrics import get_logger, get_metrics
+
+
+logger = get_logger(__name__)
+
+
+DEFAULT_PORTFOLIO_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'portfolio_cache.sqlite3')
+
+# 汇总维度 → 显示名称
+DIMENSIONS = {
+    'fund': '基金',          # 同一基金在各销售机构/账户下的持仓合并为一行
+    'type': '基金类型',
+    'tag': '标签',           # 有两个标签的持仓金额平分到两个标签
+    'account': '账户',       # 销售机构+交易账户，文件中没有交易账户时按销售机构
+    'institution': '销售机构',
+    'currency': '结算币种',
+}
+
+# 汇总前先把资产情况按结算币种换算为人民币，汇总表中的资产金额、组合净值都以人民币计价
+VALUE_COLUMN = '人民币金额'
+
+TEXT_COLUMNS = ('基金代码', '基金名称', '销售机构', '交易账户', '基金类型', '标签1', '标签2', '结算币种', '净值日期')
+AMOUNT_COLUMNS = ('持有份额', '基金净值', '资产情况')
+
+# 分组取值为空时的名称
+UNCLASSIFIED = '未分类'
+UNTAGGED = '未打标签'
+
+# 进程内保留的快照数
+MEMORY_SNAPSHOTS = 8
+
+# 快照ID的前缀，汇总口径变化时修改，旧口径缓存的汇总表不再使用
+SNAPSHOT_VERSION = 'cny'
+
+
+def load_positions(csv_file_path):
+    """读取持仓CSV，返回每个持仓一行的DataFrame，文本列已清理，数字列为浮点数
+
+    没有基金代码的行（空行、打印时间行）不计入；资产情况为0而持有份额和基金净值都有时按份额×净值补齐；
+    人民币金额列是按结算币种和净值日期的汇率换算后的资产情况，汇率列缺少汇率时为NaN（见fx_rates.convert_to_cny）
+    """
+    import numpy as np
+    import pandas as pd
+
+    raw_df = read_holdings_frame(csv_file_path)
+    columns = {}
+    for header, field_name in resolve_header_mapping(raw_df.columns).items():
+        # 字段数不足的行缺失的单元格是NaN，当作空文本
+        values = raw_df[header].fillna('').tolist()
+        if field_name in AMOUNT_COLUMNS:
+            columns[field_name] = clean_numeric_column(values)
+        else:
+            columns[field_name] = np.asarray(list(map(str.strip, values)), dtype=object)
+
+    row_count = len(raw_df)
+    positions = pd.DataFrame({
+        **{name: columns.get(name, np.full(row_count, '', dtype=object)) for name in TEXT_COLUMNS},
+        **{name: columns.get(name, np.zeros(row_count)) for name in AMOUNT_COLUMNS},
+    })
+    positions = positions[positions['基金代码'] != ''].reset_index(drop=True)
+    positions['基金代码'] = [normalize_fund_code(code) or code for code in positions['基金代码'].tolist()]
+
+    missing_value = (positions['资产情况'] == 0) & (positions['持有份额'] > 0) & (positions['基金净值'] > 0)
+    positions.loc[missing_value, '资产情况'] = positions['持有份额'] * positions['基金净值']
+    positions[VALUE_COLUMN], positions['汇率'] = convert_to_cny(
+        positions['结算币种'].tolist(), positions['净值日期'].tolist(), positions['资产情况'].to_numpy())
+
+    has_account = positions['交易账户'] != ''
+    positions['账户'] = positions['销售机构'].where(~has_account, positions['销售机构'] + ' ' + positions['交易账户'])
+    return positions
+
+
+def rollup(keys, amounts, total_value, unclassified=UNCLASSIFIED):
+    """按keys分组合计金额，返回[名称, 资产金额, 资产占比, 持仓数]，按资产金额从大到小排列"""
+    import numpy as np
+    import pandas as pd
+
+    keys = np.where(np.asarray(keys, dtype=object) == '', unclassified, keys)
+    grouped = pd.Series(amounts).groupby(keys, sort=False).agg(['sum', 'size'])
+    table = pd.DataFrame({
+        '名称': grouped.index.astype(object),
+        '资产金额': grouped['sum'].to_numpy(),
+        '资产占比': grouped['sum'].to_numpy() / total_value if total_value else 0.0,
+        '持仓数': grouped['size'].to_numpy(),
+    })
+    return table.sort_values('资产金额', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def rollup_funds(positions, total_value):
+    """同一基金在各销售机构/账户下的持仓合并为一行"""
+    grouped = positions.groupby('基金代码', sort=False).agg(**{
+        '基金名称': ('基金名称', 'first'),
+        '基金类型': ('基金类型', 'first'),
+        '持有份额': ('持有份额', 'sum'),
+        '资产金额': (VALUE_COLUMN, 'sum'),
+        '持仓数': (VALUE_COLUMN, 'size'),
+        '销售机构数': ('销售机构', 'nunique'),
+    })
+    table = grouped.reset_index()
+    table.insert(0, '名称', table['基金名称'].where(table['基金名称'] != '', table['基金代码']))
+    table.insert(table.columns.get_loc('资产金额') + 1, '资产占比',
+                 table['资产金额'] / total_value if total_value else 0.0)
+    return table.sort_values('资产金额', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def rollup_tags(positions, total_value):
+    """按标签汇总：有两个标签的持仓金额平分到两个标签，没有标签的计入"未打标签"，占比之和仍为1"""
+    import numpy as np
+
+    tag1 = positions['标签1'].to_numpy()
+    tag2 = positions['标签2'].to_numpy()
+    amounts = positions[VALUE_COLUMN].to_numpy()
+    has_tag1 = tag1 != ''
+    has_tag2 = (tag2 != '') & (tag2 != tag1)
+    tag_count = has_tag1.astype(int) + has_tag2
+    shares = amounts / np.maximum(tag_count, 1)
+    untagged = tag_count == 0
+    keys = np.concatenate([tag1[has_tag1], tag2[has_tag2], np.full(int(untagged.sum()), UNTAGGED, dtype=object)])
+    values = np.concatenate([shares[has_tag1], shares[has_tag2], amounts[untagged]])
+    return rollup(keys, values, total_value)
+
+
+class PortfolioSnapshot:
+    """一次持仓快照的汇总结果，构建后只读
+
+    snapshot_id: 持仓文件的路径、大小和修改时间，文件不变时直接使用缓存的汇总表
+    total_value: 当前组合净值（换算为人民币后的资产情况合计）
+    tables: 维度（见DIMENSIONS）→ 汇总表DataFrame，按资产金额从大到小排列
+    unconverted_count: 缺少汇率、按原币种金额计入的持仓数
+    """
+
+    def __init__(self, snapshot_id, total_value, position_count, tables, created_at=None, unconverted_count=0):
+        self.snapshot_id = snapshot_id
+        self.total_value = total_value
+        self.position_count = position_count
+        self.tables = tables
+        self.created_at = created_at or time.time()
+        self.unconverted_count = unconverted_count
+
+    @classmethod
+    def from_positions(cls, snapshot_id, positions):
+        """由load_positions的结果一次算出所有维度的汇总表"""
+        total_value = float(positions[VALUE_COLUMN].sum())
+        amounts = positions[VALUE_COLUMN].to_numpy()
+        tables = {
+            'fund': rollup_funds(positions, total_value),
+            'type': rollup(positions['基金类型'].to_numpy(), amounts, total_value),
+            'tag': rollup_tags(positions, total_value),
+            'account': rollup(positions['账户'].to_numpy(), amounts, total_value),
+            'institution': rollup(positions['销售机构'].to_numpy(), amounts, total_value),
+            'currency': rollup(positions['结算币种'].to_numpy(), amounts, total_value),
+        }
+        return cls(snapshot_id, total_value, len(positions), tables,
+                   unconverted_count=int(positions['汇率'].isna().sum()))
+
+    @property
+    def fund_count(self):
+        return len(self.tables['fund'])
+
+    @property
+    def currencies(self):
+        return [currency for currency in self.tables['currency']['名称'].tolist() if currency != UNCLASSIFIED]
+
+    def table(self, dimension):
+        return self.tables[dimension]
+
+    def weights(self, dimension):
+        """{名称: 资产占比}"""
+        table = self.tables[dimension]
+        return dict(zip(table['名称'].tolist(), table['资产占比'].tolist()))
+
+
+class PortfolioReport:
+    """按指定维度输出快照，top为每个维度最多输出的行数（0表示全部）"""
+
+    def __init__(self, snapshot, dimensions=None, top=10):
+        self.snapshot = snapshot
+        self.dimensions = list(dimensions or DIMENSIONS)
+        self.top = top
+
+    def rows(self, dimension):
+        table = self.snapshot.table(dimension)
+        return table.head(self.top) if self.top else table
+
+    def to_dict(self):
+        snapshot = self.snapshot
+        return {
+            'snapshot': snapshot.snapshot_id,
+            'total_value': round(snapshot.total_value, 2),
+            'currency': BASE_CURRENCY,
+            'positions': snapshot.position_count,
+            'funds': snapshot.fund_count,
+            'currencies': snapshot.currencies,
+            'unconverted': snapshot.unconverted_count,
+            'tables': {dimension: self.rows(dimension).round({'资产金额': 2, '持有份额': 2}).to_dict('records')
+                       for dimension in self.dimensions},
+        }
+
+    def log(self):
+        snapshot = self.snapshot
+        logger.info(f"\n📊 当前组合净值: {snapshot.total_value:,.2f} {BASE_CURRENCY}"
+                    f"（{snapshot.position_count} 个持仓，{snapshot.fund_count} 只基金）")
+        if len(snapshot.currencies) > 1:
+            logger.info(f"💱 持仓包含多个结算币种（{'、'.join(snapshot.currencies)}），已按净值日期的汇率换算为{BASE_CURRENCY}")
+        if snapshot.unconverted_count:
+            logger.warning(f"⚠️  {snapshot.unconverted_count} 个持仓缺少汇率，按原币种金额计入")
+        for dimension in self.dimensions:
+            table = snapshot.table(dimension)
+            rows = self.rows(dimension)
+            suffix = f"（前 {len(rows)} / {len(table)} 项）" if len(rows) < len(table) else ''
+            logger.info(f"\n📂 按{DIMENSIONS[dimension]}{suffix}:")
+            for name, amount, weight, count in zip(rows['名称'].tolist(), rows['资产金额'].tolist(),
+                                                   rows['资产占比'].tolist(), rows['持仓数'].tolist()):
+                logger.info(f"   {name:<24} {amount:>16,.2f} {weight:>8.2%}  ({count} 个持仓)")
+
+
+class PortfolioCache:
+    """汇总表的本地SQLite缓存，每个快照只汇总一次；最近用过的快照同时保留在内存中"""
+
+    def __init__(self, db_path=None, keep_snapshots=30):
+        self.db_path = db_path or DEFAULT_PORTFOLIO_CACHE_PATH
+        self.keep_snapshots = keep_snapshots
+        self.memory = {}
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS snapshots (
+                snapshot_id TEXT PRIMARY KEY,
+                total_value REAL NOT NULL,
+                position_count INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS rollups (
+                snapshot_id TEXT NOT NULL,
+                dimension TEXT NOT NULL,
+                table_json TEXT NOT NULL,
+                PRIMARY KEY (snapshot_id, dimension)
+            )
+        ''')
+        self.conn.commit()
+
+    def get(self, snapshot_id):
+        """读取缓存的快照，没有时返回None"""
+        with self.lock:
+            snapshot = self.memory.get(snapshot_id)
+            if snapshot is not None:
+                return snapshot
+            row = self.conn.execute(
+                'SELECT total_value, position_count, created_at FROM snapshots WHERE snapshot_id = ?',
+                (snapshot_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            import pandas as pd
+            tables = {}
+            for dimension, table_json in self.conn.execute(
+                    'SELECT dimension, table_json FROM rollups WHERE snapshot_id = ?', (snapshot_id,)):
+                tables[dimension] = pd.DataFrame(json.loads(table_json))
+        if set(tables) != set(DIMENSIONS):
+            return None
+        snapshot = PortfolioSnapshot(snapshot_id, row[0], row[1], tables, created_at=row[2])
+        self._remember(snapshot)
+        return snapshot
+
+    def put(self, snapshot):
+        """保存快照的汇总表，只保留最近keep_snapshots个快照"""
+        # 按列保存（{列名: 取值列表}），读取时直接整列构建DataFrame
+        rows = [(snapshot.snapshot_id, dimension,
+                 json.dumps({column: table[column].tolist() for column in table.columns}, ensure_ascii=False))
+                for dimension, table in snapshot.tables.items()]
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO snapshots (snapshot_id, total_value, position_count, created_at) '
+                'VALUES (?, ?, ?, ?)',
+                (snapshot.snapshot_id, snapshot.total_value, snapshot.position_count, snapshot.created_at)
+            )
+            self.conn.execute('DELETE FROM rollups WHERE snapshot_id = ?', (snapshot.snapshot_id,))
+            self.conn.executemany(
+                'INSERT INTO rollups (snapshot_id, dimension, table_json) VALUES (?, ?, ?)', rows)
+            stale = [snapshot_id for (snapshot_id,) in self.conn.execute(
+                'SELECT snapshot_id FROM snapshots ORDER BY created_at DESC LIMIT -1 OFFSET ?',
+                (self.keep_snapshots,))]
+            self.conn.executemany('DELETE FROM snapshots WHERE snapshot_id = ?', [(s,) for s in stale])
+            self.conn.executemany('DELETE FROM rollups WHERE snapshot_id = ?', [(s,) for s in stale])
+            self.conn.commit()
+        self._remember(snapshot)
+
+    def _remember(self, snapshot):
+        with self.lock:
+            self.memory.pop(snapshot.snapshot_id, None)
+            self.memory[snapshot.snapshot_id] = snapshot
+            while len(self.memory) > MEMORY_SNAPSHOTS:
+                self.memory.pop(next(iter(self.memory)))
+
+
+_portfolio_cache = None
+_portfolio_cache_lock = threading.Lock()
+
+
+def get_portfolio_cache():
+    """获取全局共享的汇总缓存，路径和保留的快照数可在config.json中配置"""
+    global _portfolio_cache
+    with _portfolio_cache_lock:
+        if _portfolio_cache is None:
+            _portfolio_cache = PortfolioCache(
+                db_path=get_setting('portfolio_cache_path', DEFAULT_PORTFOLIO_CACHE_PATH),
+                keep_snapshots=get_setting('portfolio_cache_snapshots', 30),
+            )
+        return _portfolio_cache
+
+
+def get_portfolio_snapshot(csv_file_path, refresh=False):
+    """获取持仓文件的汇总快照
+
+    文件（路径、大小、修改时间）没有变化时直接返回缓存的汇总表，不再读取CSV；
+    refresh为True时重新汇总。读取和汇总的耗时分别记录在portfolio_cached、portfolio_build计时器中；
+    有持仓缺少汇率时不缓存，下次运行重新换算
+    """
+    snapshot_id = f"{SNAPSHOT_VERSION}|{file_fingerprint(csv_file_path)}"
+    cache = get_portfolio_cache()
+    metrics = get_metrics()
+
+    if not refresh:
+        with metrics.timer('portfolio_cached'):
+            snapshot = cache.get(snapshot_id)
+        if snapshot is not None:
+            logger.info(f"💾 使用缓存的汇总结果（{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot.created_at))}）")
+            return snapshot
+
+    logger.info(f"📋 正在汇总持仓: {csv_file_path}")
+    with metrics.timer('portfolio_build'):
+        snapshot = PortfolioSnapshot.from_positions(snapshot_id, load_positions(csv_file_path))
+    if not snapshot.unconverted_count:
+        cache.put(snapshot)
+    return snapshot
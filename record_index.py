@@ -0,0 +1,77 @@
+import sys
+from feishu_bitable import field_text, record_digest
+from holdings_csv import clean_numeric_value, make_record_key
+
+
+class RecordRef:
+    """表格记录的紧凑表示：只保留record_id、脚本用到的几个字段和内容摘要，不保留完整的fields
+
+    同一基金会在多个账户下重复出现，文本字段都经过sys.intern，重复的取值在内存中只有一份；
+    asset_value（资产情况）用于按优先级安排补全的顺序
+    """
+
+    __slots__ = ('record_id', 'fund_code', 'trading_account', 'fund_name', 'fund_type', 'tag1', 'tag2',
+                 'asset_value', 'digest')
+
+    def __init__(self, record_id, fund_code='', trading_account='', fund_name='', fund_type='', tag1='', tag2='',
+                 asset_value=0.0, digest=None):
+        self.record_id = record_id
+        self.fund_code = sys.intern(fund_code)
+        self.trading_account = sys.intern(trading_account)
+        self.fund_name = sys.intern(fund_name)
+        self.fund_type = sys.intern(fund_type)
+        self.tag1 = sys.intern(tag1)
+        self.tag2 = sys.intern(tag2)
+        self.asset_value = asset_value
+        self.digest = digest
+
+    @classmethod
+    def from_fields(cls, record_id, fields, field_names=None, numeric_fields=()):
+        """由飞书返回的字段构建，给出field_names时按这些字段计算内容摘要（见record_digest）"""
+        digest = record_digest(fields, field_names, numeric_fields) if field_names else None
+        return cls(
+            record_id,
+            fund_code=field_text(fields.get('基金代码')),
+            trading_account=field_text(fields.get('交易账户')),
+            fund_name=field_text(fields.get('基金名称')),
+            fund_type=field_text(fields.get('基金类型')),
+            tag1=field_text(fields.get('标签1')),
+            tag2=field_text(fields.get('标签2')),
+            asset_value=clean_numeric_value(field_text(fields.get('资产情况'))),
+            digest=digest,
+        )
+
+    @property
+    def record_key(self):
+        return make_record_key(self.fund_code, self.trading_account)
+
+    def __repr__(self):
+        return f"RecordRef({self.record_id!r}, {self.fund_code!r}, {self.trading_account!r})"
+
+
+class RecordIndex:
+    """(基金代码, 交易账户) → RecordRef的查找索引，缺少任一字段的记录不进入索引"""
+
+    def __init__(self, records=()):
+        self.records = {}
+        for record in records:
+            self.add(record)
+
+    @classmethod
+    def from_fields(cls, records, field_names=None, numeric_fields=()):
+        """由逐条产生的(record_id, fields)构建，整个过程只持有索引本身"""
+        return cls(RecordRef.from_fields(record_id, fields, field_names, numeric_fields)
+                   for record_id, fields in records)
+
+    def add(self, record):
+        if record.fund_code and record.trading_account:
+            self.records[(record.fund_code, record.trading_account)] = record
+
+    def get(self, fund_code, trading_account):
+        return self.records.get((fund_code, trading_account))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records.values())
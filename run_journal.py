@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import threading
+from config_loader import get_setting
+from metrics import get_logger
+
+
+logger = get_logger(__name__)
+
+
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.journal')
+
+# 本地工具默认每处理50个基金代码写一次检查点
+DEFAULT_CHECKPOINT_EVERY = 50
+
+
+def file_fingerprint(file_path):
+    """文件的路径、大小和修改时间，文件内容变化后旧的进度记录不再适用"""
+    stat = os.stat(file_path)
+    return f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+class RunJournal:
+    """追加写入的进度日志（JSON Lines），每完成一项写一行并立即刷盘
+
+    resume为False时丢弃旧记录重新开始；为True时载入已完成的项，调用方据此跳过。
+    进程被中断时最后一行可能不完整，载入时忽略即可。
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.completed = {}
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if resume:
+            self._load()
+        elif os.path.exists(path):
+            os.remove(path)
+        self.file = open(path, 'a', encoding='utf-8')
+        # 上次中断时最后一行可能没写完，先换行，免得新记录接在半行后面一起被忽略
+        if self.file.tell() and not self._ends_with_newline():
+            self.file.write('\n')
+            self.file.flush()
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _load(self):
+        self.completed.update(read_journal_entries(self.path))
+
+    def __len__(self):
+        return len(self.completed)
+
+    def is_done(self, key):
+        return str(key) in self.completed
+
+    def get(self, key, default=None):
+        return self.completed.get(str(key), default)
+
+    def mark_done(self, key, value=None):
+        """记录一项已完成的工作"""
+        key = str(key)
+        with self.lock:
+            self.completed[key] = value
+            self.file.write(json.dumps({'key': key, 'value': value}, ensure_ascii=False) + '\n')
+            self.file.flush()
+
+    def close(self, completed=False):
+        """关闭日志；整个任务完成时删除日志文件，下次运行从头开始"""
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+        if completed and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def read_journal_entries(path):
+    """读取进度日志中已完成的项{key: value}，文件不存在时为空"""
+    completed = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                completed[entry['key']] = entry.get('value')
+    except FileNotFoundError:
+        pass
+    return completed
+
+
+def get_journal_path(job_name, *identity):
+    """按任务名和任务标识（如表格ID、输入文件指纹）确定进度日志的路径"""
+    digest = hashlib.sha1('|'.join(str(part) for part in identity).encode('utf-8')).hexdigest()[:12]
+    journal_dir = get_setting('journal_dir', DEFAULT_JOURNAL_DIR)
+    return os.path.join(journal_dir, f'{job_name}_{digest}.jsonl')
+
+
+def read_journal(job_name, *identity):
+    """只读地取出已完成的项（不创建也不清空日志），用于预估--resume时剩下的工作"""
+    return set(read_journal_entries(get_journal_path(job_name, *identity)))
+
+
+def open_journal(job_name, *identity, resume=False):
+    """按任务名和任务标识（如表格ID、输入文件指纹）打开进度日志"""
+    journal = RunJournal(get_journal_path(job_name, *identity), resume=resume)
+    if resume:
+        logger.info(f"♻️  断点续传: 已完成 {len(journal)} 项，将跳过这些工作")
+    return journal
+
+
+def get_checkpoint_path(file_path):
+    """本地CSV的检查点文件路径"""
+    return f'{file_path}.checkpoint.csv'
+
+
+def write_checkpoint(df, checkpoint_path):
+    """原子写入DataFrame检查点（先写临时文件再替换），中途崩溃不会留下半个文件"""
+    temp_path = checkpoint_path + '.tmp'
+    df.to_csv(temp_path, index=False, encoding='utf-8-sig')
+    os.replace(temp_path, checkpoint_path)
@@ -0,0 +1,320 @@
+import math
+from config_loader import get_setting
+from bitable_mirror import get_bitable_mirror, is_mirror_enabled, iter_table_records
+from feishu_bitable import BATCH_SIZE, record_digest
+from fund_cache import get_fund_universe_index, lookup_cached_fund_type, normalize_fund_code
+from holdings_csv import NUMERIC_FIELDS, get_csv_headers, read_cleaned_rows, resolve_header_mapping
+from record_index import RecordIndex, RecordRef
+from run_journal import file_fingerprint, read_journal
+from tag_matcher import load_compiled_tag_library
+from update_fund_type import RETRY_FUND_TYPES
+from add_fund_tags import match_tags_by_fund_type
+from metrics import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# 飞书列表接口每页最多返回500条记录
+LIST_PAGE_SIZE = 500
+
+# 流水线写入前重新补全的字段
+DERIVED_FIELDS = ('基金类型', '标签1', '标签2')
+
+
+class RunPlan:
+    """一次运行的预估工作量，不写入任何数据
+
+    counts: 各类记录数（待创建、待更新、跳过等），按添加顺序输出
+    stages: 按执行顺序排列的阶段[(阶段名, 飞书API调用次数, akshare查询次数)]，同一阶段内两者并行
+    """
+
+    def __init__(self, job_name):
+        self.job_name = job_name
+        self.counts = {}
+        self.stages = []
+        self.notes = []
+
+    def add_stage(self, name, api_calls=0, akshare_calls=0):
+        self.stages.append((name, api_calls, akshare_calls))
+
+    @property
+    def api_calls(self):
+        return sum(api_calls for _, api_calls, _ in self.stages)
+
+    @property
+    def akshare_calls(self):
+        return sum(akshare_calls for _, _, akshare_calls in self.stages)
+
+    def estimate_seconds(self, feishu_rate=None, feishu_burst=None, akshare_rate=None):
+        """按config.json中的限流速率估算耗时（秒）
+
+        飞书调用共用一个令牌桶（开头可以突发feishu_burst次），akshare查询另有令牌桶；
+        只计限流等待，不含接口本身的响应时间，是理想情况下的下限
+        """
+        feishu_rate = feishu_rate or get_setting('feishu_rate_per_second', 10)
+        burst_left = get_setting('feishu_rate_burst', 10) if feishu_burst is None else feishu_burst
+        akshare_rate = akshare_rate or get_setting('akshare_rate_per_second', 2)
+
+        total = 0.0
+        for _, api_calls, akshare_calls in self.stages:
+            throttled = max(0, api_calls - burst_left)
+            burst_left = max(0, burst_left - api_calls)
+            total += max(throttled / feishu_rate, akshare_calls / akshare_rate)
+        return total
+
+    def to_dict(self):
+        return {
+            'job': self.job_name,
+            'counts': dict(self.counts),
+            'stages': [{'name': name, 'api_calls': api_calls, 'akshare_calls': akshare_calls}
+                       for name, api_calls, akshare_calls in self.stages],
+            'api_calls': self.api_calls,
+            'akshare_calls': self.akshare_calls,
+            'estimated_seconds': round(self.estimate_seconds(), 1),
+            'notes': list(self.notes),
+        }
+
+    def log(self):
+        """输出计划"""
+        logger.info(f"\n📋 运行计划（{self.job_name}，未写入任何数据）:")
+        for name, count in self.counts.items():
+            logger.info(f"   {name}: {count}")
+        logger.info("🔹 各阶段调用次数:")
+        for name, api_calls, akshare_calls in self.stages:
+            akshare_text = f", akshare {akshare_calls} 次" if akshare_calls else ''
+            logger.info(f"   {name}: 飞书API {api_calls} 次{akshare_text}")
+        logger.info(f"📡 合计: 飞书API {self.api_calls} 次, akshare {self.akshare_calls} 次")
+        logger.info(f"⏱️  预计耗时: {format_duration(self.estimate_seconds())}（按限流速率估算的下限）")
+        for note in self.notes:
+            logger.info(f"💡 {note}")
+
+
+def format_duration(seconds):
+    """把秒数格式化为便于阅读的时长"""
+    if seconds < 60:
+        return f"{seconds:.1f}秒"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes < 60:
+        return f"{minutes}分{seconds}秒"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}小时{minutes}分"
+
+
+def list_calls(record_count):
+    """分页读取record_count条记录需要的调用次数（空表也要请求一次）"""
+    return max(1, math.ceil(record_count / LIST_PAGE_SIZE))
+
+
+def write_calls(record_count, batch_mode=True):
+    """写入record_count条记录需要的调用次数"""
+    return math.ceil(record_count / BATCH_SIZE) if batch_mode else record_count
+
+
+def estimate_load_calls(app_token, table_id, record_count):
+    """运行时获取表格记录的调用次数：镜像需要全量同步时扫描整张表，增量同步通常只需一页"""
+    if is_mirror_enabled() and not get_bitable_mirror().needs_full_sync(app_token, table_id):
+        return 1
+    return list_calls(record_count)
+
+
+def load_table_refs(client, app_token, table_id, tenant_access_token, field_names=None, numeric_fields=()):
+    """所有表格记录的RecordRef列表（包括缺少基金代码或交易账户的记录），来源见iter_table_records"""
+    refs = [RecordRef.from_fields(record_id, fields, field_names, numeric_fields)
+            for record_id, fields in iter_table_records(client, app_token, table_id, tenant_access_token)]
+    logger.info(f"📋 表格中共有 {len(refs)} 条记录{'（本地镜像上次同步时的内容）' if client is None else ''}")
+    return refs
+
+
+class CachedFundTypes:
+    """规划时查询基金类型：只查全市场索引和本地缓存，不下载也不调用akshare
+
+    get()返回缓存中的基金类型，需要调用akshare时返回None；全市场索引与运行时一样在第一次查询时才载入
+    """
+
+    def __init__(self, bulk_mode=True):
+        self.bulk_mode = bulk_mode
+        self.universe_index = None
+        self.universe_missing = False
+        self.types = {}
+
+    def get(self, fund_code):
+        normalized_code = normalize_fund_code(fund_code) or fund_code
+        if normalized_code not in self.types:
+            if self.bulk_mode and not self.types:
+                self.universe_index = get_fund_universe_index(download=False)
+                self.universe_missing = self.universe_index is None
+            self.types[normalized_code] = lookup_cached_fund_type(fund_code, universe_index=self.universe_index)[1]
+        return self.types[normalized_code]
+
+    def fetch_count(self, plan):
+        """运行时需要的akshare查询次数（含下载全市场列表），今天还没有下载全市场列表时按上限计算"""
+        fetch_count = sum(1 for fund_type in self.types.values() if fund_type is None)
+        if self.universe_missing:
+            # 运行时先下载一次全市场列表，其中收录的基金不必逐个查询
+            plan.notes.append("今天还没有下载全市场基金列表，akshare查询次数按全部未收录计算（上限）")
+            return fetch_count + 1
+        return fetch_count
+
+
+def csv_field_names(csv_file_path):
+    return list(resolve_header_mapping(get_csv_headers(csv_file_path)).values())
+
+
+def plan_import(client, app_token, table_id, csv_file_path, tenant_access_token=None, batch_mode=True,
+                resume=False):
+    """预估import_csv_to_feishu的工作量：按内容摘要比对CSV与表格，client为None时只读本地镜像"""
+    field_names = csv_field_names(csv_file_path)
+    record_index = RecordIndex.from_fields(iter_table_records(client, app_token, table_id, tenant_access_token),
+                                           field_names, NUMERIC_FIELDS)
+    if client is None and not len(record_index):
+        logger.warning("⚠️  本地镜像中没有该表格的记录（尚未同步过或已关闭镜像），所有行都会算作新建")
+    done = read_journal('import', app_token, table_id, file_fingerprint(csv_file_path)) if resume else set()
+
+    create_count = 0
+    update_count = 0
+    unchanged_count = 0
+    resumed_count = 0
+    for _, record_key, cleaned_row in read_cleaned_rows(csv_file_path):
+        if record_key in done:
+            resumed_count += 1
+            continue
+        existing = record_index.get(cleaned_row['基金代码'], cleaned_row['交易账户'])
+        if existing is None:
+            create_count += 1
+        elif existing.digest != record_digest(cleaned_row, field_names, NUMERIC_FIELDS):
+            update_count += 1
+        else:
+            unchanged_count += 1
+
+    plan = RunPlan('import')
+    plan.counts.update({'表格现有记录': len(record_index), '➕ 待创建': create_count, '🔄 待更新': update_count,
+                        '⏸️  无变化跳过': unchanged_count})
+    if resume:
+        plan.counts['♻️  断点续传跳过'] = resumed_count
+    plan.add_stage('读取表格记录', estimate_load_calls(app_token, table_id, len(record_index)))
+    plan.add_stage('批量写入' if batch_mode else '逐条写入',
+                   write_calls(create_count, batch_mode) + write_calls(update_count, batch_mode))
+    return plan
+
+
+def plan_fund_types(client, app_token, table_id, tenant_access_token=None, bulk_mode=True, resume=False):
+    """预估update_fund_types的工作量：待补全的记录数、去重后的基金代码和需要调用akshare的次数"""
+    refs = load_table_refs(client, app_token, table_id, tenant_access_token)
+    done = read_journal('update_fund_type', app_token, table_id) if resume else set()
+
+    candidates = [ref for ref in refs if ref.fund_code and ref.fund_type in RETRY_FUND_TYPES]
+    pending = [ref for ref in candidates if ref.record_id not in done]
+    fund_types = CachedFundTypes(bulk_mode)
+    for ref in pending:
+        fund_types.get(ref.fund_code)
+
+    plan = RunPlan('update_fund_type')
+    fetch_count = fund_types.fetch_count(plan)
+    plan.counts.update({
+        '表格现有记录': len(refs),
+        '⏭️  已有基金类型跳过': sum(1 for ref in refs if ref.fund_code) - len(candidates),
+        '🔄 待更新': len(pending),
+        '基金代码（去重）': len(fund_types.types),
+    })
+    if resume:
+        plan.counts['♻️  断点续传跳过'] = len(candidates) - len(pending)
+    plan.add_stage('检查基金类型列', 1)
+    plan.add_stage('读取待补全记录', list_calls(len(candidates)))
+    plan.add_stage('查询基金类型并逐条写入', len(pending), fetch_count)
+    return plan
+
+
+def plan_tags(client, app_token, table_id, tenant_access_token=None, resume=False):
+    """预估update_fund_tags的工作量：有基金名称、标签不完整的记录都会写入一次"""
+    refs = load_table_refs(client, app_token, table_id, tenant_access_token)
+    done = read_journal('add_fund_tags', app_token, table_id) if resume else set()
+
+    candidates = [ref for ref in refs if ref.fund_name and not (ref.tag1 and ref.tag2)]
+    pending = [ref for ref in candidates if ref.record_id not in done]
+
+    plan = RunPlan('add_fund_tags')
+    plan.counts.update({
+        '表格现有记录': len(refs),
+        '⏭️  已有标签跳过': sum(1 for ref in refs if ref.fund_name) - len(candidates),
+        '🔄 待更新': len(pending),
+    })
+    if resume:
+        plan.counts['♻️  断点续传跳过'] = len(candidates) - len(pending)
+    plan.add_stage('检查标签列', 1)
+    plan.add_stage('读取待打标签记录', list_calls(len(candidates)))
+    plan.add_stage('逐条写入', len(pending))
+    return plan
+
+
+def plan_pipeline(client, app_token, table_id, csv_file_path, tenant_access_token=None, bulk_mode=True,
+                  resume=False):
+    """预估run_pipeline的工作量：按与运行时相同的规则合并CSV与表格、补全基金类型和标签，再与现有记录比较
+
+    基金类型只查本地缓存和全市场索引，需要调用akshare才能确定类型的记录按会更新计算
+    """
+    field_names = csv_field_names(csv_file_path)
+    # 基金类型和标签会在写入前重新补全，单独比较，不计入内容摘要
+    content_fields = [name for name in field_names if name not in DERIVED_FIELDS]
+    refs = load_table_refs(client, app_token, table_id, tenant_access_token, content_fields, NUMERIC_FIELDS)
+    record_index = RecordIndex(refs)
+    done = read_journal('pipeline', app_token, table_id, file_fingerprint(csv_file_path)) if resume else set()
+    tag_library = load_compiled_tag_library().tag_library
+    fund_types = CachedFundTypes(bulk_mode)
+    counts = {'create': 0, 'update': 0, 'unchanged': 0, 'resumed': 0}
+
+    def classify(label, row, existing, content_changed):
+        fund_code = row.get('基金代码', existing.fund_code if existing else '')
+        fund_name = row.get('基金名称', existing.fund_name if existing else '')
+        fund_type = row.get('基金类型', existing.fund_type if existing else '')
+        tags = (row.get('标签1', existing.tag1 if existing else ''), row.get('标签2', existing.tag2 if existing else ''))
+
+        # 基金类型在写入前统一补全，断点续传跳过的记录也会参与查询；None表示要调用akshare才能确定
+        if fund_code and fund_type in RETRY_FUND_TYPES:
+            fund_type = fund_types.get(fund_code)
+        if fund_name and not (tags[0] and tags[1]):
+            if fund_type is None:
+                tags = None
+            else:
+                matched_tags, _ = match_tags_by_fund_type(fund_type, fund_name, tag_library)
+                tags = (matched_tags[0] or '', matched_tags[1] or '')
+
+        if str(label) in done:
+            counts['resumed'] += 1
+        elif existing is None:
+            counts['create'] += 1
+        elif content_changed or fund_type != existing.fund_type or tags != (existing.tag1, existing.tag2):
+            counts['update'] += 1
+        else:
+            counts['unchanged'] += 1
+
+    matched_record_ids = set()
+    for row_index, _, cleaned_row in read_cleaned_rows(csv_file_path):
+        existing = record_index.get(cleaned_row['基金代码'], cleaned_row['交易账户'])
+        if existing is None:
+            classify(row_index, cleaned_row, None, True)
+            continue
+        matched_record_ids.add(existing.record_id)
+        classify(row_index, cleaned_row, existing,
+                 existing.digest != record_digest(cleaned_row, content_fields, NUMERIC_FIELDS))
+
+    for ref in refs:
+        if ref.record_id not in matched_record_ids:
+            classify(ref.record_id, {}, ref, False)
+
+    plan = RunPlan('pipeline')
+    fetch_count = fund_types.fetch_count(plan)
+    plan.counts.update({
+        '表格现有记录': len(refs),
+        '➕ 待创建': counts['create'],
+        '🔄 待更新': counts['update'],
+        '⏸️  无变化跳过': counts['unchanged'],
+        '基金代码（待补全类型）': len(fund_types.types),
+    })
+    if resume:
+        plan.counts['♻️  断点续传跳过'] = counts['resumed']
+    plan.add_stage('检查基金类型和标签列', 2)
+    plan.add_stage('读取表格记录', estimate_load_calls(app_token, table_id, len(refs)))
+    plan.add_stage('补全基金类型', 0, fetch_count)
+    plan.add_stage('批量写入', write_calls(counts['create']) + write_calls(counts['update']))
+    return plan
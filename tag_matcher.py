@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import deque
+from config_loader import get_setting
+
+
+DEFAULT_TAG_LIBRARY_PATH = os.path.join(os.path.dirname(__file__), 'config.md')
+
+
+class TagMatcher:
+    """基于Aho-Corasick自动机的多标签匹配器
+    
+    由标签库一次性构建，对每个基金名称只扫描一遍即可找出所有标签及其位置，
+    再按"长标签优先、位置不重叠、最多2个"的规则选出结果。
+    """
+    
+    def __init__(self, tag_library, version=''):
+        self.tag_library = tag_library
+        self.version = version
+        
+        # 按标签库顺序展开(标签, 分类)，同一标签可能出现在多个分类中
+        entries = [(tag, category) for category, tags in tag_library.items() for tag in tags if tag]
+        # 长标签优先；长度相同时保持标签库中的顺序
+        self.entries = sorted(entries, key=lambda entry: -len(entry[0]))
+        
+        self.patterns = []
+        self.pattern_ids = {}
+        self.pattern_ranks = []
+        for rank, (tag, _) in enumerate(self.entries):
+            if tag not in self.pattern_ids:
+                self.pattern_ids[tag] = len(self.patterns)
+                self.patterns.append(tag)
+                self.pattern_ranks.append([])
+            self.pattern_ranks[self.pattern_ids[tag]].append(rank)
+        
+        self._build_automaton()
+    
+    def _build_automaton(self):
+        """构建goto/fail/output表"""
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        
+        for pattern_id, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(pattern_id)
+        
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+    
+    def find_first_positions(self, text):
+        """单次扫描文本，返回{标签id: 首次出现的起始位置}"""
+        positions = {}
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern_id in self.output[state]:
+                if pattern_id not in positions:
+                    positions[pattern_id] = index - len(self.patterns[pattern_id]) + 1
+        return positions
+    
+    def match(self, fund_name, max_tags=2):
+        """从基金名称中匹配标签，返回(标签列表, 分类列表)，标签列表补齐为2个元素"""
+        if not fund_name or not self.entries:
+            return [], []
+        
+        positions = self.find_first_positions(fund_name)
+        
+        # 只对命中的标签按优先级排序
+        ranks = sorted(rank for pattern_id in positions for rank in self.pattern_ranks[pattern_id])
+        
+        matched_tags = []
+        matched_categories = []
+        used_spans = []
+        for rank in ranks:
+            tag, category = self.entries[rank]
+            if tag in matched_tags:
+                continue
+            
+            # 检查是否与已选择的标签重叠
+            start = positions[self.pattern_ids[tag]]
+            end = start + len(tag)
+            if any(start < used_end and used_start < end for used_start, used_end in used_spans):
+                continue
+            
+            matched_tags.append(tag)
+            matched_categories.append(category)
+            used_spans.append((start, end))
+            if len(matched_tags) >= max_tags:
+                break
+        
+        # 确保返回2个元素的列表
+        while len(matched_tags) < max_tags:
+            matched_tags.append("")
+        
+        return matched_tags[:max_tags], matched_categories[:max_tags]
+
+
+def parse_tag_library_text(content):
+    """解析config.md格式的标签库：每行 '分类': ['标签1', '标签2', ...]，兼容全角标点"""
+    tag_library = {}
+    for line in content.splitlines():
+        match = re.match(r"""\s*['"‘“]?([^'"’”:：\[]+?)['"’”]?\s*[:：]\s*\[(.*)\]""", line)
+        if not match:
+            continue
+        category = match.group(1).strip()
+        tags = [tag.strip().strip("""'"‘’“” """) for tag in re.split(r'[,，、]', match.group(2))]
+        tag_library.setdefault(category, []).extend(tag for tag in tags if tag)
+    return tag_library
+
+
+def parse_tag_library(content, file_path):
+    """按文件扩展名解析标签库（.json / .yaml / .yml / 其他按config.md格式）"""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.json':
+        raw_library = json.loads(content)
+    elif extension in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("读取YAML标签库需要安装PyYAML: pip install pyyaml")
+        raw_library = yaml.safe_load(content) or {}
+    else:
+        raw_library = parse_tag_library_text(content)
+    
+    # 去除空标签和重复标签，保持原有顺序
+    tag_library = {}
+    for category, tags in raw_library.items():
+        unique_tags = list(dict.fromkeys(str(tag).strip() for tag in tags if str(tag).strip()))
+        if unique_tags:
+            tag_library[str(category).strip()] = unique_tags
+    return tag_library
+
+
+def get_tag_library_path():
+    """标签库文件路径，可在config.json中通过tag_library_path配置"""
+    return get_setting('tag_library_path', DEFAULT_TAG_LIBRARY_PATH)
+
+
+_loaded_matchers = {}
+_loaded_lock = threading.Lock()
+
+
+def load_compiled_tag_library(file_path=None):
+    """加载并编译标签库，进程内缓存；文件mtime变化且内容哈希变化时才重新编译
+    
+    返回的匹配器带有version（内容哈希），tag_library属性为解析后的标签库
+    """
+    file_path = os.path.abspath(file_path or get_tag_library_path())
+    stat = os.stat(file_path)
+    file_state = (stat.st_mtime_ns, stat.st_size)
+    
+    with _loaded_lock:
+        loaded = _loaded_matchers.get(file_path)
+        if loaded and loaded[0] == file_state:
+            return loaded[1]
+        
+        with open(file_path, 'rb') as f:
+            raw_content = f.read()
+        version = hashlib.sha256(raw_content).hexdigest()[:12]
+        
+        if loaded and loaded[1].version == version:
+            matcher = loaded[1]
+        else:
+            tag_library = parse_tag_library(raw_content.decode('utf-8'), file_path)
+            matcher = TagMatcher(tag_library, version)
+        
+        _loaded_matchers[file_path] = (file_state, matcher)
+        return matcher
+
+
+_compiled_library = None
+_compiled_matcher = None
+
+
+def get_tag_matcher(tag_library):
+    """获取标签库对应的匹配器，同一标签库对象只构建一次"""
+    global _compiled_library, _compiled_matcher
+    
+    # 多个线程可能同时调用，与load_compiled_tag_library共用一把锁
+    with _loaded_lock:
+        # 由load_compiled_tag_library加载的标签库直接复用已编译的匹配器
+        for _, matcher in _loaded_matchers.values():
+            if matcher.tag_library is tag_library:
+                return matcher
+        
+        if _compiled_matcher is None or _compiled_library is not tag_library:
+            _compiled_matcher = TagMatcher(tag_library)
+            _compiled_library = tag_library
+        return _compiled_matcher
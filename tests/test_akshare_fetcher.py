@@ -0,0 +1,63 @@
+import pytest
+
+import akshare_fetcher
+from akshare_fetcher import AkshareFetcher
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """替换akshare请求：state['down']为True时抛出异常，记录每次请求的基金代码"""
+    state = {'down': True, 'calls': []}
+
+    def request_fund_info(normalized_code):
+        state['calls'].append(normalized_code)
+        if state['down']:
+            raise ConnectionError('akshare unavailable')
+        return '股票型', {'基金类型': '股票型'}
+
+    monkeypatch.setattr(akshare_fetcher, 'request_fund_info', request_fund_info)
+    monkeypatch.setattr(akshare_fetcher, 'store_fund_type', lambda *args: None)
+    monkeypatch.setattr(akshare_fetcher, 'lookup_cached_fund_type',
+                        lambda fund_code, universe_index=None: (fund_code, None))
+    return state
+
+
+def make_fetcher(cooldown):
+    return AkshareFetcher(max_workers=1, rate=1000, min_rate=1000, max_retries=2, backoff_base=0, breaker_threshold=2,
+                          breaker_cooldown=cooldown)
+
+
+def test_failure_counts_once_per_code_after_retries(upstream):
+    fetcher = make_fetcher(cooldown=60)
+
+    assert fetcher.fetch('000001') == '获取失败'
+    assert len(upstream['calls']) == 3
+    assert fetcher.breaker.failures == 1
+    assert not fetcher.breaker.is_open
+
+
+def expire_cooldown(breaker):
+    breaker.opened_at -= breaker.cooldown
+
+
+def test_breaker_recovers_after_cooldown_with_probe(upstream):
+    fetcher = make_fetcher(cooldown=60)
+
+    results = list(fetcher.lookup_all(['000001', '000002', '000003']))
+    assert results == [('000001', '获取失败', True)]
+    assert fetcher.breaker.is_open
+    assert fetcher.fetch('000003') is None
+
+    # 冷却结束后的试探失败：重新断开，只请求一次
+    expire_cooldown(fetcher.breaker)
+    upstream['calls'].clear()
+    assert fetcher.fetch('000003') == '获取失败'
+    assert upstream['calls'] == ['000003']
+    assert fetcher.breaker.is_cooling_down
+
+    # 下一次试探成功后恢复
+    expire_cooldown(fetcher.breaker)
+    upstream['down'] = False
+    results = list(fetcher.lookup_all(['000002', '000003']))
+    assert sorted(results) == [('000002', '股票型', True), ('000003', '股票型', True)]
+    assert not fetcher.breaker.is_open
@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+import pytest
+
+import bitable_mirror
+from bitable_mirror import BitableMirror
+from feishu_bitable import iter_records
+
+
+APP_TOKEN = 'app'
+TABLE_ID = 'tbl'
+
+
+def make_record(index):
+    return SimpleNamespace(record_id=f'rec{index}', last_modified_time=1700000000000 + index,
+                           fields={'基金代码': f'{index:06d}', '交易账户': 'A1'})
+
+
+def make_response(items=None, has_more=False, success=True):
+    return SimpleNamespace(
+        success=lambda: success, code=0 if success else 1254000, msg='success' if success else 'WrongRequest',
+        raw=None, data=SimpleNamespace(items=items, has_more=has_more, page_token='next'),
+    )
+
+
+def fake_client(responses):
+    """按顺序返回responses中的分页结果的飞书client"""
+    pages = iter(responses)
+
+    def list_page(request, option):
+        page = next(pages)
+        if isinstance(page, Exception):
+            raise page
+        return page
+
+    return SimpleNamespace(bitable=SimpleNamespace(v1=SimpleNamespace(
+        app_table_record=SimpleNamespace(list=list_page))))
+
+
+def scan(responses, strict):
+    return list(iter_records(fake_client(responses), APP_TOKEN, TABLE_ID, 't-token', strict=strict))
+
+
+@pytest.mark.parametrize('failure', [make_response(success=False), ConnectionError('timeout')])
+def test_iter_records_strict_raises_on_failed_page(failure):
+    responses = [make_response([make_record(1)], has_more=True), failure]
+
+    assert [record.record_id for record in scan(responses, strict=False)] == ['rec1']
+    with pytest.raises(Exception):
+        scan(responses, strict=True)
+
+
+def sync_with(monkeypatch, mirror, records, fail=False, full=False):
+    def fake_iter_records(*args, **kwargs):
+        assert kwargs.get('strict')
+        yield from records
+        if fail:
+            raise Exception('获取记录失败: token expired')
+
+    monkeypatch.setattr(bitable_mirror, 'iter_records', fake_iter_records)
+    return mirror.sync(None, APP_TOKEN, TABLE_ID, 't-token', full=full)
+
+
+def test_sync_keeps_previous_mirror_when_scan_fails(monkeypatch, tmp_path):
+    mirror = BitableMirror(db_path=str(tmp_path / 'mirror.sqlite3'))
+    assert sync_with(monkeypatch, mirror, [make_record(i) for i in range(3)]) == 3
+    state = mirror._get_state(APP_TOKEN, TABLE_ID)
+
+    for full in (True, False):
+        with pytest.raises(Exception):
+            sync_with(monkeypatch, mirror, [make_record(9)], fail=True, full=full)
+        assert sorted(record_id for record_id, _ in mirror.records(APP_TOKEN, TABLE_ID)) == ['rec0', 'rec1', 'rec2']
+        assert mirror._get_state(APP_TOKEN, TABLE_ID) == state
+
+
+def test_iter_records_does_not_hold_lock_between_rows(monkeypatch, tmp_path):
+    monkeypatch.setattr(bitable_mirror, 'SYNC_BATCH_SIZE', 2)
+    mirror = BitableMirror(db_path=str(tmp_path / 'mirror.sqlite3'))
+    sync_with(monkeypatch, mirror, [make_record(i) for i in range(5)])
+
+    record_ids = []
+    for record_id, fields in mirror.iter_records(APP_TOKEN, TABLE_ID):
+        # 循环中再使用镜像不会死锁
+        assert len(mirror.records(APP_TOKEN, TABLE_ID)) == 5
+        record_ids.append(record_id)
+    assert record_ids == [f'rec{i}' for i in range(5)]
+
+    abandoned = mirror.iter_records(APP_TOKEN, TABLE_ID)
+    next(abandoned)
+    assert mirror.lock.acquire(timeout=1)
+    mirror.lock.release()
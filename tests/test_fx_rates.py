@@ -0,0 +1,42 @@
+import math
+
+import pytest
+
+import fx_rates
+from fx_rates import FxRateCache, convert_to_cny
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return FxRateCache(db_path=str(tmp_path / 'fx_rates.sqlite3'))
+
+
+def test_empty_cache_keeps_original_amounts(cache, monkeypatch):
+    def unavailable():
+        raise ConnectionError('akshare unavailable')
+
+    monkeypatch.setattr(fx_rates, 'fetch_rates_from_akshare', unavailable)
+    converted, rates = convert_to_cny(['美元', '人民币'], ['2025/9/10', '2025/9/10'], [100.0, 50.0], cache=cache)
+
+    assert converted.tolist() == [100.0, 50.0]
+    assert math.isnan(rates[0]) and rates[1] == 1.0
+
+
+def test_unknown_currency_with_populated_cache(cache):
+    cache.put_rates([('美元', '2025-09-09', 7.1), ('美元', '2025-09-10', 7.12)], '2025-09-10')
+    converted, rates = convert_to_cny(['新台币', '人民币'], ['2025/9/10', ''], [100.0, 50.0],
+                                      cache=cache, download=False)
+
+    assert converted.tolist() == [100.0, 50.0]
+    assert math.isnan(rates[0]) and rates[1] == 1.0
+
+
+def test_uses_latest_rate_on_or_before_valuation_date(cache):
+    cache.put_rates([('美元', '2025-09-05', 7.1), ('美元', '2025-09-08', 7.12), ('港元', '2025-09-08', 0.91)],
+                    '2025-09-10')
+    converted, rates = convert_to_cny(['美元', 'USD', '港币', '美元现汇'],
+                                      ['2025/9/5', '2025/9/7', '2025/9/9', '2025/9/8'],
+                                      [100.0, 100.0, 100.0, 10.0], cache=cache, download=False)
+
+    assert rates.tolist() == [7.1, 7.1, 0.91, 7.12]
+    assert converted.tolist() == pytest.approx([710.0, 710.0, 91.0, 71.2])
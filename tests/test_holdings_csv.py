@@ -0,0 +1,86 @@
+import importlib
+import os
+
+import pytest
+
+from holdings_csv import read_cleaned_rows
+from record_index import RecordIndex
+from run_journal import RunJournal
+
+
+CSV_TEXT = '''序号,基金代码,基金名称,交易账户,持有份额,资产情况（结算币种）
+1,000071,恒生联接,A1,"26,663.80",42910.05
+2,000575,兴全添利宝,A2,100,100
+,,,,,
+3,013003,坏行,A3,1,1
+打印时间：2025-09-10,,,,,
+'''
+
+
+def write_csv(tmp_path):
+    path = tmp_path / 'holdings.csv'
+    path.write_text(CSV_TEXT, encoding='utf-8')
+    return str(path)
+
+
+def test_read_cleaned_rows(tmp_path):
+    rows = list(read_cleaned_rows(write_csv(tmp_path)))
+
+    assert [(row_index, record_key) for row_index, record_key, _ in rows] == \
+        [(1, '000071_A1'), (2, '000575_A2'), (4, '013003_A3')]
+    assert rows[0][2] == {'序号': 1.0, '基金代码': '000071', '基金名称': '恒生联接', '交易账户': 'A1',
+                          '持有份额': 26663.8, '资产情况': 42910.05}
+
+
+# 第2行字段多了一个，第4行字段不足（缺少资产情况），第3行是空行
+MALFORMED_CSV_TEXT = '''序号,基金代码,基金名称,交易账户,持有份额,资产情况（结算币种）
+1,000071,恒生联接,A1,100,42910.05
+2,000575,兴全添利宝,A2,100,100,多余的字段
+
+4,013003,短行,A3,1
+5,000001,正常,A5,1,1
+'''
+
+
+def write_malformed_csv(tmp_path):
+    path = tmp_path / 'malformed.csv'
+    path.write_text(MALFORMED_CSV_TEXT, encoding='utf-8')
+    return str(path)
+
+
+def test_malformed_line_is_reported_and_row_numbers_are_kept(tmp_path):
+    failed = []
+    rows = list(read_cleaned_rows(write_malformed_csv(tmp_path),
+                                  on_error=lambda row_index, e: failed.append(row_index)))
+
+    assert failed == [2]
+    assert [(row_index, record_key) for row_index, record_key, _ in rows] == \
+        [(1, '000071_A1'), (4, '013003_A3'), (5, '000001_A5')]
+    assert rows[1][2]['资产情况'] == 0.0
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_import_counts_malformed_line_and_keeps_journal(tmp_path, monkeypatch, stream):
+    importer = importlib.import_module('import')
+    journal_path = str(tmp_path / 'journal' / 'import.jsonl')
+    written = []
+
+    def fake_write(client, app_token, table_id, creates, updates, tenant_access_token, on_written):
+        for row_index, fields in creates:
+            written.append((row_index, fields['基金代码']))
+            on_written(row_index)
+        return len(creates), 0, 0
+
+    monkeypatch.setattr(importer, 'create_client', lambda: None)
+    monkeypatch.setattr(importer, 'load_record_index', lambda *args, **kwargs: RecordIndex())
+    monkeypatch.setattr(importer, 'batch_upsert_records', fake_write)
+    monkeypatch.setattr(importer, 'open_journal', lambda *args, resume=False: RunJournal(journal_path, resume=resume))
+
+    success_count, error_count, create_count, _, _ = importer.import_csv_to_feishu(
+        'app', 'tbl', write_malformed_csv(tmp_path), 't-token', stream=stream)
+
+    assert (success_count, error_count, create_count) == (3, 1, 3)
+    assert written == [(1, '000071'), (4, '013003'), (5, '000001')]
+    # 有失败的行，进度日志保留，--resume时只处理剩下的行
+    assert os.path.exists(journal_path)
+    assert set(RunJournal(journal_path, resume=True).completed) == {'000071_A1', '013003_A3', '000001_A5'}
@@ -0,0 +1,59 @@
+from feishu_bitable import diff_digest_fields, diff_record_fields, record_digest
+from holdings_csv import NUMERIC_FIELDS
+
+
+FIELD_NAMES = ['基金代码', '交易账户', '基金名称', '持有份额', '资产情况', '基金类型', '标签1', '标签2']
+
+EXISTING = {
+    '基金代码': '000071',
+    '交易账户': 'A1',
+    '基金名称': [{'type': 'text', 'text': '恒生联接'}],
+    '持有份额': 26663.8,
+    '资产情况': 42910.05,
+    '基金类型': 'QDII-股票',
+    '标签1': '恒生',
+}
+
+ROW = {
+    '基金代码': '000071',
+    '交易账户': 'A1',
+    '基金名称': '恒生联接',
+    '持有份额': '26663.80',
+    '资产情况': 42910.05,
+    '基金类型': 'QDII-股票',
+    '标签1': '恒生',
+    '标签2': '',
+}
+
+
+def check(row):
+    existing_digest = record_digest(EXISTING, FIELD_NAMES, NUMERIC_FIELDS)
+    expected = diff_record_fields(row, EXISTING, NUMERIC_FIELDS)
+    assert diff_digest_fields(row, existing_digest, FIELD_NAMES, NUMERIC_FIELDS) == expected
+    assert (record_digest(row, FIELD_NAMES, NUMERIC_FIELDS) == existing_digest) == (not expected)
+    return expected
+
+
+def test_identical_row_after_normalisation():
+    assert check(ROW) == {}
+
+
+def test_only_changed_fields_are_returned():
+    assert check({**ROW, '资产情况': 43000.0, '标签2': '港股'}) == {'资产情况': 43000.0, '标签2': '港股'}
+
+
+def test_blank_csv_cell_is_a_change():
+    assert check({**ROW, '基金类型': ''}) == {'基金类型': ''}
+
+
+def test_numeric_values_with_equal_builtin_hash_are_a_change():
+    # CPython中hash(-1.0) == hash(-2.0)
+    assert check({**ROW, '持有份额': -1.0}) == {'持有份额': -1.0}
+    existing_digest = record_digest({**EXISTING, '持有份额': -1.0}, FIELD_NAMES, NUMERIC_FIELDS)
+    assert diff_digest_fields({**ROW, '持有份额': -2.0}, existing_digest, FIELD_NAMES, NUMERIC_FIELDS) == \
+        {'持有份额': -2.0}
+
+
+def test_negative_zero_is_unchanged():
+    existing_digest = record_digest({**EXISTING, '持有份额': 0.0}, FIELD_NAMES, NUMERIC_FIELDS)
+    assert diff_digest_fields({**ROW, '持有份额': -0.0}, existing_digest, FIELD_NAMES, NUMERIC_FIELDS) == {}
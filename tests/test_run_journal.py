@@ -0,0 +1,33 @@
+from run_journal import RunJournal, read_journal_entries
+
+
+def test_resume_skips_completed_items(tmp_path):
+    path = str(tmp_path / 'journal' / 'import.jsonl')
+    journal = RunJournal(path)
+    journal.mark_done('000071_A1')
+    journal.mark_done('000575_A2', {'type': '货币型'})
+    journal.close()
+    # 中断时写了一半的最后一行
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"key": "013003_A3"')
+
+    resumed = RunJournal(path, resume=True)
+    assert resumed.is_done('000071_A1') and resumed.is_done('000575_A2')
+    assert not resumed.is_done('013003_A3')
+    assert resumed.get('000575_A2') == {'type': '货币型'}
+    resumed.mark_done('013003_A3')
+    resumed.close()
+    assert set(read_journal_entries(path)) == {'000071_A1', '000575_A2', '013003_A3'}
+
+    fresh = RunJournal(path)
+    assert len(fresh) == 0
+    fresh.close()
+
+
+def test_completed_run_removes_journal(tmp_path):
+    path = str(tmp_path / 'import.jsonl')
+    journal = RunJournal(path)
+    journal.mark_done('000071_A1')
+    journal.close(completed=True)
+
+    assert read_journal_entries(path) == {}
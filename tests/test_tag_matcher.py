@@ -0,0 +1,111 @@
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from add_fund_tags_local import compute_tags
+from conftest import REPO_DIR
+from tag_matcher import TagMatcher, get_tag_matcher, load_compiled_tag_library
+
+
+# 改用Aho-Corasick自动机之前的逐个标签子串匹配，作为对照
+def reference_match_tags_from_fund_name(fund_name, tag_library):
+    if not fund_name or not tag_library:
+        return [], []
+
+    matched_tags = []
+    matched_categories = []
+    all_matches = []
+    for category, tags in tag_library.items():
+        for tag in tags:
+            if tag in fund_name:
+                all_matches.append((tag, category, len(tag)))
+    all_matches.sort(key=lambda x: x[2], reverse=True)
+
+    used_positions = set()
+    for tag, category, length in all_matches:
+        start_pos = fund_name.find(tag)
+        if start_pos != -1:
+            tag_positions = set(range(start_pos, start_pos + length))
+            if not tag_positions.intersection(used_positions):
+                if tag not in matched_tags:
+                    matched_tags.append(tag)
+                    matched_categories.append(category)
+                    used_positions.update(tag_positions)
+                    if len(matched_tags) >= 2:
+                        break
+
+    while len(matched_tags) < 2:
+        matched_tags.append("")
+    return matched_tags[:2], matched_categories[:2]
+
+
+REFERENCE_STOCK_TYPES = [
+    'QDII-股票', 'QDII-债券', '商品型-非QDII', '混合型-偏股', '股票型-标准指数',
+    '股票型-增强指数', '混合型-灵活配置', '混合型-偏债', '混合型-股债平衡', '股票型-普通'
+]
+REFERENCE_MONEY_TYPES = ['货币型']
+REFERENCE_BOND_TYPES = ['债券型-中短债', '债券型-长期纯债', '债券型-短期纯债', '债券型-债券指数', '债券型-普通债券']
+REFERENCE_TYPE_TO_TAG = {
+    'QDII-股票': '股票', 'QDII-债券': '债券', '商品型-非QDII': '商品', '混合型-偏股': '偏股',
+    '股票型-标准指数': '指数', '股票型-增强指数': '指数', '混合型-灵活配置': '灵活', '混合型-偏债': '偏债',
+    '混合型-股债平衡': '平衡', '股票型-普通': '股票',
+}
+
+
+def reference_match_tags_by_fund_type(fund_type, fund_name, tag_library):
+    if not fund_type:
+        return reference_match_tags_from_fund_name(fund_name, tag_library)
+    if fund_type in REFERENCE_MONEY_TYPES:
+        return ['货币', ''], ['货币', '']
+    if fund_type in REFERENCE_BOND_TYPES:
+        return ['债券', ''], ['债券', '']
+    if fund_type in REFERENCE_STOCK_TYPES:
+        matched_tags, matched_categories = reference_match_tags_from_fund_name(fund_name, tag_library)
+        if matched_tags[0]:
+            return matched_tags, matched_categories
+        type_tag = REFERENCE_TYPE_TO_TAG.get(fund_type, '')
+        return ([type_tag, ''], [fund_type, '']) if type_tag else (['', ''], ['', ''])
+    return reference_match_tags_from_fund_name(fund_name, tag_library)
+
+
+@pytest.fixture(scope='module')
+def tag_library():
+    return load_compiled_tag_library(os.path.join(REPO_DIR, 'config.md')).tag_library
+
+
+@pytest.fixture(scope='module')
+def holdings():
+    return pd.read_csv(os.path.join(REPO_DIR, 'test.csv'), dtype=str, keep_default_na=False, encoding='utf-8-sig')
+
+
+def test_matcher_agrees_with_substring_matching(tag_library, holdings):
+    matcher = TagMatcher(tag_library)
+    rng = random.Random(0)
+    tags = [tag for tags in tag_library.values() for tag in tags]
+    filler = list('基金指数联接发起式混合ETFA类C类') + tags
+    random_names = [''.join(rng.choice(filler) for _ in range(rng.randint(1, 8))) for _ in range(5000)]
+
+    for fund_name in holdings['基金名称'].tolist() + random_names:
+        assert matcher.match(fund_name) == reference_match_tags_from_fund_name(fund_name, tag_library), fund_name
+
+
+def test_compute_tags_matches_row_by_row_tagging(tag_library, holdings):
+    df = holdings.assign(标签1='', 标签2='')
+    tag1, tag2, pending = compute_tags(df, '基金名称', '基金类型', tag_library)
+
+    assert pending.all()
+    for fund_name, fund_type, new_tag1, new_tag2 in zip(df['基金名称'], df['基金类型'], tag1, tag2):
+        expected, _ = reference_match_tags_by_fund_type(fund_type.strip(), fund_name.strip(), tag_library)
+        assert [new_tag1, new_tag2] == expected, fund_name
+
+
+def test_get_tag_matcher_from_threads_builds_one_matcher(tag_library):
+    library_copy = {category: list(tags) for category, tags in tag_library.items()}
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        matchers = list(pool.map(get_tag_matcher, [tag_library] * 8 + [library_copy] * 8))
+
+    assert all(matcher is load_compiled_tag_library(os.path.join(REPO_DIR, 'config.md')) for matcher in matchers[:8])
+    assert len({id(matcher) for matcher in matchers[8:]}) == 1
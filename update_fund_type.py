@@ -1,110 +1,58 @@
+import argparse
 import json
-import time
-import lark_oapi as lark
-from lark_oapi.api.bitable.v1 import *
-import akshare as ak
-from config_loader import get_feishu_config
+from concurrent.futures import CancelledError
+from config_loader import load_config, prefetch_feishu_config, wait_for_tenant_access_token
+from feishu_bitable import build_filter_formula, create_client, iter_records, preload_feishu_sdk, write_and_record
+from feishu_executor import get_executor
+from akshare_fetcher import get_akshare_fetcher
+from fund_cache import get_fund_universe_index, normalize_fund_code
+from record_index import RecordRef
+from run_journal import open_journal
+from work_scheduler import get_deadline, get_priority, order_groups
+from metrics import configure_logging, get_logger, get_metrics, write_run_summary
 
 
-def get_fund_type_from_akshare(fund_code):
-    """通过akshare获取基金类型信息"""
-    try:
-        # 标准化基金代码：去除空格，补零至6位
-        normalized_code = str(fund_code).strip()
-        
-        # 验证基金代码是否为纯数字
-        if not normalized_code.isdigit():
-            print(f"⚠️  基金代码格式错误: {fund_code}，应为数字")
-            return "代码格式错误"
-        
-        # 补零至6位
-        normalized_code = normalized_code.zfill(6)
-        print(f"   📝 基金代码标准化: {fund_code} -> {normalized_code}")
-        
-        # 调用akshare API获取基金基本信息
-        fund_info_df = ak.fund_individual_basic_info_xq(symbol=normalized_code)
-        
-        if not fund_info_df.empty:
-            # 查找基金类型字段
-            fund_type_row = fund_info_df[fund_info_df['item'] == '基金类型']
-            
-            if not fund_type_row.empty:
-                fund_type = fund_type_row['value'].iloc[0]
-                return str(fund_type)
-            
-            # 如果没有找到"基金类型"字段，尝试其他可能的字段名
-            possible_type_fields = ['类型', 'fund_type', '投资类型']
-            for field in possible_type_fields:
-                type_row = fund_info_df[fund_info_df['item'] == field]
-                if not type_row.empty:
-                    fund_type = type_row['value'].iloc[0]
-                    return str(fund_type)
-        
-        return "未知"
-    except KeyError as e:
-        print(f"⚠️  基金代码 {fund_code} 可能不存在或API返回格式异常: {str(e)}")
-        return "基金不存在"
-    except Exception as e:
-        print(f"⚠️  获取基金代码 {fund_code} 的类型信息失败: {str(e)}")
-        return "获取失败"
+logger = get_logger(__name__)
+
 
+# 需要（重新）获取基金类型的取值
+RETRY_FUND_TYPES = ['', '未知', '获取失败']
 
-def get_all_records(client, app_token, table_id, tenant_access_token):
-    """获取飞书表格中的所有记录"""
-    print("📋 正在获取飞书表格中的所有记录...")
+
+def get_all_records(client, app_token, table_id, tenant_access_token, pending_only=True):
+    """获取飞书表格中的记录
     
-    all_records = []
-    page_token = None
+    pending_only为True时由服务端筛选出基金类型为空、未知或获取失败的记录，
+    并且只返回需要用到的字段（资产情况用于安排查询顺序）；每条记录以紧凑的RecordRef保存
+    """
+    logger.info("📋 正在获取飞书表格中的所有记录...")
     
-    while True:
-        try:
-            # 构建查询请求
-            request_builder = ListAppTableRecordRequest.builder() \
-                .app_token(app_token) \
-                .table_id(table_id) \
-                .page_size(500)  # 每页最多500条记录
-            
-            if page_token:
-                request_builder.page_token(page_token)
-            
-            request = request_builder.build()
-            option = lark.RequestOption.builder().tenant_access_token(tenant_access_token).build()
-            response = client.bitable.v1.app_table_record.list(request, option)
-            
-            if not response.success():
-                print(f"❌ 获取记录失败: {response.msg}")
-                break
-            
-            # 处理返回的记录
-            if response.data and response.data.items:
-                for record in response.data.items:
-                    fields = record.fields if record.fields else {}
-                    fund_code = fields.get('基金代码', '')
-                    
-                    if fund_code:  # 只处理有基金代码的记录
-                        all_records.append({
-                            'record_id': record.record_id,
-                            'fund_code': str(fund_code),
-                            'fields': fields
-                        })
-            
-            # 检查是否还有更多页
-            if not response.data.has_more:
-                break
-            
-            page_token = response.data.page_token
-            time.sleep(0.1)  # 避免API限制
-            
-        except Exception as e:
-            print(f"❌ 获取记录时出错: {str(e)}")
-            break
+    filter_formula = None
+    field_names = None
+    if pending_only:
+        filter_formula = build_filter_formula('基金类型', RETRY_FUND_TYPES)
+        field_names = ['基金代码', '基金类型', '资产情况']
+    
+    all_records = []
+    for record in iter_records(client, app_token, table_id, tenant_access_token, filter_formula, field_names):
+        record = RecordRef.from_fields(record.record_id, record.fields or {})
+        if record.fund_code:  # 只处理有基金代码的记录
+            all_records.append(record)
     
-    print(f"📋 已获取 {len(all_records)} 条有效记录")
+    logger.info(f"📋 已获取 {len(all_records)} 条有效记录")
     return all_records
 
 
+def describe_pending_record(record):
+    """排序用：(资产情况, 是否从未补全过, 是否卡在获取失败)"""
+    return record.asset_value, not record.fund_type, record.fund_type == '获取失败'
+
+
 def update_record_with_fund_type(client, app_token, table_id, record_id, fund_type, tenant_access_token):
     """更新记录，添加基金类型字段"""
+    import lark_oapi as lark
+    from lark_oapi.api.bitable.v1 import AppTableRecord, UpdateAppTableRecordRequest
+    
     try:
         # 构建更新字段
         update_fields = {
@@ -121,7 +69,8 @@ def update_record_with_fund_type(client, app_token, table_id, record_id, fund_ty
             .build()
         
         option = lark.RequestOption.builder().tenant_access_token(tenant_access_token).build()
-        response = client.bitable.v1.app_table_record.update(request, option)
+        response = get_executor().call(app_token, lambda: client.bitable.v1.app_table_record.update(request, option),
+                                       stage='write')
         
         return response.success(), response.msg
     except Exception as e:
@@ -130,6 +79,9 @@ def update_record_with_fund_type(client, app_token, table_id, record_id, fund_ty
 
 def add_fund_type_column(client, app_token, table_id, tenant_access_token):
     """添加基金类型列到表格（如果不存在）"""
+    import lark_oapi as lark
+    from lark_oapi.api.bitable.v1 import AppTableField, CreateAppTableFieldRequest, ListAppTableFieldRequest
+    
     try:
         # 首先获取表格字段信息
         request = ListAppTableFieldRequest.builder() \
@@ -144,7 +96,7 @@ def add_fund_type_column(client, app_token, table_id, tenant_access_token):
             # 检查是否已存在基金类型字段
             existing_fields = [field.field_name for field in response.data.items]
             if '基金类型' in existing_fields:
-                print("✅ 基金类型列已存在")
+                logger.info("✅ 基金类型列已存在")
                 return True, "字段已存在"
         
         # 创建基金类型字段
@@ -160,110 +112,173 @@ def add_fund_type_column(client, app_token, table_id, tenant_access_token):
         field_response = client.bitable.v1.app_table_field.create(field_request, option)
         
         if field_response.success():
-            print("✅ 成功创建基金类型列")
+            logger.info("✅ 成功创建基金类型列")
             return True, "字段创建成功"
         else:
-            print(f"❌ 创建基金类型列失败: {field_response.msg}")
+            logger.error(f"❌ 创建基金类型列失败: {field_response.msg}")
             return False, field_response.msg
             
     except Exception as e:
-        print(f"❌ 添加基金类型列时出错: {str(e)}")
+        logger.error(f"❌ 添加基金类型列时出错: {str(e)}")
         return False, str(e)
 
 
-def update_fund_types(app_token, table_id, tenant_access_token):
-    """主要逻辑：获取基金代码并更新基金类型"""
+def update_fund_types(app_token, table_id, tenant_access_token, bulk_mode=True, resume=False, priority=None,
+                      time_budget=None):
+    """主要逻辑：获取基金代码并更新基金类型
+    
+    bulk_mode为True时先用当天的全市场基金列表分类，未收录的代码再逐个查询；
+    每条记录写入后记入进度日志，resume为True时跳过上次已写入的记录（包括写入了"获取失败"的记录）；
+    基金代码按priority排序（见work_scheduler.PRIORITIES），time_budget秒用完后不再查询和写入，剩余的留待下次运行
+    """
     # 创建client
-    client = lark.Client.builder() \
-        .enable_set_token(True) \
-        .log_level(lark.LogLevel.INFO) \
-        .build()
+    client = create_client()
     
     success_count = 0
     error_count = 0
+    executor = get_executor()
+    pending_updates = []
     
-    print(f"开始更新基金类型信息")
-    print(f"目标数据表ID: {table_id}")
+    logger.info("开始更新基金类型信息")
+    logger.info(f"目标数据表ID: {table_id}")
     
     # 添加基金类型列（如果不存在）
     column_success, column_msg = add_fund_type_column(client, app_token, table_id, tenant_access_token)
     if not column_success:
-        print(f"❌ 无法添加基金类型列: {column_msg}")
+        logger.error(f"❌ 无法添加基金类型列: {column_msg}")
         return
     
     # 获取所有记录
-    all_records = get_all_records(client, app_token, table_id, tenant_access_token)
+    with get_metrics().timer('stage_load_records'):
+        all_records = get_all_records(client, app_token, table_id, tenant_access_token)
     
+    # 服务端已筛选出待处理的记录，没有记录说明都已完成（读取失败时iter_records已记录错误）
     if not all_records:
-        print("❌ 没有找到任何记录")
-        return
+        logger.info("✅ 没有需要更新基金类型的记录")
+        return 0, 0
     
-    print(f"\n🔄 开始处理 {len(all_records)} 条记录...")
+    logger.info(f"\n🔄 开始处理 {len(all_records)} 条记录...")
     
-    for index, record in enumerate(all_records, 1):
-        try:
-            fund_code = record['fund_code']
-            record_id = record['record_id']
-            
-            print(f"\n📊 处理第 {index}/{len(all_records)} 条记录")
-            print(f"   基金代码: {fund_code}")
-            
-            # 检查是否已有基金类型信息
-            existing_fund_type = record['fields'].get('基金类型', '')
-            if existing_fund_type and existing_fund_type not in ['', '未知', '获取失败']:
-                print(f"   ⏭️  已有基金类型: {existing_fund_type}，跳过")
-                continue
-            
-            # 获取基金类型信息
-            print(f"   🔍 正在获取基金类型信息...")
-            fund_type = get_fund_type_from_akshare(fund_code)
-            print(f"   📋 获取到基金类型: {fund_type}")
-            
-            # 更新记录
-            success, msg = update_record_with_fund_type(client, app_token, table_id, record_id, fund_type, tenant_access_token)
+    journal = open_journal('update_fund_type', app_token, table_id, resume=resume)
+    deadline = get_deadline(time_budget)
+    on_written = lambda record_id: journal.mark_done(record_id)
+    interrupted = False
+    
+    # 同一基金在不同销售机构/账户下会重复出现，先按标准化代码分组
+    code_to_records = {}
+    skip_count = 0
+    resumed_count = 0
+    for record in all_records:
+        if journal.is_done(record.record_id):
+            resumed_count += 1
+            continue
+        
+        # 检查是否已有基金类型信息
+        if record.fund_type not in RETRY_FUND_TYPES:
+            skip_count += 1
+            continue
+        
+        code_key = normalize_fund_code(record.fund_code) or record.fund_code
+        code_to_records.setdefault(code_key, []).append(record)
+    
+    # 重要的基金排在前面，时间预算不够时先完成它们
+    code_to_records = order_groups(code_to_records, describe_pending_record, get_priority(priority))
+    
+    pending_count = sum(len(records) for records in code_to_records.values())
+    logger.info(f"⏭️  已有基金类型跳过: {skip_count} 条记录")
+    if resumed_count:
+        logger.info(f"♻️  断点续传跳过: {resumed_count} 条记录")
+    logger.info(f"📋 需要更新 {pending_count} 条记录，去重后共 {len(code_to_records)} 个基金代码")
+    
+    # 批量模式：全市场基金列表每天只下载一次，之后每只基金都是字典查询
+    universe_index = get_fund_universe_index() if bulk_mode and code_to_records else None
+    
+    fetch_count = 0
+    cache_hit_count = 0
+    fetcher = get_akshare_fetcher()
+    index = 0
+    
+    # 未命中缓存的代码由查询器并发获取，按完成顺序返回，每个代码只查询一次
+    try:
+        for index, (fund_code, fund_type, from_network) in enumerate(
+                fetcher.lookup_all(code_to_records, universe_index=universe_index, deadline=deadline), 1):
+            records = code_to_records[fund_code]
+            logger.debug(f"\n📊 第 {index}/{len(code_to_records)} 个基金代码: {fund_code} ({len(records)} 条记录)")
+            logger.debug(f"   📋 获取到基金类型: {fund_type}{'' if from_network else ' (缓存)'}")
             
-            if success:
-                print(f"   ✅ 成功更新基金类型: {fund_type}")
-                success_count += 1
+            if from_network:
+                fetch_count += 1
+                cache_hit_count += len(records) - 1
             else:
-                print(f"   ❌ 更新失败: {msg}")
-                error_count += 1
+                cache_hit_count += len(records)
             
-            # 添加延迟避免API限制
-            time.sleep(1)  # akshare API需要更长的延迟
-                
-        except KeyboardInterrupt:
-            print(f"\n⚠️  用户中断操作，已处理 {index-1} 条记录")
-            break
-        except Exception as e:
-            print(f"   ❌ 处理记录时出错: {str(e)}")
-            error_count += 1
+            # 提交到共享执行器异步更新所有对应记录，不阻塞后续的akshare查询
+            for record in records:
+                future = executor.submit(write_and_record, on_written, [record.record_id],
+                                         update_record_with_fund_type, client, app_token, table_id,
+                                         record.record_id, fund_type, tenant_access_token)
+                pending_updates.append((fund_code, fund_type, future))
+                deadline.watch([(future, 1)])
+    except KeyboardInterrupt:
+        logger.warning(f"\n⚠️  用户中断操作，已处理 {index} 个基金代码")
+        interrupted = True
+    
+    if fetcher.breaker.is_open:
+        logger.warning(f"⚠️  akshare不可用，剩余 {len(code_to_records) - index} 个基金代码留待下次运行")
+        interrupted = True
+    elif deadline.expired and index < len(code_to_records) and not interrupted:
+        logger.warning(f"⏰ 时间预算已用完，剩余 {len(code_to_records) - index} 个基金代码留待下次运行")
+        interrupted = True
+    
+    # 等待所有飞书更新完成，时间预算用完后取消尚未开始的写入
+    for fund_code, fund_type, future in pending_updates:
+        try:
+            success, msg = future.result()
+        except CancelledError:
             continue
+        if success:
+            logger.debug(f"   ✅ 成功更新基金类型: {fund_code} -> {fund_type}")
+            success_count += 1
+        else:
+            logger.error(f"   ❌ 更新失败 ({fund_code}): {msg}")
+            error_count += 1
+    if deadline.deferred:
+        logger.warning(f"⏰ 时间预算已用完，{deadline.deferred} 条记录的写入已取消，留待下次运行")
+        interrupted = True
     
-    print(f"\n📊 更新完成！")
-    print(f"✅ 成功更新: {success_count} 条记录")
-    print(f"❌ 失败: {error_count} 条记录")
+    journal.close(completed=not interrupted and error_count == 0)
+    if interrupted or error_count:
+        logger.info("♻️  重新运行时加上 --resume 可跳过已写入的记录")
+    
+    logger.info("\n📊 更新完成！")
+    logger.info(f"✅ 成功更新: {success_count} 条记录")
+    logger.info(f"❌ 失败: {error_count} 条记录")
+    logger.info(f"🌐 akshare查询: {fetch_count} 次")
+    logger.info(f"💾 缓存命中: {cache_hit_count} 条记录")
     return success_count, error_count
 
 
-def main():
-    """主函数"""
+def main(resume=False):
+    """主函数，resume为True时跳过上次中断前已完成的工作"""
     print("=== 飞书表格基金类型更新工具 ===")
     print("💡 根据基金代码自动获取并更新基金类型信息")
     
     try:
+        # 飞书SDK和tenant_access_token都在后台准备，与下面的交互提示同时进行
+        preload_feishu_sdk()
+        
         # 从配置文件加载默认值
         try:
-            config = get_feishu_config()
+            config = load_config()
             default_app_token = config['app_token']
-            default_tenant_access_token = config['tenant_access_token']
             default_table_id = config['table_id']
+            config_future = prefetch_feishu_config()
         except Exception as e:
             print(f"⚠️  加载配置文件失败: {str(e)}")
             print("将使用手动输入模式")
             default_app_token = ""
-            default_tenant_access_token = ""
             default_table_id = ""
+            config_future = None
         
         # 获取用户输入
         app_token = input(f"请输入App Token (回车使用配置文件默认值): ").strip()
@@ -286,8 +301,7 @@ def main():
         
         tenant_access_token = input(f"请输入Tenant Access Token (回车使用配置文件默认值): ").strip()
         if not tenant_access_token:
-            tenant_access_token = default_tenant_access_token
-            if tenant_access_token:
+            if config_future is not None:
                 print(f"使用配置文件Tenant Access Token")
             else:
                 print("❌ 错误: Tenant Access Token不能为空")
@@ -299,6 +313,11 @@ def main():
         print(f"   - 将基金类型信息更新到表格的'基金类型'列")
         print(f"   - 如果记录已有基金类型信息，则跳过")
         
+        # 选择查询模式
+        bulk_input = input("\n是否使用全市场基金列表批量分类（未收录的基金再逐个查询）？(Y/n): ").strip().lower()
+        bulk_mode = bulk_input not in ['n', 'no']
+        print(f"查询模式: {'全市场批量分类' if bulk_mode else '逐个查询'}")
+        
         # 确认更新
         confirm = input("\n确认开始更新吗？(y/N): ").strip().lower()
         if confirm not in ['y', 'yes']:
@@ -308,8 +327,15 @@ def main():
         print("\n⚠️  提示: 更新过程中可以按 Ctrl+C 中断操作")
         print("⚠️  注意: akshare API调用较慢，请耐心等待")
         
+        # 使用配置文件的token时，到这里才等待后台获取完成
+        if not tenant_access_token:
+            tenant_access_token = wait_for_tenant_access_token(config_future)
+            if not tenant_access_token:
+                print("❌ 错误: Tenant Access Token不能为空")
+                return
+        
         # 执行更新
-        update_fund_types(app_token, table_id, tenant_access_token)
+        update_fund_types(app_token, table_id, tenant_access_token, bulk_mode, resume=resume)
         
     except KeyboardInterrupt:
         print("\n⚠️  用户中断操作")
@@ -318,4 +344,12 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='飞书表格基金类型更新工具')
+    parser.add_argument('--resume', action='store_true', help='跳过上次中断前已完成的工作')
+    args = parser.parse_args()
+    
+    configure_logging()
+    try:
+        main(resume=args.resume)
+    finally:
+        write_run_summary('update_fund_type')
@@ -1,68 +1,36 @@
-import pandas as pd
-import time
-import akshare as ak
+import argparse
 import os
+from config_loader import get_setting
+from akshare_fetcher import get_akshare_fetcher
+from fund_cache import FAILED_FUND_TYPES, get_fund_universe_index, normalize_fund_code
+from holdings_csv import clean_numeric_value
+from run_journal import DEFAULT_CHECKPOINT_EVERY, file_fingerprint, get_checkpoint_path, open_journal, write_checkpoint
+from work_scheduler import get_deadline, get_priority, order_groups
+from metrics import configure_logging, get_logger, get_metrics, write_run_summary
 
 
-def get_fund_type_from_akshare(fund_code):
-    """通过akshare获取基金类型信息"""
-    try:
-        # 标准化基金代码：去除空格，补零至6位
-        normalized_code = str(fund_code).strip()
-        
-        # 验证基金代码是否为纯数字
-        if not normalized_code.isdigit():
-            print(f"⚠️  基金代码格式错误: {fund_code}，应为数字")
-            return "代码格式错误"
-        
-        # 补零至6位
-        normalized_code = normalized_code.zfill(6)
-        print(f"   📝 基金代码标准化: {fund_code} -> {normalized_code}")
-        
-        # 调用akshare API获取基金基本信息
-        fund_info_df = ak.fund_individual_basic_info_xq(symbol=normalized_code)
-        
-        if not fund_info_df.empty:
-            # 查找基金类型字段
-            fund_type_row = fund_info_df[fund_info_df['item'] == '基金类型']
-            
-            if not fund_type_row.empty:
-                fund_type = fund_type_row['value'].iloc[0]
-                return str(fund_type)
-            
-            # 如果没有找到"基金类型"字段，尝试其他可能的字段名
-            possible_type_fields = ['类型', 'fund_type', '投资类型']
-            for field in possible_type_fields:
-                type_row = fund_info_df[fund_info_df['item'] == field]
-                if not type_row.empty:
-                    fund_type = type_row['value'].iloc[0]
-                    return str(fund_type)
-        
-        return "未知"
-    except KeyError as e:
-        print(f"⚠️  基金代码 {fund_code} 可能不存在或API返回格式异常: {str(e)}")
-        return "基金不存在"
-    except Exception as e:
-        print(f"⚠️  获取基金代码 {fund_code} 的类型信息失败: {str(e)}")
-        return "获取失败"
+logger = get_logger(__name__)
 
 
 def load_csv_file(file_path):
     """加载CSV文件"""
+    import pandas as pd
+    
     try:
         if not os.path.exists(file_path):
-            print(f"❌ 文件不存在: {file_path}")
+            logger.error(f"❌ 文件不存在: {file_path}")
             return None
         
         # 读取CSV文件
-        df = pd.read_csv(file_path)
-        print(f"✅ 成功加载CSV文件: {file_path}")
-        print(f"📊 共有 {len(df)} 条记录")
-        print(f"📋 列名: {list(df.columns)}")
+        with get_metrics().timer('csv_parse'):
+            df = pd.read_csv(file_path)
+        logger.info(f"✅ 成功加载CSV文件: {file_path}")
+        logger.info(f"📊 共有 {len(df)} 条记录")
+        logger.info(f"📋 列名: {list(df.columns)}")
         
         return df
     except Exception as e:
-        print(f"❌ 加载CSV文件失败: {str(e)}")
+        logger.error(f"❌ 加载CSV文件失败: {str(e)}")
         return None
 
 
@@ -74,23 +42,36 @@ def save_csv_file(df, file_path):
         if os.path.exists(file_path):
             import shutil
             shutil.copy2(file_path, backup_path)
-            print(f"📋 已创建备份文件: {backup_path}")
+            logger.info(f"📋 已创建备份文件: {backup_path}")
         
         # 保存更新后的文件
         df.to_csv(file_path, index=False, encoding='utf-8-sig')
-        print(f"✅ 成功保存CSV文件: {file_path}")
+        logger.info(f"✅ 成功保存CSV文件: {file_path}")
         return True
     except Exception as e:
-        print(f"❌ 保存CSV文件失败: {str(e)}")
+        logger.error(f"❌ 保存CSV文件失败: {str(e)}")
         return False
 
 
-def update_fund_types_in_csv(file_path):
-    """主要逻辑：读取CSV文件，获取基金代码并更新基金类型"""
+def update_fund_types_in_csv(file_path, bulk_mode=True, resume=False, priority=None, time_budget=None):
+    """主要逻辑：读取CSV文件，获取基金代码并更新基金类型
     
-    # 加载CSV文件
-    df = load_csv_file(file_path)
+    bulk_mode为True时先用当天的全市场基金列表分类，未收录的代码再逐个查询；
+    每个代码的结果记入进度日志，并每隔checkpoint_every个代码原子写入一次检查点文件，
+    进程崩溃后resume为True时从检查点和进度日志继续，不再重复查询；
+    基金代码按priority排序查询（见work_scheduler.PRIORITIES），time_budget秒用完后保存已完成的部分并结束
+    """
+    checkpoint_path = get_checkpoint_path(file_path)
+    journal = open_journal('update_fund_type_local', file_fingerprint(file_path), resume=resume)
+    
+    # 加载CSV文件（续传时优先读取检查点）
+    if resume and os.path.exists(checkpoint_path):
+        logger.info(f"♻️  从检查点恢复: {checkpoint_path}")
+        df = load_csv_file(checkpoint_path)
+    else:
+        df = load_csv_file(file_path)
     if df is None:
+        journal.close()
         return
     
     # 检查是否有基金代码列
@@ -102,90 +83,151 @@ def update_fund_types_in_csv(file_path):
             break
     
     if fund_code_column is None:
-        print(f"❌ 未找到基金代码列，请确保CSV文件包含以下列名之一: {possible_columns}")
+        logger.error(f"❌ 未找到基金代码列，请确保CSV文件包含以下列名之一: {possible_columns}")
+        journal.close()
         return
     
-    print(f"📋 使用基金代码列: {fund_code_column}")
+    logger.info(f"📋 使用基金代码列: {fund_code_column}")
     
     # 添加基金类型列（如果不存在）
     if '基金类型' not in df.columns:
         df['基金类型'] = ''
-        print("✅ 已添加基金类型列")
+        logger.info("✅ 已添加基金类型列")
     else:
-        print("✅ 基金类型列已存在")
+        # 空列会被pandas读成float类型，转为object以便写入文本
+        df['基金类型'] = df['基金类型'].astype(object)
+        logger.info("✅ 基金类型列已存在")
     
     success_count = 0
     error_count = 0
     skip_count = 0
+    fetch_count = 0
+    cache_hit_count = 0
+    resumed_count = 0
+    interrupted = False
+    checkpoint_every = get_setting('checkpoint_every', DEFAULT_CHECKPOINT_EVERY)
     
-    print(f"\n🔄 开始处理 {len(df)} 条记录...")
+    logger.info(f"\n🔄 开始处理 {len(df)} 条记录...")
     
+    # 同一基金在不同销售机构/账户下会重复出现，先按标准化代码分组
+    code_to_indices = {}
     for index, row in df.iterrows():
-        try:
-            fund_code = str(row[fund_code_column]).strip()
-            
-            print(f"\n📊 处理第 {index + 1}/{len(df)} 条记录")
-            print(f"   基金代码: {fund_code}")
-            
-            # 检查基金代码是否为空
-            if not fund_code or fund_code in ['nan', 'NaN', '']:
-                print(f"   ⏭️  基金代码为空，跳过")
-                skip_count += 1
-                continue
-            
-            # 检查是否已有基金类型信息
-            existing_fund_type = str(row.get('基金类型', '')).strip()
-            if existing_fund_type and existing_fund_type not in ['', 'nan', 'NaN', '未知', '获取失败']:
-                print(f"   ⏭️  已有基金类型: {existing_fund_type}，跳过")
-                skip_count += 1
-                continue
-            
-            # 获取基金类型信息
-            print(f"   🔍 正在获取基金类型信息...")
-            fund_type = get_fund_type_from_akshare(fund_code)
-            print(f"   📋 获取到基金类型: {fund_type}")
+        fund_code = str(row[fund_code_column]).strip()
+        
+        # 检查基金代码是否为空
+        if not fund_code or fund_code in ['nan', 'NaN', '']:
+            logger.debug(f"   ⏭️  第 {index + 1} 条记录基金代码为空，跳过")
+            skip_count += 1
+            continue
+        
+        # 检查是否已有基金类型信息
+        existing_fund_type = str(row.get('基金类型', '')).strip()
+        if existing_fund_type and existing_fund_type not in ['', 'nan', 'NaN', '未知', '获取失败']:
+            skip_count += 1
+            continue
+        
+        code_key = normalize_fund_code(fund_code) or fund_code
+        code_to_indices.setdefault(code_key, []).append(index)
+    
+    pending_count = sum(len(indices) for indices in code_to_indices.values())
+    logger.info(f"📋 需要更新 {pending_count} 条记录，去重后共 {len(code_to_indices)} 个基金代码")
+    
+    # 上次运行已处理过的代码直接使用记录的结果
+    for fund_code in [code for code in code_to_indices if journal.is_done(code)]:
+        indices = code_to_indices.pop(fund_code)
+        fund_type = journal.get(fund_code)
+        df.loc[indices, '基金类型'] = fund_type
+        resumed_count += len(indices)
+        if fund_type not in FAILED_FUND_TYPES:
+            success_count += len(indices)
+        else:
+            error_count += len(indices)
+    
+    # 重要的基金排在前面，时间预算不够时先完成它们
+    asset_column = df['资产情况'] if '资产情况' in df.columns else None
+    
+    def describe_index(index):
+        existing_fund_type = str(df.at[index, '基金类型']).strip()
+        asset_value = clean_numeric_value(asset_column.at[index]) if asset_column is not None else 0.0
+        return asset_value, existing_fund_type in ['', 'nan', 'NaN'], existing_fund_type == '获取失败'
+    
+    code_to_indices = order_groups(code_to_indices, describe_index, get_priority(priority))
+    deadline = get_deadline(time_budget)
+    
+    # 批量模式：全市场基金列表每天只下载一次，之后每只基金都是字典查询
+    universe_index = get_fund_universe_index() if bulk_mode and code_to_indices else None
+    fetcher = get_akshare_fetcher()
+    code_index = 0
+    
+    # 未命中缓存的代码由查询器并发获取，按完成顺序返回，每个代码只查询一次
+    try:
+        for code_index, (fund_code, fund_type, from_network) in enumerate(
+                fetcher.lookup_all(code_to_indices, universe_index=universe_index, deadline=deadline), 1):
+            indices = code_to_indices[fund_code]
+            logger.debug(f"\n📊 第 {code_index}/{len(code_to_indices)} 个基金代码: {fund_code} ({len(indices)} 条记录)")
+            logger.debug(f"   📋 获取到基金类型: {fund_type}{'' if from_network else ' (缓存)'}")
             
-            # 更新DataFrame
-            df.at[index, '基金类型'] = fund_type
+            # 将结果回填到所有对应的记录
+            df.loc[indices, '基金类型'] = fund_type
+            journal.mark_done(fund_code, fund_type)
+            if code_index % checkpoint_every == 0:
+                write_checkpoint(df, checkpoint_path)
             
-            if fund_type not in ['未知', '获取失败', '基金不存在', '代码格式错误']:
-                print(f"   ✅ 成功更新基金类型: {fund_type}")
-                success_count += 1
+            if from_network:
+                fetch_count += 1
+                cache_hit_count += len(indices) - 1
             else:
-                print(f"   ⚠️  基金类型获取异常: {fund_type}")
-                error_count += 1
+                cache_hit_count += len(indices)
             
-            # 添加延迟避免API限制
-            time.sleep(1)  # akshare API需要延迟
-                
-        except KeyboardInterrupt:
-            print(f"\n⚠️  用户中断操作，已处理 {index} 条记录")
-            break
-        except Exception as e:
-            print(f"   ❌ 处理记录时出错: {str(e)}")
-            error_count += 1
-            continue
+            if fund_type not in FAILED_FUND_TYPES:
+                success_count += len(indices)
+            else:
+                error_count += len(indices)
+    except KeyboardInterrupt:
+        logger.warning(f"\n⚠️  用户中断操作，已处理 {code_index} 个基金代码")
+        interrupted = True
+    
+    if fetcher.breaker.is_open:
+        logger.warning(f"⚠️  akshare不可用，剩余 {len(code_to_indices) - code_index} 个基金代码留待下次运行")
+        interrupted = True
+    elif deadline.expired and code_index < len(code_to_indices) and not interrupted:
+        logger.warning(f"⏰ 时间预算已用完，剩余 {len(code_to_indices) - code_index} 个基金代码留待下次运行")
+        interrupted = True
     
-    print(f"\n📊 处理完成！")
-    print(f"✅ 成功更新: {success_count} 条记录")
-    print(f"❌ 失败/异常: {error_count} 条记录")
-    print(f"⏭️  跳过: {skip_count} 条记录")
+    logger.info("\n📊 处理完成！")
+    logger.info(f"✅ 成功更新: {success_count} 条记录")
+    logger.info(f"❌ 失败/异常: {error_count} 条记录")
+    logger.info(f"⏭️  跳过: {skip_count} 条记录")
+    logger.info(f"🌐 akshare查询: {fetch_count} 次")
+    logger.info(f"💾 缓存命中: {cache_hit_count} 条记录")
+    if resumed_count:
+        logger.info(f"♻️  断点续传跳过: {resumed_count} 条记录")
     
-    # 保存更新后的文件
+    # 保存更新后的文件（中断时也保存已处理的部分）
+    save_success = True
     if success_count > 0 or error_count > 0:
         save_success = save_csv_file(df, file_path)
         if save_success:
-            print(f"✅ 文件已更新保存")
+            logger.info("✅ 文件已更新保存")
         else:
-            print(f"❌ 文件保存失败")
+            logger.error("❌ 文件保存失败")
+            write_checkpoint(df, checkpoint_path)
+            logger.info(f"♻️  结果已写入检查点 {checkpoint_path}，可用 --resume 继续")
     else:
-        print(f"📋 没有记录需要更新，文件未修改")
+        logger.info("📋 没有记录需要更新，文件未修改")
+    
+    # 结果已写回原文件后，检查点和进度日志都不再需要
+    journal.close(completed=save_success)
+    if save_success and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    if interrupted:
+        logger.info("♻️  已处理的部分已保存，重新运行会从剩余的记录继续")
     
     return success_count, error_count, skip_count
 
 
-def main():
-    """主函数"""
+def main(resume=False):
+    """主函数，resume为True时跳过上次中断前已完成的工作"""
     print("=== 本地CSV文件基金类型更新工具 ===")
     print("💡 根据基金代码自动获取并更新基金类型信息")
     
@@ -215,6 +257,11 @@ def main():
         print(f"   - 如果记录已有基金类型信息，则跳过")
         print(f"   - 自动创建备份文件")
         
+        # 选择查询模式
+        bulk_input = input("\n是否使用全市场基金列表批量分类（未收录的基金再逐个查询）？(Y/n): ").strip().lower()
+        bulk_mode = bulk_input not in ['n', 'no']
+        print(f"查询模式: {'全市场批量分类' if bulk_mode else '逐个查询'}")
+        
         # 确认更新
         confirm = input("\n确认开始更新吗？(y/N): ").strip().lower()
         if confirm not in ['y', 'yes']:
@@ -225,7 +272,7 @@ def main():
         print("⚠️  注意: akshare API调用较慢，请耐心等待")
         
         # 执行更新
-        update_fund_types_in_csv(file_path)
+        update_fund_types_in_csv(file_path, bulk_mode, resume=resume)
         
     except KeyboardInterrupt:
         print("\n⚠️  用户中断操作")
@@ -234,4 +281,12 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='本地CSV文件基金类型更新工具')
+    parser.add_argument('--resume', action='store_true', help='跳过上次中断前已完成的工作')
+    args = parser.parse_args()
+    
+    configure_logging()
+    try:
+        main(resume=args.resume)
+    finally:
+        write_run_summary('update_fund_type_local')
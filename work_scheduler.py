@@ -0,0 +1,118 @@
+import threading
+import time
+from config_loader import get_setting
+from metrics import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# 待处理工作的排序方式：
+# asset  - 资产情况从大到小（同一基金代码按各账户资产合计）
+# failed - 先处理卡在"获取失败"的记录，其余按资产情况
+# new    - 先处理新记录（新导入的行、从未补全过的记录），其余按资产情况
+# none   - 保持表格/文件中的原始顺序
+PRIORITIES = ('asset', 'failed', 'new', 'none')
+DEFAULT_PRIORITY = 'asset'
+
+
+def get_priority(priority=None):
+    """确定排序方式，未指定时取config.json中的schedule_priority，无效的取值退回默认排序"""
+    priority = priority or get_setting('schedule_priority', DEFAULT_PRIORITY)
+    if priority not in PRIORITIES:
+        logger.warning(f"⚠️  未知的排序方式 {priority!r}（可选: {', '.join(PRIORITIES)}），按 {DEFAULT_PRIORITY} 排序")
+        return DEFAULT_PRIORITY
+    return priority
+
+
+def priority_key(priority, asset_value=0.0, is_new=False, is_failed=False):
+    """排序键，越小越先处理"""
+    if priority == 'none':
+        return ()
+    if priority == 'failed':
+        return (not is_failed, -asset_value)
+    if priority == 'new':
+        return (not is_new, -asset_value)
+    return (-asset_value,)
+
+
+def order_records(records, describe, priority):
+    """按优先级排序记录，describe(record)返回(资产情况, 是否新记录, 是否卡在获取失败)；排序稳定"""
+    if priority == 'none':
+        return list(records)
+    return sorted(records, key=lambda record: priority_key(priority, *describe(record)))
+
+
+def order_groups(groups, describe, priority):
+    """按优先级重排{基金代码: [记录, ...]}，整组的资产取合计，组内任一记录是新记录/获取失败即视为整组如此"""
+    if priority == 'none':
+        return groups
+
+    def group_key(item):
+        described = [describe(record) for record in item[1]]
+        return priority_key(priority,
+                            sum(asset_value for asset_value, _, _ in described),
+                            any(is_new for _, is_new, _ in described),
+                            any(is_failed for _, _, is_failed in described))
+
+    return {code: order_records(records, describe, priority)
+            for code, records in sorted(groups.items(), key=group_key)}
+
+
+class Deadline:
+    """墙钟时间预算，从创建时开始计时；seconds为空或0表示不限时
+
+    用完后调用方停止提交新的工作；交给watch的写入到期时仍未开始的会被取消（future.cancelled()为True），
+    取消的条数记在deferred中。没有写入的记录不记入进度日志，下次运行（或--resume）时继续
+    """
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds or None
+        self.expires_at = time.monotonic() + self.seconds if self.seconds else None
+        self.deferred = 0
+        self.watched = []
+        self.timer = None
+        self.lock = threading.Lock()
+
+    @property
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def remaining(self):
+        """剩余秒数，不限时返回None"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def watch(self, futures):
+        """到期时取消其中尚未开始的写入，futures为[(future, 记录条数), ...]
+
+        线程池按提交顺序执行，等待结果的线程总是落后于正在执行的写入，所以由定时器在到期时统一取消
+        """
+        if self.expires_at is None:
+            return
+        with self.lock:
+            self.watched.extend(futures)
+            if self.timer is None:
+                self.timer = threading.Timer(self.remaining(), self.cancel_watched)
+                self.timer.daemon = True
+                self.timer.start()
+        if self.expired:
+            self.cancel_watched()
+
+    def cancel_watched(self):
+        with self.lock:
+            watched, self.watched = self.watched, []
+            for future, count in watched:
+                if future.cancel():
+                    self.deferred += count
+
+
+def get_deadline(seconds=None):
+    """创建时间预算，未指定时取config.json中的time_budget_seconds（默认不限时）"""
+    if seconds is None:
+        seconds = get_setting('time_budget_seconds', None)
+    deadline = Deadline(seconds)
+    if deadline.seconds:
+        logger.info(f"⏰ 时间预算: {deadline.seconds:g} 秒，超出后剩余的工作留待下次运行")
+    return deadline